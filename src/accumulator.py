@@ -0,0 +1,98 @@
+"""
+accumulator.py
+
+Provides the Accumulator class, which keeps the hidden layer of a neural network up to date for a set of sparse inputs
+that changes a little at a time (in the style of NNUE evaluators).
+"""
+
+
+class Accumulator(object):
+    """
+    Class that keeps the weighted sums of the hidden neurons of a neural network for a set of sparse inputs. Moving to
+    a similar set of inputs (e.g. the board after a move) only adds and subtracts the weight rows of the inputs that
+    changed, and evaluating a few extra inputs on top of the current ones (e.g. an action) only adds their rows.
+    """
+
+    def __init__(self, nn):
+        """
+        Construct a new accumulator with no inputs.
+
+        :param nn: The neural network (NN) to accumulate for.
+        """
+
+        self.nn = nn
+
+        # Current inputs as a dictionary: index -> value
+        self.active = {}
+
+        # Weighted sums of the hidden neurons for the current inputs and the weights version they were computed with
+        self.pre_activation = None
+        self.version = None
+
+    def changes_to(self, indices, values):
+        """
+        Find the difference between the current inputs and the given ones.
+
+        :param indices: Indices of the non-zero inputs (as a list).
+        :param values: Values of the non-zero inputs (as a list).
+        :return: A tuple (indices, deltas) with the inputs that need to be added to the current ones to obtain the given
+        inputs.
+        """
+
+        changed_indices = []
+        deltas = []
+        seen = set()
+
+        for i in range(len(indices)):
+            delta = values[i] - self.active.get(indices[i], 0.0)
+            seen.add(indices[i])
+
+            if delta != 0:
+                changed_indices.append(indices[i])
+                deltas.append(delta)
+
+        for index, value in self.active.iteritems():
+            if index not in seen:
+                changed_indices.append(index)
+                deltas.append(-value)
+
+        return changed_indices, deltas
+
+    def refresh(self, indices, values):
+        """
+        Move the accumulator to the given inputs. Only the inputs that changed are applied, unless the weights of the
+        neural network changed since the last time (in which case everything is recomputed).
+
+        :param indices: Indices of the non-zero inputs (as a list).
+        :param values: Values of the non-zero inputs (as a list).
+        """
+
+        if self.pre_activation is None or self.version != self.nn.version:
+            self.pre_activation = self.nn.accumulate(indices, values)
+        else:
+            changed_indices, deltas = self.changes_to(indices, values)
+
+            if len(changed_indices) > 0:
+                self.pre_activation = self.nn.accumulate(changed_indices, deltas, self.pre_activation)
+
+        self.active = dict(zip(indices, values))
+        self.version = self.nn.version
+
+    def evaluate(self, indices=(), values=()):
+        """
+        Get the output of the neural network for the current inputs plus some changes (see Accumulator.changes_to).
+
+        :param indices: Indices of the inputs to change (as a list).
+        :param values: Values to add to those inputs (as a list).
+        :return: The output of the neural network (as a number).
+        """
+
+        # Recompute the weighted sums if the weights changed since they were computed
+        if self.version != self.nn.version:
+            self.pre_activation = self.nn.accumulate(self.active.keys(), self.active.values())
+            self.version = self.nn.version
+
+        if len(indices) == 0:
+            return self.nn.evaluate_pre_activation(self.pre_activation)
+
+        return self.nn.evaluate_pre_activation(self.nn.accumulate(indices, values, self.pre_activation))
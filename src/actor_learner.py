@@ -0,0 +1,280 @@
+"""
+actor_learner.py
+
+Provides a Q-Learning trainer that separates playing from learning. Actor processes play training episodes with their
+own copy of the neural network and send the transitions (packed, see TransitionLog) to the learner through a bounded
+queue: when the learner falls behind, the actors wait. The learner (the parent process) trains the network with batches
+of the transitions it receives and publishes the new weights to the actors every few updates.
+"""
+
+import multiprocessing
+import random
+import time
+import Queue
+
+import numpy
+
+from checkpoint import CheckpointWriter
+from nn import NN
+from ql_trainer import QLTrainer
+from replay_buffer import TransitionLog
+from replay_buffer import train_from_replay
+from replay_buffer import train_with_transitions
+
+
+class ActorLearnerTrainer(QLTrainer):
+    """
+    Class that provides an actor-learner Q-Learning trainer for a Ludo game.
+    """
+
+    # Seconds the learner waits for transitions before checking that the actors are still running
+    poll_interval = 0.5
+
+    def __init__(self, num_episodes, nn_file_dst, num_actors=None, nn_file_src=None, debug=False, nn_backend="numpy",
+                 afterstate=False, cache_bytes=None, keep_checkpoints=3, nn_encoder=None, batch_size=32,
+                 publish_every=100, queue_size=64, replay_capacity=100000, replay_batches=0):
+        """
+        Constructor for a new trainer.
+
+        :param num_episodes: Number of episodes to train the network with (in total, across all the actors).
+        :param nn_file_dst: The name of a file where to store the resulting neural network (as a binary checkpoint).
+        :param num_actors: Number of processes that play episodes. If None, one per CPU (besides the learner).
+        :param nn_file_src: The name of a file where to retrieve an existing neural network and use it as the starting
+        point. If no file is provided, the neural network will be initialize with random weights.
+        :param debug: If True, print debugging information.
+        :param nn_backend: Name of the implementation of the neural network (see NN). Its weights must be shareable
+        ("numpy" or "linear").
+        :param afterstate: If True, the Q-Learning players learn the values of afterstates (see QLPlayer).
+        :param cache_bytes: Memory budget (in bytes) for a cache of neural network outputs in each actor. If None, no
+        cache is used.
+        :param keep_checkpoints: Number of periodic checkpoints to keep next to nn_file_dst (as nn_file_dst.<episode>).
+        :param nn_encoder: Name of the encoder of the neural network inputs (see QLTrainer).
+        :param batch_size: Number of transitions in each training update.
+        :param publish_every: Number of training updates between publications of the weights to the actors.
+        :param queue_size: Number of episodes (of transitions) that can wait in the queue to the learner.
+        :param replay_capacity: Number of transitions the learner keeps (see ReplayBuffer).
+        :param replay_batches: Number of batches sampled from the kept transitions (in addition to the batches of new
+        transitions) after every episode.
+        """
+
+        QLTrainer.__init__(self, num_episodes, nn_file_dst, nn_file_src, debug, nn_backend, afterstate,
+                           keep_checkpoints=keep_checkpoints, nn_encoder=nn_encoder, replay_capacity=replay_capacity,
+                           replay_batch_size=batch_size, replay_batches=replay_batches)
+
+        if num_actors is None:
+            num_actors = max(1, multiprocessing.cpu_count() - 1)
+
+        self.num_actors = num_actors
+        self.cache_bytes = cache_bytes
+        self.publish_every = publish_every
+        self.updates = 0
+        self.publications = 0
+
+        # Copy of the weights the actors refresh their networks from (in shared memory, see NN.share_weights)
+        self.published = NN(self.nn.num_inputs, None, self.nn.backend, self.nn.encoder.name,
+                            backend_options=self.nn.backend_options)
+        self.published.share_weights()
+        self.publish_lock = multiprocessing.Lock()
+        self.publish()
+
+        # Transitions of each episode, with the actor that played it and the winner
+        self.queue = multiprocessing.Queue(queue_size)
+
+        # Episodes handed out to the actors and exploration rate of the episodes that start now (set by the learner)
+        self.next_episode = multiprocessing.Value("l", 0)
+        self.current_epsilon = multiprocessing.RawValue("d", QLTrainer.max_epsilon)
+
+        # Throughput of each actor: episodes and transitions sent, and seconds spent waiting for room in the queue
+        self.actor_episodes = multiprocessing.RawArray("l", num_actors)
+        self.actor_transitions = multiprocessing.RawArray("l", num_actors)
+        self.actor_blocked = multiprocessing.RawArray("d", num_actors)
+
+    def publish(self):
+        """
+        Copy the current weights of the learner's network to the actors.
+        """
+
+        arrays, metadata = self.nn.get_weights()
+
+        with self.publish_lock:
+            self.published.set_weights(arrays, metadata)
+
+        self.publications += 1
+
+    def act(self, actor):
+        """
+        Play training episodes until all of them have been handed out (runs in each actor process).
+
+        :param actor: Index of the actor.
+        """
+
+        # Forked actors would otherwise roll the same dice
+        random.seed()
+        numpy.random.seed()
+
+        # The actor's own network (only changed with the published weights) and the transitions of the current episode
+        self.nn = NN(self.nn.num_inputs, None, self.nn.backend, self.nn.encoder.name,
+                     backend_options=self.nn.backend_options)
+        self.nn.enable_cache(self.cache_bytes)
+        self.replay = TransitionLog()
+
+        synced_version = None
+
+        while True:
+            with self.next_episode.get_lock():
+                if self.next_episode.value >= self.num_episodes:
+                    break
+
+                self.next_episode.value += 1
+
+            # Refresh the network between episodes if new weights were published
+            if self.published.version != synced_version:
+                with self.publish_lock:
+                    synced_version = self.published.version
+                    arrays, metadata = self.published.get_weights()
+
+                self.nn.set_weights(arrays, metadata)
+
+            winner = self.play_episode(self.current_epsilon.value, learn=False)
+
+            self.actor_transitions[actor] += len(self.replay)
+            data = self.replay.pack()
+
+            start_time = time.time()
+            self.queue.put((actor, winner, data))
+            self.actor_blocked[actor] += time.time() - start_time
+            self.actor_episodes[actor] += 1
+
+    def update(self, indices=None):
+        """
+        Apply a training update and publish the weights every publish_every updates.
+
+        :param indices: Indices of the transitions to train with (in the replay buffer). If None, a batch is sampled.
+        """
+
+        if indices is None:
+            train_from_replay(self.nn, self.replay, self.replay_batch_size, self.afterstate, None, self.learning_rate,
+                              self.discount_rate)
+        else:
+            train_with_transitions(self.nn, self.replay, indices, None, self.afterstate, None, self.learning_rate,
+                                   self.discount_rate)
+
+        self.updates += 1
+
+        if self.updates % self.publish_every == 0:
+            self.publish()
+
+    def actor_throughput(self, seconds):
+        """
+        Get the throughput of each actor.
+
+        :param seconds: Seconds since the actors were started.
+        :return: A list with a tuple (episodes per second, transitions per second, fraction of the time spent waiting
+        for the learner) for each actor.
+        """
+
+        return [(self.actor_episodes[a] / seconds, self.actor_transitions[a] / seconds, self.actor_blocked[a] / seconds)
+                for a in range(self.num_actors)]
+
+    def train(self, test=False):
+        """
+        Override the parent method.
+        """
+
+        # Keep track of how many times each player wins
+        wins = [0, ] * 4
+
+        if self.debug:
+            print "===================================================================================================="
+            print "| TRAINING STARTED                                                                                 |"
+            print "===================================================================================================="
+            print
+
+        # Test initially
+        if test:
+            self.print_tests(0)
+
+        # The actors are started before the checkpoint writer's thread (forking copies only the calling thread). They
+        # stop with the learner.
+        actors = [multiprocessing.Process(target=self.act, args=(a, )) for a in range(self.num_actors)]
+
+        for actor in actors:
+            actor.daemon = True
+            actor.start()
+
+        writer = CheckpointWriter(self.nn_file_dst, self.keep_checkpoints)
+        start_time = time.time()
+
+        episode = 0
+
+        while episode < self.num_episodes:
+            try:
+                actor, winner, data = self.queue.get(timeout=ActorLearnerTrainer.poll_interval)
+            except Queue.Empty:
+                if not any(actor.is_alive() for actor in actors):
+                    writer.close()
+                    raise RuntimeError("The actors stopped before the end of training")
+
+                continue
+
+            if winner is not None:
+                wins[winner] += 1
+
+            # Train with the new transitions, then again with past transitions
+            indices = self.replay.add_batch(TransitionLog.unpack(data))
+
+            for b in range(0, len(indices), self.replay_batch_size):
+                self.update(indices[b:b + self.replay_batch_size])
+
+            if len(self.replay) >= self.replay_batch_size:
+                for b in range(self.replay_batches):
+                    self.update()
+
+            # Decrease epsilon (for the episodes the actors start from now on)
+            self.current_epsilon.value = self.epsilon(episode + 1)
+
+            # Test regularly
+            if test and episode > 0:
+                if episode % QLTrainer.test_every == 0:
+                    self.print_tests(episode)
+
+            # Save the neural network to the specified file regularly
+            if episode % QLTrainer.checkpoint_every == 0:
+                arrays, metadata = self.nn.get_weights()
+                metadata["episode"] = episode
+                writer.save(arrays, metadata, episode)
+
+                if self.debug:
+                    seconds = time.time() - start_time
+
+                    print "Episodes: %d/%d, updates: %d, publications: %d, queued episodes: %d" % \
+                        (episode + 1, self.num_episodes, self.updates, self.publications, self.queue.qsize())
+
+                    for a, (episodes, transitions, blocked) in enumerate(self.actor_throughput(seconds)):
+                        print "Actor %d: %.1f episodes/s, %.1f transitions/s, %.0f%% waiting" % \
+                            (a, episodes, transitions, blocked * 100.0)
+
+                    print
+
+            episode += 1
+
+        for actor in actors:
+            actor.join()
+
+        # Save the final neural network to the specified file
+        arrays, metadata = self.nn.get_weights()
+        metadata["episode"] = self.num_episodes
+        writer.save(arrays, metadata, self.num_episodes)
+        writer.close()
+
+        # Display the percentage of wins
+        for w in range(len(wins)):
+            wins[w] = wins[w] * 100.0 / self.num_episodes
+
+        if self.debug:
+            print "Wins: " + str(wins)
+            print
+            print "===================================================================================================="
+            print "| TRAINING ENDED                                                                                   |"
+            print "===================================================================================================="
+            print
@@ -0,0 +1,136 @@
+"""
+background_eval.py
+
+Provides a background evaluator: the periodic tests of a network being trained (see QLTrainer.train) run in a pool of
+other processes on snapshots of the weights, so that training goes on while they run. The rows of the learning curve
+are printed in order as soon as they are ready.
+"""
+
+import collections
+import multiprocessing
+import random
+
+import numpy
+
+
+def reseed():
+    """
+    Give a pool process its own dice (forked processes start with the same random state).
+    """
+
+    random.seed()
+    numpy.random.seed()
+
+
+def test_snapshot(episode, arrays, metadata, backend, afterstate, games, backend_options=None):
+    """
+    Test a snapshot of the weights of a network against both test settings (runs in a pool process).
+
+    :param episode: Number of the training episode the snapshot was taken at.
+    :param arrays: Arrays returned by NN.get_weights().
+    :param metadata: Metadata returned by NN.get_weights().
+    :param backend: Name of the backend of the network (see NN).
+    :param afterstate: If True, the network estimates the values of afterstates (see QLPlayer).
+    :param games: Number of games of each test.
+    :param backend_options: Extra arguments of the backend (see NN).
+    :return: A tuple (episode, percentage of wins against random players, percentage of wins against expert players).
+    """
+
+    # Imported here: ql_trainer.py imports this module
+    from ql_trainer import QLTrainer
+
+    trainer = QLTrainer(0, None, nn_backend=backend, afterstate=afterstate, nn_encoder=metadata["encoder"],
+                        nn_backend_options=backend_options)
+    trainer.nn.set_weights(arrays, metadata)
+
+    return (episode,
+            trainer.test(games, "1_QL_AGAINST_3_RANDOM")[0],
+            trainer.test(games, "1_QL_AGAINST_3_EXPERT")[0])
+
+
+class BackgroundEvaluator(object):
+    """
+    Class that tests snapshots of a network in a pool of processes.
+    """
+
+    def __init__(self, processes, backend, afterstate=False, games=1000, results=None, backend_options=None):
+        """
+        Start the pool of processes. It should be created before any other threads are started (the processes are
+        forked).
+
+        :param processes: Number of processes.
+        :param backend: Name of the backend of the network (see NN). It must support checkpoints.
+        :param afterstate: If True, the network estimates the values of afterstates (see QLPlayer).
+        :param games: Number of games of each test.
+        :param results: A list where to append the rows as they are printed. If None, a new list is used.
+        :param backend_options: Extra arguments of the backend (see NN).
+        """
+
+        self.pool = multiprocessing.Pool(processes, reseed)
+        self.backend = backend
+        self.afterstate = afterstate
+        self.games = games
+        self.backend_options = backend_options
+
+        # Tests submitted and not printed yet (in order), and all the rows printed
+        self.pending = collections.deque()
+        self.results = results if results is not None else []
+
+    def submit(self, episode, nn):
+        """
+        Test a snapshot of the current weights of a network.
+
+        :param episode: Number of the training episode (the first column of the learning curve).
+        :param nn: The network (NN).
+        """
+
+        if not nn.supports("checkpoint"):
+            raise ValueError("The " + nn.backend + " backend cannot be tested in the background")
+
+        arrays, metadata = nn.get_weights()
+        self.pending.append(self.pool.apply_async(test_snapshot, (episode, arrays, metadata, self.backend,
+                                                                  self.afterstate, self.games,
+                                                                  self.backend_options)))
+
+    def print_row(self, result):
+        """
+        Print a row of the learning curve.
+
+        :param result: A tuple returned by test_snapshot(...).
+        """
+
+        print "%-10d %20.2f %20.2f" % result
+        self.results.append(result)
+
+    def print_ready(self):
+        """
+        Print the rows of the tests that are done (without waiting for the others).
+        """
+
+        while len(self.pending) > 0 and self.pending[0].ready():
+            self.print_row(self.pending.popleft().get())
+
+    def close(self):
+        """
+        Wait for all the tests, print their rows and stop the pool. The pool is terminated if a test fails.
+        """
+
+        self.pool.close()
+
+        try:
+            while len(self.pending) > 0:
+                self.print_row(self.pending.popleft().get())
+        except Exception:
+            self.terminate()
+            raise
+
+        self.pool.join()
+
+    def terminate(self):
+        """
+        Stop the pool right away (e.g. when the training fails): the tests still running are lost.
+        """
+
+        self.pending.clear()
+        self.pool.terminate()
+        self.pool.join()
@@ -0,0 +1,296 @@
+"""
+checkpoint.py
+
+Provides a compact binary format for neural network weights and a background writer that saves checkpoints without
+stalling training.
+
+A checkpoint file starts with a fixed header (magic string, format version and length of a JSON description), followed
+by the JSON description (array names, types, shapes and offsets, plus free-form metadata) and the raw arrays. Each array
+starts at an aligned offset so that it can be memory-mapped directly.
+"""
+
+import collections
+import json
+import os
+import struct
+import tempfile
+import threading
+import Queue
+
+import numpy
+
+# Identification of the format
+MAGIC = "LUDONN\x00\x00"
+FORMAT_VERSION = 1
+
+# Layout of the fixed header: magic, format version, length of the JSON description
+HEADER = struct.Struct("<8sII")
+
+# Arrays start at multiples of this number of bytes
+ALIGNMENT = 64
+
+
+def align(offset):
+    """
+    Round an offset up to the next multiple of ALIGNMENT.
+
+    :param offset: An offset in bytes.
+    :return: The aligned offset.
+    """
+
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def is_checkpoint(src_file):
+    """
+    Determine if a file is a binary checkpoint (as opposed to e.g. a FANN text file).
+
+    :param src_file: Name of the file.
+    :return: True if the file starts with the checkpoint magic string. False otherwise.
+    """
+
+    with open(src_file, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def write_checkpoint(dst_file, arrays, metadata=None):
+    """
+    Write arrays to a checkpoint file atomically: the data is written to a temporary file in the same directory which
+    then replaces dst_file. A crash while writing never leaves a partial dst_file behind.
+
+    :param dst_file: Name of the file where to write the checkpoint.
+    :param arrays: An ordered dictionary of NumPy arrays (name -> array).
+    :param metadata: A dictionary of JSON-serializable values to store with the arrays.
+    """
+
+    # Describe the arrays. Offsets are computed once the length of the description is known, which depends on the
+    # offsets themselves: iterate until the description stops changing (the offsets it holds are then those of the
+    # arrays that follow it).
+    descriptions = []
+
+    for name, array in arrays.items():
+        descriptions.append({"name": name,
+                             "dtype": array.dtype.str,
+                             "shape": list(array.shape),
+                             "offset": 0})
+
+    description = ""
+
+    while True:
+        offset = align(HEADER.size + len(description))
+
+        for d, array in zip(descriptions, arrays.values()):
+            d["offset"] = offset
+            offset = align(offset + array.nbytes)
+
+        new_description = json.dumps({"arrays": descriptions, "metadata": metadata or {}})
+
+        if new_description == description:
+            break
+
+        description = new_description
+
+    dst_dir = os.path.dirname(os.path.abspath(dst_file))
+    fd, tmp_file = tempfile.mkstemp(prefix=os.path.basename(dst_file) + ".", suffix=".tmp", dir=dst_dir)
+
+    renamed = False
+
+    try:
+        # Temporary files are only readable by their owner: give the checkpoint the usual permissions instead
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_file, 0666 & ~umask)
+
+        with os.fdopen(fd, "wb") as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(description)))
+            f.write(description.encode("utf-8"))
+
+            for d, array in zip(descriptions, arrays.values()):
+                f.write("\x00" * (d["offset"] - f.tell()))
+                f.write(numpy.ascontiguousarray(array).tobytes())
+
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.rename(tmp_file, dst_file)
+        renamed = True
+    finally:
+        # Even an interrupted write (e.g. KeyboardInterrupt) leaves no temporary file behind
+        if not renamed and os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def read_checkpoint(src_file, mmap=True):
+    """
+    Read a checkpoint file.
+
+    :param src_file: Name of the checkpoint file.
+    :param mmap: If True, the arrays are read-only memory maps of the file (the data is only read when used, and the
+    pages are shared by all the processes that map the same file). Otherwise, the arrays are loaded into memory.
+    :return: A tuple (arrays, metadata) where arrays is an ordered dictionary of NumPy arrays (name -> array) and
+    metadata is the dictionary stored with them.
+    """
+
+    with open(src_file, "rb") as f:
+        magic, version, description_len = HEADER.unpack(f.read(HEADER.size))
+
+        if magic != MAGIC:
+            raise ValueError(src_file + " is not a checkpoint file")
+
+        if version > FORMAT_VERSION:
+            raise ValueError("Unsupported checkpoint format version " + str(version) + " in " + src_file)
+
+        description = json.loads(f.read(description_len).decode("utf-8"))
+
+        arrays = collections.OrderedDict()
+
+        for d in description["arrays"]:
+            dtype = numpy.dtype(str(d["dtype"]))
+            shape = tuple(d["shape"])
+
+            if mmap:
+                arrays[d["name"]] = numpy.memmap(src_file, dtype=dtype, mode="r", offset=d["offset"], shape=shape)
+            else:
+                f.seek(d["offset"])
+                count = int(numpy.prod(shape))
+                arrays[d["name"]] = numpy.fromfile(f, dtype=dtype, count=count).reshape(shape)
+
+    return arrays, description["metadata"]
+
+
+class CheckpointWriter(object):
+    """
+    Class that saves checkpoints on a background thread. Each checkpoint is written atomically and becomes the latest
+    one (at dst_file). The last few checkpoints are also kept under numbered names (dst_file.<number>).
+    """
+
+    def __init__(self, dst_file, keep=3):
+        """
+        Construct a new checkpoint writer and start its thread.
+
+        :param dst_file: Name of the file where to write the latest checkpoint.
+        :param keep: Number of numbered checkpoints to keep (0 to keep only the latest one). The numbered checkpoints
+        left by earlier runs count too: the oldest ones are removed right away.
+        """
+
+        self.dst_file = dst_file
+        self.keep = keep
+        self.kept_files = []
+
+        if keep > 0:
+            dst_dir = os.path.dirname(os.path.abspath(dst_file))
+            prefix = os.path.basename(dst_file) + "."
+
+            self.kept_files = sorted([os.path.join(os.path.dirname(dst_file), f) for f in os.listdir(dst_dir)
+                                      if f.startswith(prefix) and f[len(prefix):].isdigit()],
+                                     key=lambda f: (os.path.getmtime(f), f))
+            self.prune()
+
+        # Pending checkpoints: at most one waits while another one is being written
+        self.queue = Queue.Queue(maxsize=1)
+        self.error = None
+
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        """
+        Write the queued checkpoints until None is queued.
+        """
+
+        while True:
+            item = self.queue.get()
+
+            try:
+                if item is None:
+                    return
+
+                number, arrays, metadata = item
+
+                if self.keep > 0 and number is not None:
+                    # Write the numbered checkpoint and make the latest checkpoint point to the same data
+                    numbered_file = "%s.%08d" % (self.dst_file, number)
+                    write_checkpoint(numbered_file, arrays, metadata)
+
+                    tmp_file = self.dst_file + ".link.tmp"
+
+                    if os.path.exists(tmp_file):
+                        os.remove(tmp_file)
+
+                    os.link(numbered_file, tmp_file)
+                    os.rename(tmp_file, self.dst_file)
+
+                    # Forget the oldest checkpoints
+                    if numbered_file not in self.kept_files:
+                        self.kept_files.append(numbered_file)
+
+                    self.prune()
+                else:
+                    write_checkpoint(self.dst_file, arrays, metadata)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def prune(self):
+        """
+        Remove the oldest numbered checkpoints beyond the number to keep.
+        """
+
+        while len(self.kept_files) > self.keep:
+            old_file = self.kept_files.pop(0)
+
+            if os.path.exists(old_file):
+                os.remove(old_file)
+
+    def check(self):
+        """
+        Raise the error of the last failed write, if any.
+        """
+
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            raise error
+
+    def save(self, arrays, metadata=None, number=None):
+        """
+        Queue a checkpoint. The arrays are copied first, so the caller can keep modifying them. If a checkpoint is
+        already waiting to be written, this call blocks until it starts being written.
+
+        :param arrays: An ordered dictionary of NumPy arrays (name -> array).
+        :param metadata: A dictionary of JSON-serializable values to store with the arrays.
+        :param number: A number identifying the checkpoint (e.g. the episode) to keep it under a numbered name.
+        """
+
+        self.check()
+
+        snapshot = collections.OrderedDict()
+
+        for name, array in arrays.items():
+            snapshot[name] = numpy.array(array)
+
+        self.queue.put((number, snapshot, metadata))
+
+    def flush(self):
+        """
+        Wait until all the queued checkpoints are written.
+        """
+
+        self.queue.join()
+        self.check()
+
+    def close(self, check=True):
+        """
+        Write the queued checkpoints and stop the thread.
+
+        :param check: If True, raise the error of the last failed write, if any (see CheckpointWriter.check). Use False
+        to stop the writer while another error is being handled.
+        """
+
+        self.queue.put(None)
+        self.thread.join()
+
+        if check:
+            self.check()
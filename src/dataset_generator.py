@@ -0,0 +1,407 @@
+"""
+dataset_generator.py
+
+Provides a generator of offline datasets of transitions: games between configurable seat policies are played in a pool
+of processes, and every move is recorded with the board state it was made from, the dice, the action, its categories,
+the shaped reward of the Q-Learning players (see rewards.shaped_rewards) and the board state it reached. The
+transitions are written to shards of a fixed number of transitions (one .npy file per field, which can be
+memory-mapped) described by a JSON manifest, so that the same dataset can be used by many training experiments.
+"""
+
+import collections
+import json
+import multiprocessing
+import os
+import random
+import time
+
+import numpy
+
+from aggressive_player import AggressivePlayer
+from background_eval import reseed
+from defensive_player import DefensivePlayer
+from encoders import get_encoder
+from fast_player import FastPlayer
+from ludo import Ludo
+from mixed_strategy_player import MixedStrategyPlayer
+from nn import NN
+from ql_player import QLPlayer
+from rewards import shaped_rewards
+from rnd_player import RandomPlayer
+
+# Seat policies (name -> class). The "ql" policy is a Q-Learning player with a trained network.
+POLICIES = {"random": RandomPlayer,
+            "fast": FastPlayer,
+            "aggressive": AggressivePlayer,
+            "defensive": DefensivePlayer,
+            "mixed": MixedStrategyPlayer,
+            "ql": QLPlayer}
+
+# Arrays of a shard (name -> (type, shape of an element)). A transition takes 46 bytes. Both boards are packed by the
+# player who moved (see Player.pack_board_state): the next player's view of next_packed is next_packed[4:] +
+# next_packed[:4]. The categories are the bits of the move (see Player.****_MOVE), game is the number of the game in the
+# shard and terminal marks the last transition of each player in a game.
+FIELDS = collections.OrderedDict([("packed", (numpy.uint8, (16, ))),
+                                  ("dice", (numpy.uint8, ())),
+                                  ("action", (numpy.uint8, (2, ))),
+                                  ("categories", (numpy.uint8, ())),
+                                  ("reward", (numpy.float32, ())),
+                                  ("terminal", (numpy.bool_, ())),
+                                  ("next_packed", (numpy.uint8, (16, ))),
+                                  ("seat", (numpy.uint8, ())),
+                                  ("game", (numpy.uint32, ()))])
+
+
+def shard_file(dst_prefix, shard, name):
+    """
+    Get the name of the file of an array of a shard.
+
+    :param dst_prefix: Prefix of the files of the dataset.
+    :param shard: Number of the shard.
+    :param name: Name of the array (see FIELDS).
+    :return: The name of the file (dst_prefix.<shard>.<name>.npy).
+    """
+
+    return "%s.%05d.%s.npy" % (dst_prefix, shard, name)
+
+
+def create_players(policies, nn=None, afterstate=False):
+    """
+    Create the players of a game.
+
+    :param policies: The names of the policies of the 4 seats (see POLICIES).
+    :param nn: The network of the "ql" seats (NN).
+    :param afterstate: If True, the network of the "ql" seats estimates the values of afterstates (see QLPlayer).
+    :return: A list with the players.
+    """
+
+    players = []
+
+    for seat, policy in enumerate(policies):
+        if policy == "ql":
+            players.append(QLPlayer(id=seat, train=False, nn=nn, epsilon=0, afterstate=afterstate))
+        else:
+            players.append(POLICIES[policy](seat))
+
+    return players
+
+
+class RecordingGame(Ludo):
+    """
+    Class that plays a Ludo game and records its transitions (see FIELDS). A player's transition gets the reward of its
+    move and the penalties the player receives before its next move (e.g. -1 when another player wins), as the
+    Q-Learning players get them. The last transition of each player is terminal.
+    """
+
+    def __init__(self, players, seed=None):
+        """
+        Construct a new game.
+
+        :param players: The players, in the order of their turns (the id of each player is its index).
+        :param seed: If not None, the seed of the dice (see Ludo).
+        """
+
+        Ludo.__init__(self, players, seed)
+
+        # Transitions as a list of values for each field (but the number of the game), and index of the last transition
+        # of each player
+        self.columns = collections.OrderedDict((name, []) for name in FIELDS if name != "game")
+        self.last = [None, ] * 4
+
+    def __len__(self):
+        """
+        Get the number of transitions recorded.
+
+        :return: The number of transitions.
+        """
+
+        return len(self.columns["seat"])
+
+    def play(self):
+        """
+        Override the parent method. Every move is recorded (see RecordingGame.play_move).
+        """
+
+        # Keep track of the turn number as a timestamp
+        turn = 0
+
+        while True:
+            cur_player = self.players[self.player_turn]
+
+            # Roll dice
+            dice = self.roll_dice()
+
+            # Prompt player for a move (turns without moves are not transitions)
+            successors = cur_player.get_next_states(dice, self.players)
+
+            if successors is not None:
+                self.play_move(cur_player, dice, successors, turn)
+
+            # Check for a winner
+            if Ludo.player_wins(cur_player):
+                break
+
+            # Next player
+            self.player_turn = (self.player_turn + 1) % 4
+
+            turn += 1
+
+        # The game is over for everyone
+        for i in self.last:
+            if i is not None:
+                self.columns["terminal"][i] = True
+
+        return cur_player
+
+    def play_move(self, player, dice, successors, turn):
+        """
+        Let a player make a move and record it.
+
+        :param player: The player.
+        :param dice: The value of the dice roll.
+        :param successors: The possible new states (see Player.get_next_states).
+        :param turn: The turn number.
+        """
+
+        seat = self.player_turn
+        packed = player.pack_board_state(self.players)
+        cur_states = [list(p.state) for p in self.players]
+        previous_moved = turn > 0 and self.players[(seat - 1) % 4].timestamp == turn - 1
+
+        player.make_move(successors, self.players, turn)
+
+        categories = [s["categories"] for s in successors if tuple(s["action"]) == player.action][0]
+        rewards = shaped_rewards(seat, cur_states, player.action, [p.state for p in self.players], previous_moved)
+
+        # The penalties of the other players go to their last transitions
+        for p in range(4):
+            if p != seat and rewards[p] != 0.0 and self.last[p] is not None:
+                self.columns["reward"][self.last[p]] += rewards[p]
+
+        self.last[seat] = len(self)
+
+        self.columns["packed"].append(packed)
+        self.columns["dice"].append(dice)
+        self.columns["action"].append(player.action)
+        self.columns["categories"].append(categories)
+        self.columns["reward"].append(rewards[seat])
+        self.columns["terminal"].append(False)
+        self.columns["next_packed"].append(player.pack_board_state(self.players))
+        self.columns["seat"].append(seat)
+
+
+def write_shard(dst_prefix, shard, shard_size, policies, seed=None, nn_file=None, nn_backend=None, nn_encoder=None,
+                afterstate=False):
+    """
+    Play games until a shard is full and write it (runs in a pool process). The transitions of the last game that do
+    not fit in the shard are dropped.
+
+    :param dst_prefix: Prefix of the files of the dataset (see shard_file).
+    :param shard: Number of the shard.
+    :param shard_size: Number of transitions of the shard.
+    :param policies: The names of the policies of the 4 seats (see POLICIES).
+    :param seed: Seed of the random generators (the dice and the random choices of the players). If None, the
+    process draws its own.
+    :param nn_file: The network of the "ql" seats (a binary checkpoint or a file in the backend's own format).
+    :param nn_backend: Name of the backend of the network (see NN). If None, the default backend is used.
+    :param nn_encoder: Name of the encoder of the network (see encoders.py). If None, "board" is used for afterstate
+    values and "full" otherwise.
+    :param afterstate: If True, the network estimates the values of afterstates (see QLPlayer).
+    :return: A dictionary that describes the shard for the manifest: its number, the names of its files (without their
+    directory), and the numbers of transitions, games, dropped transitions and wins of each seat.
+    """
+
+    start = time.time()
+
+    if seed is None:
+        reseed()
+    else:
+        random.seed(seed)
+        numpy.random.seed(seed % 2 ** 32)
+
+    nn = None
+
+    if "ql" in policies:
+        if nn_encoder is None:
+            nn_encoder = "board" if afterstate else "full"
+
+        nn = NN(get_encoder(nn_encoder).num_inputs, nn_file, nn_backend, nn_encoder)
+
+    arrays = collections.OrderedDict()
+
+    for name, (dtype, shape) in FIELDS.items():
+        arrays[name] = numpy.lib.format.open_memmap(shard_file(dst_prefix, shard, name), mode="w+", dtype=dtype,
+                                                    shape=(shard_size, ) + shape)
+
+    size = 0
+    games = 0
+    dropped = 0
+    wins = [0, ] * 4
+
+    while size < shard_size:
+        game = RecordingGame(create_players(policies, nn, afterstate))
+        wins[game.play().id] += 1
+
+        count = min(len(game), shard_size - size)
+
+        for name, column in game.columns.items():
+            arrays[name][size:size + count] = column[:count]
+
+        arrays["game"][size:size + count] = games
+
+        size += count
+        games += 1
+        dropped += len(game) - count
+
+    for array in arrays.values():
+        array.flush()
+
+    return {"shard": shard,
+            "files": dict((name, os.path.basename(shard_file(dst_prefix, shard, name))) for name in FIELDS),
+            "transitions": size,
+            "games": games,
+            "dropped": dropped,
+            "wins": wins,
+            "seconds": time.time() - start}
+
+
+def read_manifest(src_file):
+    """
+    Read the manifest of a dataset.
+
+    :param src_file: Name of the manifest file (see DatasetGenerator.manifest_file).
+    :return: A dictionary (see DatasetGenerator.run).
+    """
+
+    with open(src_file) as f:
+        return json.load(f)
+
+
+def load_shard(manifest_file, shard, mmap=True):
+    """
+    Load the arrays of a shard of a dataset.
+
+    :param manifest_file: Name of the manifest file of the dataset (the shards are next to it).
+    :param shard: Number of the shard.
+    :param mmap: If True, the arrays are memory-mapped (read-only). Otherwise, they are read into memory.
+    :return: An ordered dictionary (field name -> array, see FIELDS).
+    """
+
+    description = [s for s in read_manifest(manifest_file)["shards"] if s["shard"] == shard][0]
+    src_dir = os.path.dirname(os.path.abspath(manifest_file))
+
+    return collections.OrderedDict((name, numpy.load(os.path.join(src_dir, description["files"][name]),
+                                                     mmap_mode="r" if mmap else None))
+                                   for name in FIELDS)
+
+
+class DatasetGenerator(object):
+    """
+    Class that writes the shards of a dataset in a pool of processes.
+    """
+
+    def __init__(self, dst_prefix, policies, shard_size=1000000, processes=None, seed=None, nn_file=None,
+                 nn_backend=None, nn_encoder=None, afterstate=False):
+        """
+        Construct a new generator.
+
+        :param dst_prefix: Prefix of the files of the dataset: the shards (see shard_file) and the manifest (see
+        DatasetGenerator.manifest_file). Existing files are overwritten.
+        :param policies: The names of the policies of the 4 seats (see POLICIES), e.g. ["ql", "mixed", "mixed",
+        "mixed"]. The starting seat of each game is random.
+        :param shard_size: Number of transitions of each shard.
+        :param processes: Number of shards written at once. If None, one per CPU.
+        :param seed: If not None, each shard is generated with a seed of its own derived from it, so that the dataset
+        can be generated again. Otherwise, the games are different every time.
+        :param nn_file: The network of the "ql" seats (see write_shard).
+        :param nn_backend: Name of the backend of the network (see NN).
+        :param nn_encoder: Name of the encoder of the network (see write_shard).
+        :param afterstate: If True, the network estimates the values of afterstates (see QLPlayer).
+        """
+
+        if len(policies) != 4:
+            raise ValueError("A game needs 4 seat policies, not " + str(len(policies)))
+
+        for policy in policies:
+            if policy not in POLICIES:
+                raise ValueError("Unknown seat policy: " + str(policy))
+
+        if "ql" in policies and nn_file is None:
+            raise ValueError("The ql seats need a network file")
+
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+
+        self.dst_prefix = dst_prefix
+        self.policies = list(policies)
+        self.shard_size = shard_size
+        self.processes = processes
+        self.seed = seed
+        self.nn_file = nn_file
+        self.nn_backend = nn_backend
+        self.nn_encoder = nn_encoder
+        self.afterstate = afterstate
+
+    def manifest_file(self):
+        """
+        Get the name of the manifest file of the dataset.
+
+        :return: dst_prefix.manifest.json.
+        """
+
+        return self.dst_prefix + ".manifest.json"
+
+    def run(self, num_shards):
+        """
+        Write the shards of the dataset, as many at once as there are processes, and then its manifest.
+
+        :param num_shards: Number of shards.
+        :return: The manifest: a dictionary with the settings of the dataset, the type and the shape of an element of
+        each field, the total numbers of transitions and games, and a description of each shard (see write_shard).
+        """
+
+        pool = multiprocessing.Pool(self.processes)
+        results = []
+
+        for shard in range(num_shards):
+            seed = None if self.seed is None else self.seed * num_shards + shard
+
+            results.append(pool.apply_async(write_shard, (self.dst_prefix, shard, self.shard_size, self.policies,
+                                                          seed, self.nn_file, self.nn_backend, self.nn_encoder,
+                                                          self.afterstate)))
+
+        pool.close()
+
+        shards = []
+
+        for result in results:
+            description = result.get()
+            shards.append(description)
+
+            print "Shard %d: %d games, %d transitions (%.0f transitions/s)" % \
+                  (description["shard"], description["games"], description["transitions"],
+                   description["transitions"] / max(description["seconds"], 1e-9))
+
+        pool.join()
+
+        manifest = collections.OrderedDict()
+        manifest["policies"] = self.policies
+        manifest["shard_size"] = self.shard_size
+        manifest["seed"] = self.seed
+        manifest["nn_file"] = self.nn_file
+        manifest["afterstate"] = self.afterstate
+        manifest["fields"] = collections.OrderedDict((name, {"dtype": numpy.dtype(dtype).str, "shape": list(shape)})
+                                                     for name, (dtype, shape) in FIELDS.items())
+        manifest["transitions"] = sum(s["transitions"] for s in shards)
+        manifest["games"] = sum(s["games"] for s in shards)
+        manifest["shards"] = shards
+
+        # The manifest is written last (and atomically): a dataset with a manifest is complete
+        tmp_file = self.manifest_file() + ".tmp"
+
+        with open(tmp_file, "w") as f:
+            json.dump(manifest, f, indent=2)
+
+        os.rename(tmp_file, self.manifest_file())
+
+        return manifest
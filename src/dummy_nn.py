@@ -1,15 +1,21 @@
 """
 dummy_nn.py
 
-Provides an interface for a dummy neural network that always returns a single output with value = 1.
+Provides an interface for a dummy neural network that always returns a single output with value = 1. It implements the
+whole backend interface at (almost) no cost, which is useful to measure the speed of the game engine alone.
 """
 
+import collections
+
 
 class DummyNN(object):
     """
     Class that provides an interface for a dummy neural network that always returns a single output with value = 1.
     """
 
+    # Features supported natively (see nn.CAPABILITIES)
+    capabilities = frozenset(["train", "sparse", "batch", "accumulator", "checkpoint"])
+
     def __init__(self, num_inputs, learning_rate, momentum, src_file=None):
         """
         Constructor for a single-output dummy neural network.
@@ -23,6 +29,15 @@ class DummyNN(object):
         self.num_inputs = num_inputs
         self.learning_rate = learning_rate
 
+    def set_learning_rate(self, learning_rate):
+        """
+        Change the learning rate used when training the neural network.
+
+        :param learning_rate: New learning rate.
+        """
+
+        self.learning_rate = learning_rate
+
     def write_to_file(self, dst_file):
         """
         Does nothing.
@@ -32,6 +47,25 @@ class DummyNN(object):
 
         pass
 
+    def get_weights(self):
+        """
+        Return no weights.
+
+        :return: A tuple (arrays, metadata) with an empty ordered dictionary and an empty dictionary.
+        """
+
+        return collections.OrderedDict(), {}
+
+    def set_weights(self, arrays, metadata):
+        """
+        Does nothing.
+
+        :param arrays: Arrays of weights (ignored).
+        :param metadata: Metadata of the weights (ignored).
+        """
+
+        pass
+
     def train_with_datapoint(self, inputs, target):
         """
         Does nothing.
@@ -42,6 +76,17 @@ class DummyNN(object):
 
         pass
 
+    def train_with_sparse_datapoint(self, indices, values, target):
+        """
+        Does nothing.
+
+        :param indices: Indices of the non-zero inputs (as a list) (ignored).
+        :param values: Values of the non-zero inputs (as a list) (ignored).
+        :param target: Target output (as a number) (ignored).
+        """
+
+        pass
+
     def evaluate(self, inputs):
         """
         Return 1.
@@ -51,3 +96,46 @@ class DummyNN(object):
         """
 
         return 1
+
+    def evaluate_batch(self, rows):
+        """
+        Return 1 for each row.
+
+        :param rows: An array with one row of inputs per data point.
+        :return: The outputs of the neural network (as a list of numbers).
+        """
+
+        return [1, ] * len(rows)
+
+    def evaluate_sparse(self, indices, values):
+        """
+        Return 1.
+
+        :param indices: Indices of the non-zero inputs (as a list) (ignored).
+        :param values: Values of the non-zero inputs (as a list) (ignored).
+        :return: The output of the neural network (as a number).
+        """
+
+        return 1
+
+    def accumulate(self, indices, values, pre_activation=None):
+        """
+        Return 0 (there is no hidden layer).
+
+        :param indices: Indices of the inputs to add (as a list) (ignored).
+        :param values: Values of the inputs to add (as a list) (ignored).
+        :param pre_activation: Weighted sums to start from (ignored).
+        :return: 0.
+        """
+
+        return 0
+
+    def evaluate_pre_activation(self, pre_activation):
+        """
+        Return 1.
+
+        :param pre_activation: Weighted sums of the hidden neurons (ignored).
+        :return: The output of the neural network (as a number).
+        """
+
+        return 1
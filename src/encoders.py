@@ -0,0 +1,691 @@
+"""
+encoders.py
+
+Provides the encoders that transform positions (and actions) into neural network inputs.
+
+All the encoders read packed board states (see Player.pack_board_state): 16 integers with the positions of the pieces of
+the player who moves, then those of the next player and so on. They can produce a sparse input (the non-zero elements,
+split into a board part and an action part so that the board part can be shared by several actions) or fill the rows of
+a preallocated float32 array for a whole batch of inputs at once.
+"""
+
+import threading
+
+import numpy
+
+# Index of the first input of each piece's player in the one-hot encodings
+PIECE_OFFSETS = (numpy.arange(16) // 4) * 59
+
+# Normalized values of the action categories (see the Player.****_MOVE constants)
+CATEGORY_VALUES = {1: 0.20, 2: 0.40, 4: 0.60, 8: 0.80, 16: 1.00}
+
+# Safe squares (same as player.SafeSquares, which cannot be imported here)
+SAFE_SQUARES = frozenset([0, 1, 9, 14, 22, 27, 35, 40, 48])
+
+# Squares of the circular track where a piece cannot be knocked (as in Player.transition_is_defensive)
+DEFENDED_SQUARES = frozenset([1, 9, 14, 22, 27, 35, 40, 48])
+
+
+class Encoder(object):
+    """
+    Class that defines the interface of an encoder. Actual encoders should inherit from this class.
+    """
+
+    # Name under which the encoder is registered (and recorded with the networks trained with it)
+    name = None
+
+    # Number of inputs produced
+    num_inputs = 0
+
+    def board_sparse(self, packed):
+        """
+        Get the board part of a sparse input.
+
+        :param packed: A packed board state.
+        :return: A tuple (indices, values) with the non-zero board inputs.
+        """
+
+        raise NotImplementedError
+
+    def action_sparse(self, action, packed=None):
+        """
+        Get the action part of a sparse input.
+
+        :param action: The action (its meaning depends on the encoder).
+        :param packed: The packed board state the action is taken from (only needed by the encoders whose action inputs
+        depend on the board, e.g. FeatureEncoder).
+        :return: A tuple (indices, values) with the non-zero action inputs.
+        """
+
+        return [], []
+
+    def sparse(self, packed, action):
+        """
+        Get a sparse input.
+
+        :param packed: A packed board state.
+        :param action: The action (its meaning depends on the encoder).
+        :return: A tuple (indices, values) with the non-zero inputs.
+        """
+
+        indices, values = self.board_sparse(packed)
+        action_indices, action_values = self.action_sparse(action, packed)
+
+        return indices + action_indices, values + action_values
+
+    def encode_rows(self, packed, actions, out):
+        """
+        Fill the rows of an array with inputs. By default, each row is filled from its sparse input: encoders can
+        override this method with a vectorized version.
+
+        :param packed: An integer array with one packed board state per row.
+        :param actions: A list with the action of each row.
+        :param out: The float32 array to fill (with as many rows as packed). It is initially filled with zeros.
+        """
+
+        for r in range(packed.shape[0]):
+            indices, values = self.sparse(tuple(packed[r].tolist()), actions[r])
+            out[r, indices] = values
+
+    def encode_batch(self, packed, actions, out=None):
+        """
+        Encode a batch of inputs into the rows of a float32 array.
+
+        :param packed: A list (or array) of packed board states.
+        :param actions: A list with the action of each board state.
+        :param out: The array to fill. If None, a new array is returned (the encoders are shared by all the players, so
+        they keep no output of their own).
+        :return: An array with one row of inputs per board state.
+        """
+
+        packed = numpy.asarray(packed, dtype=numpy.intp).reshape((-1, 16))
+        n = packed.shape[0]
+
+        if out is None:
+            out = numpy.zeros((n, self.num_inputs), dtype=numpy.float32)
+        else:
+            out = out[:n]
+            out[:] = 0.0
+
+        self.encode_rows(packed, actions, out)
+
+        return out
+
+    def encode(self, packed, action):
+        """
+        Encode a single input.
+
+        :param packed: A packed board state.
+        :param action: The action (its meaning depends on the encoder).
+        :return: Inputs to the neural network (as a list).
+        """
+
+        return self.encode_batch([packed], [action])[0].tolist()
+
+
+class BoardEncoder(Encoder):
+    """
+    Class that encodes a board state alone: for each player (starting with the player who moves), 59 inputs with the
+    fraction of its pieces at each position. Used for afterstate values.
+    """
+
+    name = "board"
+    num_inputs = 236
+
+    def board_sparse(self, packed):
+        """
+        Override the parent method.
+        """
+
+        indices = []
+        values = []
+
+        for i in range(16):
+            index = (i // 4) * 59 + packed[i]
+
+            # Pieces of a player on the same square are consecutive in the packed board state
+            if len(indices) > 0 and indices[-1] == index:
+                values[-1] += 0.25
+            else:
+                indices.append(index)
+                values.append(0.25)
+
+        return indices, values
+
+    def encode_rows(self, packed, actions, out):
+        """
+        Override the parent method.
+        """
+
+        rows = numpy.repeat(numpy.arange(packed.shape[0]), 16)
+        numpy.add.at(out, (rows, (packed + PIECE_OFFSETS).ravel()), 0.25)
+
+
+class FullEncoder(BoardEncoder):
+    """
+    Class that encodes a state-action pair: the board (see BoardEncoder) followed by the source and destination of the
+    action, normalized between 0 and 1.
+    """
+
+    name = "full"
+    num_inputs = 238
+
+    def action_sparse(self, action, packed=None):
+        """
+        Override the parent method.
+        """
+
+        # The source is 0 when a piece is released
+        if action[0] == 0:
+            return [237], [action[1] / 58.0]
+
+        return [236, 237], [action[0] / 58.0, action[1] / 58.0]
+
+    def encode_rows(self, packed, actions, out):
+        """
+        Override the parent method.
+        """
+
+        BoardEncoder.encode_rows(self, packed, actions, out)
+        out[:, 236:238] = numpy.asarray(actions, dtype=numpy.float32).reshape((-1, 2)) / 58.0
+
+
+class CategoryEncoder(BoardEncoder):
+    """
+    Class that encodes a state-action category pair: the board (see BoardEncoder) followed by the action category (see
+    the Player.****_MOVE constants), normalized between 0 and 1.
+    """
+
+    name = "category"
+    num_inputs = 237
+
+    def action_sparse(self, action, packed=None):
+        """
+        Override the parent method.
+        """
+
+        return [236], [CATEGORY_VALUES[action]]
+
+    def encode_rows(self, packed, actions, out):
+        """
+        Override the parent method.
+        """
+
+        BoardEncoder.encode_rows(self, packed, actions, out)
+        out[:, 236] = [CATEGORY_VALUES[a] for a in actions]
+
+
+class CompactEncoder(Encoder):
+    """
+    Class that encodes a state-action pair as a piece list: the positions of the 16 pieces followed by the source and
+    destination of the action, all normalized between 0 and 1.
+    """
+
+    name = "compact"
+    num_inputs = 18
+
+    def board_sparse(self, packed):
+        """
+        Override the parent method.
+        """
+
+        indices = []
+        values = []
+
+        for i in range(16):
+            if packed[i] != 0:
+                indices.append(i)
+                values.append(packed[i] / 58.0)
+
+        return indices, values
+
+    def action_sparse(self, action, packed=None):
+        """
+        Override the parent method.
+        """
+
+        if action[0] == 0:
+            return [17], [action[1] / 58.0]
+
+        return [16, 17], [action[0] / 58.0, action[1] / 58.0]
+
+    def encode_rows(self, packed, actions, out):
+        """
+        Override the parent method.
+        """
+
+        out[:, :16] = packed / 58.0
+        out[:, 16:18] = numpy.asarray(actions, dtype=numpy.float32).reshape((-1, 2)) / 58.0
+
+
+def opponent_position(position, order):
+    """
+    Transform a position of the circular track to the coordinates of the (order)th next player (as in
+    Player.get_c_track_pieces_next_player).
+
+    :param position: A position of the circular track (1 to 51) as seen by the player who moves.
+    :param order: 1 for the next player, 2 for the 2nd next player, etc.
+    :return: The position as seen by the (order)th next player.
+    """
+
+    return (position - 13 * order) % 52 or 52
+
+
+def apply_action(packed, action):
+    """
+    Apply an action to a packed board state (like Player.get_next_states, but without checking that the action is
+    legal).
+
+    :param packed: A packed board state.
+    :param action: The action of the player who moves (source and destination of the piece that moves).
+    :return: The packed board state reached by the action (as seen by the same player).
+    """
+
+    src, dst = action
+
+    own = list(packed[:4])
+    own.remove(src)
+    own.append(dst)
+
+    result = sorted(own)
+
+    # Opponent pieces at the destination are knocked back to the start (unless it is a safe square)
+    knock = dst <= 51 and dst not in SAFE_SQUARES
+
+    for order in range(1, 4):
+        pieces = packed[4 * order:4 * order + 4]
+
+        if knock:
+            position = opponent_position(dst, order)
+            pieces = sorted([0 if p == position else p for p in pieces])
+
+        result.extend(pieces)
+
+    return tuple(result)
+
+
+def is_exposed(packed, position):
+    """
+    Determine if a piece of the player who moves at a position would be within reach (1 to 6 squares) of an opponent
+    piece (as in Player.transition_is_defensive).
+
+    :param packed: A packed board state.
+    :param position: A position of the circular track (1 to 51) as seen by the player who moves.
+    :return: True if an opponent piece could knock a piece at the position. False otherwise.
+    """
+
+    for order in range(1, 4):
+        position_in_opponent = (position - 13 * order) % 52
+
+        for i in range(4 * order, 4 * order + 4):
+            if 1 <= packed[i] <= 51 and 0 < position_in_opponent - packed[i] <= 6:
+                return True
+
+    return False
+
+
+def is_vulnerable(packed, position):
+    """
+    Determine if a piece of the player who moves at a position could be knocked: it is in the circular track, in a
+    non-safe square, alone and within reach of an opponent piece.
+
+    :param packed: A packed board state.
+    :param position: A position as seen by the player who moves.
+    :return: True if a piece at the position could be knocked. False otherwise.
+    """
+
+    return 1 <= position <= 51 and position not in DEFENDED_SQUARES and packed[:4].count(position) == 1 and \
+        is_exposed(packed, position)
+
+
+class BoardFeatureEncoder(Encoder):
+    """
+    Class that encodes a board state as a sparse vector of hand-crafted features for linear models: piece-square
+    indicators (the pieces of the player who moves, then the opponent pieces in the circular track as seen by that
+    player) followed by the summary features (see BoardFeatureEncoder.summary). Used for afterstate values.
+    """
+
+    name = "board_features"
+    num_inputs = 120
+
+    # Index of the first piece-square indicator of the opponents
+    opponents_offset = 59
+
+    # Index of the first summary feature
+    summary_offset = 112
+    num_summary = 8
+
+    def __init__(self):
+        """
+        Construct a new feature encoder.
+        """
+
+        Encoder.__init__(self)
+
+        # Last packed board state and its summary (several actions are usually encoded from the same board). The
+        # encoders are shared, so each thread keeps its own.
+        self.last = threading.local()
+
+    def summary(self, packed):
+        """
+        Compute a few features that summarize a board state.
+
+        :param packed: A packed board state.
+        :return: A list of num_summary features: a constant 1 (bias), the progress of the player who moves, the mean and
+        the max progress of the opponents, the fractions of vulnerable pieces of the player who moves and of the
+        opponents, the fraction of pieces of the player who moves at the start and its number of blockades.
+        """
+
+        last = getattr(self.last, "summary", None)
+
+        if last is not None and last[0] == packed:
+            return last[1]
+
+        progress = [sum(packed[4 * o:4 * o + 4]) / 232.0 for o in range(4)]
+
+        own_vulnerable = 0
+        own_blockades = 0
+
+        for position in set(packed[:4]):
+            if is_vulnerable(packed, position):
+                own_vulnerable += 1
+            elif 1 <= position <= 57 and position not in SAFE_SQUARES and packed[:4].count(position) >= 2:
+                own_blockades += 1
+
+        # Opponent pieces that are alone in a non-safe square and within reach of a piece of the player who moves
+        opponents_vulnerable = 0
+
+        for i in range(4, 16):
+            position = packed[i]
+            alone = packed[i - i % 4:i - i % 4 + 4].count(position) == 1
+
+            if 1 <= position <= 51 and position not in DEFENDED_SQUARES and alone:
+                position_in_own = (position + 13 * (i // 4)) % 52 or 52
+
+                for j in range(4):
+                    if 1 <= packed[j] <= 51 and 0 < (position_in_own - packed[j]) % 52 <= 6:
+                        opponents_vulnerable += 1
+                        break
+
+        summary = [1.0,
+                   progress[0],
+                   (progress[1] + progress[2] + progress[3]) / 3.0,
+                   max(progress[1:]),
+                   own_vulnerable / 4.0,
+                   opponents_vulnerable / 12.0,
+                   packed[:4].count(0) / 4.0,
+                   own_blockades / 2.0]
+
+        self.last.summary = (packed, summary)
+
+        return summary
+
+    def board_sparse(self, packed):
+        """
+        Override the parent method.
+        """
+
+        indices = []
+        values = []
+
+        # Pieces of the player who moves (pieces on the same square are consecutive)
+        for i in range(4):
+            if len(indices) > 0 and indices[-1] == packed[i]:
+                values[-1] += 0.25
+            else:
+                indices.append(packed[i])
+                values.append(0.25)
+
+        # Opponent pieces in the circular track (pieces of several opponents can be on the same square)
+        opponents = {}
+
+        for i in range(4, 16):
+            if 1 <= packed[i] <= 51:
+                index = self.opponents_offset + ((packed[i] + 13 * (i // 4)) % 52 or 52)
+                opponents[index] = opponents.get(index, 0.0) + 0.25
+
+        indices.extend(opponents.keys())
+        values.extend(opponents.values())
+
+        for i, value in enumerate(self.summary(packed)):
+            if value != 0:
+                indices.append(self.summary_offset + i)
+                values.append(value)
+
+        return indices, values
+
+
+class FeatureEncoder(BoardFeatureEncoder):
+    """
+    Class that encodes a state-action pair as a sparse vector of hand-crafted features for linear models: the board
+    features (see BoardFeatureEncoder), a few features of the action and the category bits of the action (see the
+    Player.transition_is_**** methods), each multiplied by every summary feature of the board.
+    """
+
+    name = "features"
+    num_inputs = 156
+
+    # Index of the first action feature
+    action_offset = 120
+
+    def categories(self, packed, action):
+        """
+        Find the categories of an action (like Player.get_next_states, but from the packed board state).
+
+        :param packed: A packed board state.
+        :param action: The action (source and destination of the piece that moves).
+        :return: A list of 4 flags (as 0 or 1): defensive, aggressive, fast and release.
+        """
+
+        src, dst = action
+
+        defensive = is_vulnerable(packed, src)
+
+        # A knock is the only way to send opponent pieces back to the start
+        aggressive = False
+
+        if dst <= 51 and dst not in SAFE_SQUARES:
+            for order in range(1, 4):
+                if opponent_position(dst, order) in packed[4 * order:4 * order + 4]:
+                    aggressive = True
+                    break
+
+        # The piece closest to home (not including pieces at the start or at home) moved
+        fast = 0 < src == max([p for p in packed[:4] if p < 58] or [0])
+
+        return [int(defensive), int(aggressive), int(fast), int(src == 0)]
+
+    def action_sparse(self, action, packed=None):
+        """
+        Override the parent method. The packed board state is required.
+        """
+
+        if packed is None:
+            raise ValueError("The " + self.name + " encoder needs the board state to encode an action")
+
+        src, dst = action
+
+        features = [int(dst in SAFE_SQUARES or dst >= 52),
+                    int(dst == 58),
+                    int(is_exposed(packed, dst) if 1 <= dst <= 51 and dst not in DEFENDED_SQUARES and
+                        dst not in packed[:4] else False),
+                    int(dst < 58 and dst not in SAFE_SQUARES and dst in packed[:4])]
+
+        indices = []
+        values = []
+
+        for i, value in enumerate(features):
+            if value != 0:
+                indices.append(self.action_offset + i)
+                values.append(1.0)
+
+        summary = self.summary(packed)
+        offset = self.action_offset + len(features)
+
+        for category in self.categories(packed, action):
+            if category != 0:
+                for i, value in enumerate(summary):
+                    if value != 0:
+                        indices.append(offset + i)
+                        values.append(value)
+
+            offset += self.num_summary
+
+        return indices, values
+
+
+class CategoryFeatureEncoder(BoardFeatureEncoder):
+    """
+    Class that encodes a state-action category pair as a sparse vector of hand-crafted features for linear models: the
+    board features (see BoardFeatureEncoder) and, for the action category (see the Player.****_MOVE constants), every
+    summary feature of the board.
+    """
+
+    name = "category_features"
+    num_inputs = 160
+
+    # Index of the first category feature
+    category_offset = 120
+
+    # Position of each category in the category features
+    category_order = {1: 0, 2: 1, 4: 2, 8: 3, 16: 4}
+
+    def action_sparse(self, action, packed=None):
+        """
+        Override the parent method. The packed board state is required.
+        """
+
+        if packed is None:
+            raise ValueError("The " + self.name + " encoder needs the board state to encode an action")
+
+        indices = []
+        values = []
+
+        offset = self.category_offset + self.category_order[action] * self.num_summary
+
+        for i, value in enumerate(self.summary(packed)):
+            if value != 0:
+                indices.append(offset + i)
+                values.append(value)
+
+        return indices, values
+
+
+class AbstractCategoryEncoder(Encoder):
+    """
+    Class that encodes a state-action category pair as a coarse abstraction of the board (for tables, see table_nn.py):
+    the fraction of the pieces of the player who moves in each zone of the board, the fraction of the opponent pieces
+    in each zone of the circular track (as seen by the player who moves) and the action category (one input per
+    category).
+    """
+
+    name = "abstract_category"
+    num_inputs = 26
+
+    # Number of squares of the circular track in each zone
+    zone_size = 6
+
+    # Index of the first input of the opponents and of the categories
+    opponents_offset = 12
+    category_offset = 21
+
+    # Position of each category in the category inputs
+    category_order = {1: 0, 2: 1, 4: 2, 8: 3, 16: 4}
+
+    def zone(self, position):
+        """
+        Find the zone of a position: 0 for the start, 1 to 9 for the circular track, 10 for the home column and 11 for
+        home.
+
+        :param position: A position (0 to 58).
+        :return: The zone of the position.
+        """
+
+        if position == 0:
+            return 0
+        elif position <= 51:
+            return 1 + (position - 1) // self.zone_size
+        elif position < 58:
+            return 10
+
+        return 11
+
+    def board_sparse(self, packed):
+        """
+        Override the parent method.
+        """
+
+        zones = {}
+
+        for i in range(4):
+            index = self.zone(packed[i])
+            zones[index] = zones.get(index, 0.0) + 0.25
+
+        for i in range(4, 16):
+            if 1 <= packed[i] <= 51:
+                position = (packed[i] + 13 * (i // 4)) % 52 or 52
+                index = self.opponents_offset + (position - 1) // self.zone_size
+                zones[index] = zones.get(index, 0.0) + 0.25
+
+        return zones.keys(), zones.values()
+
+    def action_sparse(self, action, packed=None):
+        """
+        Override the parent method.
+        """
+
+        return [self.category_offset + self.category_order[action]], [1.0]
+
+
+# Registered encoders (by name)
+ENCODERS = {}
+
+
+def register_encoder(encoder):
+    """
+    Make an encoder available by name.
+
+    :param encoder: An instance of an Encoder subclass.
+    """
+
+    ENCODERS[encoder.name] = encoder
+
+
+def get_encoder(name):
+    """
+    Get a registered encoder.
+
+    :param name: Name of the encoder.
+    :return: The encoder.
+    """
+
+    if name not in ENCODERS:
+        raise ValueError("Unknown encoder: " + str(name))
+
+    return ENCODERS[name]
+
+
+def default_encoder_name(num_inputs):
+    """
+    Get the name of the encoder that networks with the given number of inputs use when none is recorded.
+
+    :param num_inputs: Number of inputs to the neural network.
+    :return: The name of the encoder.
+    """
+
+    for name in ["full", "board", "category", "compact", "features", "board_features", "category_features",
+                 "abstract_category"]:
+        if ENCODERS[name].num_inputs == num_inputs:
+            return name
+
+    raise ValueError("No default encoder for " + str(num_inputs) + " inputs")
+
+
+register_encoder(FullEncoder())
+register_encoder(BoardEncoder())
+register_encoder(CategoryEncoder())
+register_encoder(CompactEncoder())
+register_encoder(BoardFeatureEncoder())
+register_encoder(FeatureEncoder())
+register_encoder(CategoryFeatureEncoder())
+register_encoder(AbstractCategoryEncoder())
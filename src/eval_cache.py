@@ -0,0 +1,95 @@
+"""
+eval_cache.py
+
+Provides the EvalCache class, a bounded memo of neural network outputs.
+"""
+
+import collections
+
+
+class EvalCache(object):
+    """
+    Class that remembers neural network outputs by a compact key (e.g. a packed position and an action). The least
+    recently used entries are evicted when the memory budget is exceeded, and all entries are discarded as soon as the
+    weights of the network change.
+    """
+
+    # Approximate memory taken by an entry: the key (a tuple of small integers), the output and the bookkeeping of the
+    # ordered dictionary
+    entry_bytes = 400
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        """
+        Construct a new empty cache.
+
+        :param max_bytes: Memory budget (in bytes) for the entries of the cache.
+        """
+
+        self.max_entries = max(1, max_bytes // EvalCache.entry_bytes)
+        self.entries = collections.OrderedDict()
+
+        # Weights version (see NN.version) the entries were computed with
+        self.version = None
+
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+
+    def hit_rate(self):
+        """
+        Get the fraction of lookups that were answered by the cache.
+
+        :return: A number between 0 and 1 (0 if there were no lookups).
+        """
+
+        lookups = self.hits + self.misses
+
+        if lookups == 0:
+            return 0.0
+
+        return float(self.hits) / lookups
+
+    def get(self, key, version):
+        """
+        Look up the output for a key.
+
+        :param key: The key of the inputs.
+        :param version: Current version of the weights of the network. If it differs from the version of the entries,
+        the cache is emptied.
+        :return: The cached output or None if it is not known.
+        """
+
+        if version != self.version:
+            self.entries.clear()
+            self.version = version
+
+        value = self.entries.pop(key, None)
+
+        if value is None:
+            self.misses += 1
+            return None
+
+        # Re-insert the entry so that it becomes the most recently used one
+        self.entries[key] = value
+        self.hits += 1
+
+        return value
+
+    def put(self, key, value, version):
+        """
+        Remember the output for a key.
+
+        :param key: The key of the inputs.
+        :param value: The output of the network.
+        :param version: Version of the weights of the network the output was computed with.
+        """
+
+        if version != self.version:
+            self.entries.clear()
+            self.version = version
+
+        self.entries[key] = value
+
+        # Evict the least recently used entries
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
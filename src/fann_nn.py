@@ -4,6 +4,9 @@ fann_nn.py
 Provides an interface for a single-output neural network in FANN.
 """
 
+import collections
+
+import numpy
 from fann2 import libfann
 
 
@@ -12,6 +15,12 @@ class FANN(object):
     Class that provides an interface for a single-output neural network in PyBrain.
     """
 
+    # Features supported natively (see nn.CAPABILITIES)
+    capabilities = frozenset(["train", "checkpoint"])
+
+    # Number of neurons in the hidden layer
+    num_hidden = 20
+
     def __init__(self, num_inputs, learning_rate, momentum, src_file=None):
         """
         Constructor for a single-output neural network.
@@ -29,7 +38,7 @@ class FANN(object):
             # Initialize neural network from file
             self.nn.create_from_file(src_file)
         else:
-            self.nn.create_standard_array([num_inputs, 20, 1])
+            self.nn.create_standard_array([num_inputs, FANN.num_hidden, 1])
 
             self.nn.set_activation_function_hidden(libfann.SIGMOID_SYMMETRIC)
             self.nn.set_activation_function_output(libfann.LINEAR)
@@ -42,6 +51,16 @@ class FANN(object):
         self.learning_rate = learning_rate
         self.momentum = momentum
 
+    def set_learning_rate(self, learning_rate):
+        """
+        Change the learning rate used when training the neural network.
+
+        :param learning_rate: New learning rate.
+        """
+
+        self.nn.set_learning_rate(learning_rate)
+        self.learning_rate = learning_rate
+
     def write_to_file(self, dst_file):
         """
         Write the neural network to a file.
@@ -51,6 +70,79 @@ class FANN(object):
 
         self.nn.save(dst_file)
 
+    def get_weights(self):
+        """
+        Get a copy of the weights of each layer (see checkpoint.py).
+
+        :return: A tuple (arrays, metadata): arrays is an ordered dictionary with the float32 arrays w1 (one row per
+        input), b1, w2 and b2. metadata is a dictionary with the activation steepnesses.
+        """
+
+        n_i = self.num_inputs
+        n_h = FANN.num_hidden
+
+        arrays = collections.OrderedDict()
+        arrays["w1"] = numpy.zeros((n_i, n_h), dtype=numpy.float32)
+        arrays["b1"] = numpy.zeros(n_h, dtype=numpy.float32)
+        arrays["w2"] = numpy.zeros(n_h, dtype=numpy.float32)
+        arrays["b2"] = numpy.zeros(1, dtype=numpy.float32)
+
+        # Neurons are numbered consecutively across layers (each layer ends with a bias neuron)
+        for from_neuron, to_neuron, weight in self.connections():
+            if to_neuron <= n_i + n_h:
+                if from_neuron == n_i:
+                    arrays["b1"][to_neuron - n_i - 1] = weight
+                else:
+                    arrays["w1"][from_neuron, to_neuron - n_i - 1] = weight
+            elif from_neuron == n_i + n_h + 1:
+                arrays["b2"][0] = weight
+            else:
+                arrays["w2"][from_neuron - n_i - 1] = weight
+
+        metadata = {"hidden_steepness": self.nn.get_activation_steepness(1, 0),
+                    "output_steepness": self.nn.get_activation_steepness(2, 0)}
+
+        return arrays, metadata
+
+    def set_weights(self, arrays, metadata):
+        """
+        Replace the weights of each layer (see FANN.get_weights).
+
+        :param arrays: An ordered dictionary with the arrays w1, b1, w2 and b2.
+        :param metadata: A dictionary with the activation steepnesses.
+        """
+
+        n_i = self.num_inputs
+        n_h = FANN.num_hidden
+
+        for from_neuron, to_neuron, weight in self.connections():
+            if to_neuron <= n_i + n_h:
+                if from_neuron == n_i:
+                    weight = arrays["b1"][to_neuron - n_i - 1]
+                else:
+                    weight = arrays["w1"][from_neuron, to_neuron - n_i - 1]
+            elif from_neuron == n_i + n_h + 1:
+                weight = arrays["b2"][0]
+            else:
+                weight = arrays["w2"][from_neuron - n_i - 1]
+
+            self.nn.set_weight(from_neuron, to_neuron, float(weight))
+
+        if "hidden_steepness" in metadata:
+            self.nn.set_activation_steepness_hidden(metadata["hidden_steepness"])
+
+        if "output_steepness" in metadata:
+            self.nn.set_activation_steepness_output(metadata["output_steepness"])
+
+    def connections(self):
+        """
+        List the connections of the network.
+
+        :return: A list of tuples (from_neuron, to_neuron, weight).
+        """
+
+        return [(c.from_neuron, c.to_neuron, c.weight) for c in self.nn.get_connection_array()]
+
     def train_with_datapoint(self, inputs, target):
         """
         Train the neural network with a single data point.
@@ -0,0 +1,212 @@
+"""
+frozen_nn.py
+
+Provides an inference-only version of a trained single-output neural network. The weights are quantized (to int8 with
+one scale per layer, or to float16) and memory-mapped from the exported file, so processes that load the same file
+(e.g. forked evaluation workers) share a single physical copy of them.
+"""
+
+import collections
+
+import numpy
+
+import checkpoint
+
+# Supported precisions for the weight matrices
+PRECISIONS = {"int8": numpy.int8, "float16": numpy.float16}
+
+
+def quantize(weights, precision):
+    """
+    Quantize a weight matrix.
+
+    :param weights: A float array.
+    :param precision: "int8" or "float16".
+    :return: A tuple (quantized, scale) such that weights ~= quantized * scale.
+    """
+
+    if precision == "float16":
+        return weights.astype(numpy.float16), 1.0
+
+    max_abs = float(numpy.abs(weights).max())
+    scale = max_abs / 127.0 if max_abs > 0 else 1.0
+
+    return numpy.round(weights / scale).astype(numpy.int8), scale
+
+
+def export_frozen(nn, dst_file, precision="int8"):
+    """
+    Export a neural network to a frozen model file.
+
+    :param nn: The neural network to export (NN).
+    :param dst_file: Name of the file where to write the frozen model.
+    :param precision: "int8" (one scale per layer) or "float16".
+    """
+
+    if precision not in PRECISIONS:
+        raise ValueError("Unsupported precision: " + str(precision))
+
+    weights, metadata = nn.get_weights()
+
+    arrays = collections.OrderedDict()
+    arrays["w1"], metadata["w1_scale"] = quantize(weights["w1"], precision)
+    arrays["b1"] = weights["b1"].astype(numpy.float32)
+    arrays["w2"], metadata["w2_scale"] = quantize(weights["w2"], precision)
+    arrays["b2"] = weights["b2"].astype(numpy.float32)
+
+    metadata["precision"] = precision
+
+    checkpoint.write_checkpoint(dst_file, arrays, metadata)
+
+
+def is_frozen(metadata):
+    """
+    Determine if a checkpoint contains a frozen model.
+
+    :param metadata: Metadata read from the checkpoint.
+    :return: True if the checkpoint was written by export_frozen(...). False otherwise.
+    """
+
+    return "precision" in metadata
+
+
+class FrozenNN(object):
+    """
+    Class that provides an inference-only interface for a single-output neural network exported by export_frozen(...).
+    """
+
+    # Features supported natively (see nn.CAPABILITIES). The weights cannot be changed.
+    capabilities = frozenset(["sparse", "batch", "accumulator"])
+
+    def __init__(self, num_inputs, learning_rate, momentum, src_file=None, loaded=None):
+        """
+        Load a frozen single-output neural network.
+
+        :param num_inputs: Number of inputs to the neural network.
+        :param learning_rate: Ignored.
+        :param momentum: Ignored.
+        :param src_file: Name of the file written by export_frozen(...).
+        :param loaded: The tuple (arrays, metadata) already read from src_file with checkpoint.read_checkpoint(...)
+        (memory-mapped), if any. Otherwise, the file is read.
+        """
+
+        if src_file is None:
+            raise ValueError("A frozen neural network must be loaded from a file")
+
+        if loaded is None:
+            loaded = checkpoint.read_checkpoint(src_file, mmap=True)
+
+        arrays, metadata = loaded
+
+        if not is_frozen(metadata):
+            raise ValueError(src_file + " does not contain a frozen neural network")
+
+        if metadata["num_inputs"] != num_inputs:
+            raise ValueError(src_file + " contains a network with " + str(metadata["num_inputs"]) + " inputs")
+
+        self.num_inputs = num_inputs
+        self.src_file = src_file
+        self.precision = metadata["precision"]
+
+        # Memory-mapped (read-only) weights
+        self.w1 = arrays["w1"]
+        self.b1 = numpy.asarray(arrays["b1"], dtype=numpy.float64)
+        self.w2 = numpy.asarray(arrays["w2"], dtype=numpy.float64) * metadata["w2_scale"]
+        self.b2 = float(arrays["b2"][0])
+
+        self.w1_scale = metadata["w1_scale"]
+        self.hidden_steepness = metadata["hidden_steepness"]
+        self.output_steepness = metadata["output_steepness"]
+
+    def get_weights(self):
+        """
+        Get a copy of the (dequantized) weights of each layer (see checkpoint.py).
+
+        :return: A tuple (arrays, metadata) like NumpyNN.get_weights().
+        """
+
+        arrays = collections.OrderedDict()
+        arrays["w1"] = (self.w1 * self.w1_scale).astype(numpy.float32)
+        arrays["b1"] = self.b1.astype(numpy.float32)
+        arrays["w2"] = self.w2.astype(numpy.float32)
+        arrays["b2"] = numpy.array([self.b2], dtype=numpy.float32)
+
+        metadata = {"hidden_steepness": self.hidden_steepness,
+                    "output_steepness": self.output_steepness}
+
+        return arrays, metadata
+
+    def write_to_file(self, dst_file):
+        """
+        Write the frozen model to another file.
+
+        :param dst_file: Name of the file where to write the network.
+        """
+
+        arrays, metadata = checkpoint.read_checkpoint(self.src_file, mmap=True)
+        checkpoint.write_checkpoint(dst_file, arrays, metadata)
+
+    def accumulate(self, indices, values, pre_activation=None):
+        """
+        Add the contribution of some sparse inputs to the weighted sums of the hidden neurons.
+
+        :param indices: Indices of the inputs to add (as a list).
+        :param values: Values of the inputs to add (as a list). Negative values remove inputs.
+        :param pre_activation: Weighted sums to start from. If None, start from the biases (i.e. no inputs).
+        :return: The new weighted sums of the hidden neurons (pre_activation is not modified).
+        """
+
+        if pre_activation is None:
+            pre_activation = self.b1
+
+        if len(indices) == 0:
+            return pre_activation.copy()
+
+        return pre_activation + self.w1_scale * numpy.asarray(values, dtype=numpy.float64).dot(self.w1[indices])
+
+    def evaluate_pre_activation(self, pre_activation):
+        """
+        Get the output of the neural network given the weighted sums of the hidden neurons.
+
+        :param pre_activation: Weighted sums of the hidden neurons (see FrozenNN.accumulate).
+        :return: The output of the neural network (as a number).
+        """
+
+        hidden = numpy.tanh(self.hidden_steepness * pre_activation)
+
+        return float(self.output_steepness * (hidden.dot(self.w2) + self.b2))
+
+    def evaluate(self, inputs):
+        """
+        Get the output of the neural network given the specified inputs.
+
+        :param inputs: Inputs to the neural network (as a list).
+        :return: The output of the neural network (as a number).
+        """
+
+        x = numpy.asarray(inputs, dtype=numpy.float64)
+
+        return self.evaluate_pre_activation(self.b1 + self.w1_scale * x.dot(self.w1))
+
+    def evaluate_batch(self, rows):
+        """
+        Get the outputs of the neural network for a batch of inputs (with a single matrix product per layer).
+
+        :param rows: An array with one row of inputs per data point.
+        :return: The outputs of the neural network (as a list of numbers).
+        """
+
+        hidden = numpy.tanh(self.hidden_steepness * (self.b1 + self.w1_scale * numpy.asarray(rows).dot(self.w1)))
+
+        return (self.output_steepness * (hidden.dot(self.w2) + self.b2)).tolist()
+
+    def evaluate_sparse(self, indices, values):
+        """
+        Get the output of the neural network given the specified inputs in sparse form.
+
+        :param indices: Indices of the non-zero inputs (as a list).
+        :param values: Values of the non-zero inputs (as a list).
+        :return: The output of the neural network (as a number).
+        """
+
+        return self.evaluate_pre_activation(self.accumulate(indices, values))
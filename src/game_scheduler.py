@@ -0,0 +1,135 @@
+"""
+game_scheduler.py
+
+Provides a scheduler that plays several Ludo games at once in a single process. Each game runs as a generator (see
+Ludo.play_steps) that stops whenever a player needs the outputs of a neural network. When every running game is waiting,
+the requests of all of them are evaluated together (in one batch per network) and the games are resumed. This gives the
+speed of batched evaluation without other processes.
+"""
+
+import collections
+
+
+class GameScheduler(object):
+    """
+    Class that plays several Ludo games at once, batching the neural network evaluations of all of them.
+    """
+
+    def __init__(self, max_games=16):
+        """
+        Construct a new scheduler.
+
+        :param max_games: Maximum number of games played at once.
+        """
+
+        self.max_games = max_games
+
+        # Statistics: number of batches and of outputs evaluated (some of them may have been found in caches)
+        self.batches = 0
+        self.rows = 0
+
+    @staticmethod
+    def advance(steps, outputs):
+        """
+        Resume a game until it needs the outputs of a neural network or ends.
+
+        :param steps: The generator of the game (see Ludo.play_steps).
+        :param outputs: The outputs requested by the game the last time (None the first time).
+        :return: The next request of the game, or None if the game ended.
+        """
+
+        try:
+            return steps.send(outputs)
+        except StopIteration:
+            return None
+
+    def evaluate(self, requests):
+        """
+        Evaluate the requests of several games, in one batch per neural network.
+
+        :param requests: A list of requests (see Player.move_steps).
+        :return: A list with the outputs of each request.
+        """
+
+        # Requests grouped by network
+        groups = collections.OrderedDict()
+
+        for r in range(len(requests)):
+            groups.setdefault(id(requests[r][0]), []).append(r)
+
+        outputs = [None, ] * len(requests)
+
+        for group in groups.values():
+            nn = requests[group[0]][0]
+            keys = []
+            packed = []
+            actions = []
+
+            for r in group:
+                keys.extend(requests[r][1])
+                packed.extend(requests[r][2])
+                actions.extend(requests[r][3])
+
+            values = nn.evaluate_keys(keys, packed, actions)
+            offset = 0
+
+            for r in group:
+                outputs[r] = values[offset:offset + len(requests[r][1])]
+                offset += len(requests[r][1])
+
+            self.batches += 1
+            self.rows += len(keys)
+
+        return outputs
+
+    def play(self, games):
+        """
+        Play games, max_games at a time, and yield each game when it ends.
+
+        :param games: An iterable of Ludo games ready to start. It is consumed lazily: a new game is only taken when
+        another one ends (so e.g. its players can depend on the results of the games before it).
+        """
+
+        games = iter(games)
+        exhausted = False
+
+        # Games in progress with their generators and their pending requests
+        running = []
+
+        while True:
+            # Start new games until max_games are running
+            while not exhausted and len(running) < self.max_games:
+                try:
+                    game = next(games)
+                except StopIteration:
+                    exhausted = True
+                    break
+
+                steps = game.play_steps()
+                request = GameScheduler.advance(steps, None)
+
+                if request is None:
+                    yield game
+                else:
+                    running.append((game, steps, request))
+
+            if len(running) == 0:
+                return
+
+            # Evaluate the requests of all the games together and resume them
+            outputs = self.evaluate([request for game, steps, request in running])
+            finished = []
+            waiting = []
+
+            for (game, steps, request), values in zip(running, outputs):
+                request = GameScheduler.advance(steps, values)
+
+                if request is None:
+                    finished.append(game)
+                else:
+                    waiting.append((game, steps, request))
+
+            running = waiting
+
+            for game in finished:
+                yield game
@@ -0,0 +1,192 @@
+"""
+health.py
+
+Provides a numerical health monitor for long trainings: the outputs and the targets of the neural network are checked as
+they are computed (a NaN, an infinity or an absurdly large value raises NumericalError before it reaches the weights),
+the norm of the weights is checked at every checkpoint, and a failed check rolls the network back to its last good
+snapshot, writes a diagnostic file and lowers the learning rate, so that the training goes on instead of ending.
+"""
+
+import json
+import math
+import os
+import time
+
+import numpy
+
+# Largest magnitude of a healthy output or target (the rewards and the Q values are of the order of 1)
+MAX_VALUE = 1e6
+
+
+def healthy(value):
+    """
+    Check a number cheaply.
+
+    :param value: A number (e.g. the sum of several outputs, which is NaN or infinite if any of them is).
+    :return: True if the number is finite and at most MAX_VALUE in magnitude. False otherwise.
+    """
+
+    # Comparisons with NaN are always False
+    return -MAX_VALUE <= value <= MAX_VALUE
+
+
+def to_json(value):
+    """
+    Convert the details of a NumericalError to something JSON can write.
+
+    :param value: A number, a NumPy array or scalar, a list, a tuple or a dictionary of those, or anything else.
+    :return: The value made of lists, dictionaries, numbers and strings (NaN and infinities are written as strings).
+    """
+
+    if isinstance(value, numpy.ndarray):
+        value = value.tolist()
+    elif isinstance(value, numpy.generic):
+        value = value.item()
+
+    if isinstance(value, dict):
+        return dict((str(key), to_json(item)) for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        return [to_json(item) for item in value]
+    elif isinstance(value, float):
+        return value if not (math.isnan(value) or math.isinf(value)) else str(value)
+    elif isinstance(value, (int, long, basestring)) or value is None:
+        return value
+
+    return repr(value)
+
+
+class NumericalError(ArithmeticError):
+    """
+    Exception raised when a neural network produces a value that is not healthy (see healthy).
+    """
+
+    def __init__(self, message, details=None):
+        """
+        Construct a new exception.
+
+        :param message: Description of the failed check.
+        :param details: A dictionary with what led to the value (e.g. the inputs and the targets), for the diagnostic
+        file (see HealthMonitor.recover).
+        """
+
+        ArithmeticError.__init__(self, message)
+
+        self.details = details if details is not None else {}
+
+
+class HealthMonitor(object):
+    """
+    Class that keeps the last good snapshot of a neural network and rolls the network back to it when a numerical check
+    fails.
+    """
+
+    def __init__(self, nn, dump_prefix=None, lr_decay=0.5, max_rollbacks=10, max_weight_norm=1e4, rollbacks=0):
+        """
+        Construct a new monitor (the current weights are not snapshotted until HealthMonitor.save_good is called).
+
+        :param nn: The neural network (see NN).
+        :param dump_prefix: Prefix of the diagnostic files (dump_prefix.divergence.<episode>.json). If None, no files
+        are written.
+        :param lr_decay: Factor of the learning rate of the network after each rollback (1 to keep it).
+        :param max_rollbacks: Number of rollbacks after which the error is raised again (the training is not going
+        anywhere).
+        :param max_weight_norm: Largest norm of healthy weights (the Euclidean norm of all of them).
+        :param rollbacks: Number of rollbacks already done (e.g. before the training was resumed, see
+        QLTrainer.load_state).
+        """
+
+        self.nn = nn
+        self.dump_prefix = dump_prefix
+        self.lr_decay = lr_decay
+        self.max_rollbacks = max_rollbacks
+        self.max_weight_norm = max_weight_norm
+
+        self.good = None
+        self.good_time = None
+        self.rollbacks = rollbacks
+
+    def weight_norm(self):
+        """
+        Get the norm of the weights of the network.
+
+        :return: The Euclidean norm of all the weights (NaN if any of them is NaN). Integer arrays (e.g. the keys and
+        the visit counts of a table) are not weights, so they are left out.
+        """
+
+        arrays, metadata = self.nn.get_weights()
+
+        return math.sqrt(sum(float(numpy.dot(a.ravel().astype(numpy.float64), a.ravel().astype(numpy.float64)))
+                             for a in arrays.values() if numpy.issubdtype(a.dtype, numpy.floating)))
+
+    def check_weights(self):
+        """
+        Check the norm of the weights of the network.
+
+        :raise NumericalError: If the norm is not finite or is above max_weight_norm.
+        """
+
+        norm = self.weight_norm()
+
+        if not (healthy(norm) and norm <= self.max_weight_norm):
+            raise NumericalError("The norm of the weights is " + str(norm), {"weight_norm": norm})
+
+    def save_good(self):
+        """
+        Check the weights of the network and keep a snapshot of them as the last good one (e.g. at every checkpoint).
+
+        :raise NumericalError: If the weights fail the check (the last good snapshot is kept).
+        """
+
+        self.check_weights()
+
+        self.good = self.nn.get_state()
+        self.good_time = time.time()
+
+    def dump(self, error, episode):
+        """
+        Write a diagnostic file for an error (see HealthMonitor.dump_prefix).
+
+        :param error: The NumericalError.
+        :param episode: Number of the episode where the error happened.
+        :return: The name of the file, or None if no file was written.
+        """
+
+        if self.dump_prefix is None:
+            return None
+
+        dst_file = "%s.divergence.%d.json" % (self.dump_prefix, episode)
+
+        diagnostic = {"message": str(error),
+                      "episode": episode,
+                      "time": time.time(),
+                      "good_time": self.good_time,
+                      "rollbacks": self.rollbacks,
+                      "learning_rate": self.nn.learning_rate,
+                      "weight_norm": self.weight_norm(),
+                      "details": error.details}
+
+        with open(dst_file, "w") as f:
+            json.dump(to_json(diagnostic), f, indent=2, sort_keys=True)
+
+        return dst_file
+
+    def recover(self, error, episode):
+        """
+        Recover from an error: write a diagnostic file, restore the last good snapshot and lower the learning rate.
+
+        :param error: The NumericalError.
+        :param episode: Number of the episode where the error happened.
+        :raise NumericalError: The error itself if there is no good snapshot or after max_rollbacks rollbacks.
+        """
+
+        self.rollbacks += 1
+        dst_file = self.dump(error, episode)
+
+        if self.good is None or self.rollbacks > self.max_rollbacks:
+            raise error
+
+        self.nn.set_state(*self.good)
+        self.nn.set_learning_rate(self.nn.learning_rate * self.lr_decay)
+
+        print "Episode %d: %s. Rolled back to the last good weights (learning rate %g%s)." % \
+              (episode, error, self.nn.learning_rate, "" if dst_file is None else ", see " + os.path.basename(dst_file))
@@ -0,0 +1,183 @@
+"""
+hogwild_trainer.py
+
+Provides a Q-Learning trainer that plays the training episodes in several processes at the same time. All the processes
+train the same neural network: its weights live in shared memory (see NN.share_weights) and are updated without locks
+(Hogwild!). A parent process hands out the episodes, sets the exploration rate and writes the checkpoints.
+"""
+
+import multiprocessing
+import random
+import time
+
+import numpy
+
+from checkpoint import CheckpointWriter
+from nn import NN
+from ql_trainer import QLTrainer
+
+
+class HogwildTrainer(QLTrainer):
+    """
+    Class that provides a multi-process Q-Learning trainer for a Ludo game.
+    """
+
+    # Seconds between checks of the progress of the workers
+    poll_interval = 0.5
+
+    def __init__(self, num_episodes, nn_file_dst, num_workers=None, nn_file_src=None, debug=False, nn_backend="numpy",
+                 afterstate=False, keep_checkpoints=3, nn_encoder=None, learning_rate=None, discount_rate=None,
+                 nn_learning_rate=None, nn_momentum=None, nn_backend_options=None):
+        """
+        Constructor for a new trainer.
+
+        :param num_episodes: Number of episodes to train the network with (in total, across all the workers).
+        :param nn_file_dst: The name of a file where to store the resulting neural network (as a binary checkpoint).
+        :param num_workers: Number of processes that play episodes. If None, one per CPU.
+        :param nn_file_src: The name of a file where to retrieve an existing neural network and use it as the starting
+        point. If no file is provided, the neural network will be initialize with random weights.
+        :param debug: If True, print debugging information.
+        :param nn_backend: Name of the implementation of the neural network (see NN). Its weights must be shareable
+        ("numpy" or "linear").
+        :param afterstate: If True, the Q-Learning players learn the values of afterstates (see QLPlayer).
+        :param keep_checkpoints: Number of periodic checkpoints to keep next to nn_file_dst (as nn_file_dst.<episode>).
+        :param nn_encoder: Name of the encoder of the neural network inputs (see QLTrainer).
+        :param learning_rate: The Q-Learning rate of the players (see QLTrainer).
+        :param discount_rate: The discount rate of the players (see QLTrainer).
+        :param nn_learning_rate: The learning rate of the network (see QLTrainer).
+        :param nn_momentum: The learning momentum of the network (see QLTrainer).
+        :param nn_backend_options: Extra arguments of the backend of the network (see QLTrainer).
+        """
+
+        QLTrainer.__init__(self, num_episodes, nn_file_dst, nn_file_src, debug, nn_backend, afterstate,
+                           keep_checkpoints=keep_checkpoints, nn_encoder=nn_encoder, learning_rate=learning_rate,
+                           discount_rate=discount_rate, nn_learning_rate=nn_learning_rate, nn_momentum=nn_momentum,
+                           nn_backend_options=nn_backend_options)
+
+        if num_workers is None:
+            num_workers = multiprocessing.cpu_count()
+
+        self.num_workers = num_workers
+
+        # The workers are forked after this point, so they all see the same weights
+        self.nn.share_weights()
+
+        # Progress shared with the workers: episodes handed out, episodes finished and wins of each player
+        self.next_episode = multiprocessing.Value("l", 0)
+        self.finished = multiprocessing.Value("l", 0)
+        self.wins = multiprocessing.RawArray("l", 4)
+
+        # Exploration rate of the episodes that start now (set by the parent)
+        self.current_epsilon = multiprocessing.RawValue("d", QLTrainer.max_epsilon)
+
+    def work(self):
+        """
+        Play training episodes until all of them have been handed out (runs in each worker process).
+        """
+
+        # Forked workers would otherwise roll the same dice
+        random.seed()
+        numpy.random.seed()
+
+        while True:
+            with self.next_episode.get_lock():
+                if self.next_episode.value >= self.num_episodes:
+                    break
+
+                self.next_episode.value += 1
+
+            winner = self.play_episode(self.current_epsilon.value)
+
+            with self.finished.get_lock():
+                self.finished.value += 1
+
+                if winner is not None:
+                    self.wins[winner] += 1
+
+    def snapshot(self):
+        """
+        Copy the shared weights, so that the parent can test them while the workers go on training them.
+
+        :return: A neural network (NN) with a copy of the current weights.
+        """
+
+        nn = NN(self.nn.num_inputs, None, self.nn.backend, self.nn.encoder.name,
+                backend_options=self.nn.backend_options)
+        nn.set_weights(*self.nn.get_weights())
+
+        return nn
+
+    def train(self, test=False):
+        """
+        Override the parent method.
+        """
+
+        if self.debug:
+            print "===================================================================================================="
+            print "| TRAINING STARTED                                                                                 |"
+            print "===================================================================================================="
+            print
+
+        # Test initially
+        if test:
+            self.print_tests(0)
+
+        # The workers are started before the checkpoint writer's thread (forking copies only the calling thread)
+        workers = [multiprocessing.Process(target=self.work) for w in range(self.num_workers)]
+
+        for worker in workers:
+            worker.start()
+
+        writer = CheckpointWriter(self.nn_file_dst, self.keep_checkpoints)
+        start_time = time.time()
+
+        # Save the neural network every QLTrainer.checkpoint_every episodes and test it every QLTrainer.test_every
+        # episodes
+        next_checkpoint = 0
+        next_test = QLTrainer.test_every
+
+        while any(worker.is_alive() for worker in workers):
+            time.sleep(HogwildTrainer.poll_interval)
+
+            episode = self.finished.value
+            self.current_epsilon.value = self.epsilon(episode)
+
+            if episode >= next_checkpoint:
+                arrays, metadata = self.nn.get_weights()
+                metadata["episode"] = episode
+                writer.save(arrays, metadata, episode)
+
+                if self.debug:
+                    print "Episodes: %d/%d (%.1f per second)" % (episode, self.num_episodes,
+                                                                 episode / (time.time() - start_time))
+
+                next_checkpoint = (episode // QLTrainer.checkpoint_every + 1) * QLTrainer.checkpoint_every
+
+            if test and episode >= next_test:
+                self.print_tests(episode, nn=self.snapshot())
+
+                next_test = (episode // QLTrainer.test_every + 1) * QLTrainer.test_every
+
+        for worker in workers:
+            worker.join()
+
+        if any(worker.exitcode != 0 for worker in workers):
+            writer.close()
+            raise RuntimeError("A training worker failed")
+
+        # Save the final neural network to the specified file
+        arrays, metadata = self.nn.get_weights()
+        metadata["episode"] = self.num_episodes
+        writer.save(arrays, metadata, self.num_episodes)
+        writer.close()
+
+        # Display the percentage of wins
+        wins = [w * 100.0 / self.num_episodes for w in self.wins]
+
+        if self.debug:
+            print "Wins: " + str(wins)
+            print
+            print "===================================================================================================="
+            print "| TRAINING ENDED                                                                                   |"
+            print "===================================================================================================="
+            print
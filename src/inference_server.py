@@ -0,0 +1,247 @@
+"""
+inference_server.py
+
+Provides an inference server: a process that owns a neural network and evaluates it for many client processes (see
+server_nn.py). The requests that arrive close together are evaluated in a single batch (one matrix product instead of
+one small product per request), which keeps the vector units busy when many processes play at the same time.
+
+Usage:
+
+    server = InferenceServer(NN(238, "trained.nn", "numpy"))
+    server.start()
+
+    # Processes forked from now on can use NN(238, backend="server")
+    ...
+
+    server.stop()
+"""
+
+import json
+import multiprocessing
+import os
+import select
+import socket
+import tempfile
+import time
+
+import numpy
+
+from metrics import Histogram
+from server_nn import REQUEST_HEADER
+from server_nn import STATS_HEADER
+from server_nn import request_stats
+
+
+class InferenceServer(object):
+    """
+    Class that provides an inference server for a neural network.
+    """
+
+    def __init__(self, nn, address=None, max_batch=256, max_wait=0.002):
+        """
+        Construct a new inference server (not started yet).
+
+        :param nn: The neural network to evaluate (NN).
+        :param address: Path of the Unix socket the server listens on. If None, a new path in the temporary directory.
+        :param max_batch: Number of rows that are evaluated as soon as they are pending.
+        :param max_wait: Maximum number of seconds a request waits for other requests to join its batch (the batch is
+        also evaluated when all the clients that ask for outputs are waiting).
+        """
+
+        if address is None:
+            address = os.path.join(tempfile.mkdtemp(), "nn.sock")
+
+        self.nn = nn
+        self.address = address
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.process = None
+
+        # Statistics (kept by the server process, see InferenceServer.summary)
+        self.requests = 0
+        self.rows = 0
+        self.batches = 0
+        self.latency = Histogram()
+        self.batch_rows = Histogram()
+
+    def start(self):
+        """
+        Start the server process. The address of the server is stored in the LUDO_NN_SERVER environment variable, so
+        that the processes forked (or started) afterwards can use the "server" backend (see NN).
+        """
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.address)
+        listener.listen(128)
+
+        self.process = multiprocessing.Process(target=self.serve, args=(listener, ))
+        self.process.daemon = True
+        self.process.start()
+
+        # The server process has its own copy of the listener
+        listener.close()
+
+        os.environ["LUDO_NN_SERVER"] = self.address
+
+    def stop(self):
+        """
+        Stop the server process.
+        """
+
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+            self.process = None
+
+        if os.environ.get("LUDO_NN_SERVER") == self.address:
+            del os.environ["LUDO_NN_SERVER"]
+
+        if os.path.exists(self.address):
+            os.remove(self.address)
+
+    def stats(self):
+        """
+        Get the statistics of the running server (see InferenceServer.summary).
+
+        :return: A dictionary.
+        """
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.address)
+
+        try:
+            return request_stats(sock)
+        finally:
+            sock.close()
+
+    def summary(self):
+        """
+        Get the statistics kept by the server process: number of inputs, requests, rows and batches evaluated, and
+        histograms of the latency of the requests (in microseconds, from their arrival to their answer) and of the
+        number of rows per batch.
+
+        :return: A dictionary.
+        """
+
+        return {"num_inputs": self.nn.num_inputs,
+                "requests": self.requests,
+                "rows": self.rows,
+                "batches": self.batches,
+                "latency_us": self.latency.to_dict(),
+                "batch_rows": self.batch_rows.to_dict()}
+
+    def serve(self, listener):
+        """
+        Answer requests until the process is terminated (runs in the server process).
+
+        :param listener: A listening Unix socket.
+        """
+
+        clients = []
+
+        # Bytes received from each client that do not make a complete request yet, and clients that ask for outputs
+        # (connections that only ask for the statistics never wait for a batch)
+        buffers = {}
+        players = set()
+
+        # Requests waiting for their batch: (client, arrival time, row lengths, indices, values)
+        pending = []
+        pending_rows = 0
+
+        while True:
+            # Wait for requests, but not longer than the oldest pending request may wait
+            timeout = None
+
+            if len(pending) > 0:
+                timeout = max(0.0, pending[0][1] + self.max_wait - time.time())
+
+            readable = select.select([listener] + clients, [], [], timeout)[0]
+
+            for sock in readable:
+                if sock is listener:
+                    client = listener.accept()[0]
+                    clients.append(client)
+                    buffers[client] = ""
+                    continue
+
+                # A single read never blocks once select reported the socket: a request sent in several pieces is kept
+                # until it is complete, so a slow client cannot stall the others
+                data = sock.recv(65536)
+
+                if len(data) == 0:
+                    clients.remove(sock)
+                    players.discard(sock)
+                    del buffers[sock]
+                    sock.close()
+                    continue
+
+                data = buffers[sock] + data
+
+                while len(data) >= REQUEST_HEADER.size:
+                    num_rows, num_values = REQUEST_HEADER.unpack_from(data)
+                    end = REQUEST_HEADER.size + 2 * num_rows + 6 * num_values
+
+                    if len(data) < end:
+                        break
+
+                    body = data[REQUEST_HEADER.size:end]
+                    data = data[end:]
+
+                    if num_rows == 0:
+                        stats = json.dumps(self.summary())
+                        sock.sendall(STATS_HEADER.pack(len(stats)) + stats)
+                        continue
+
+                    row_lengths = numpy.frombuffer(body, dtype=numpy.uint16, count=num_rows)
+                    indices = numpy.frombuffer(body, dtype=numpy.uint16, count=num_values, offset=2 * num_rows)
+                    values = numpy.frombuffer(body, dtype=numpy.float32, count=num_values,
+                                              offset=2 * num_rows + 2 * num_values)
+
+                    pending.append((sock, time.time(), row_lengths, indices, values))
+                    pending_rows += num_rows
+                    players.add(sock)
+
+                buffers[sock] = data
+
+            # Evaluate the batch when it is full, when it waited long enough or when no other request can join it
+            if len(pending) > 0 and (pending_rows >= self.max_batch or len(pending) >= len(players) or
+                                     time.time() >= pending[0][1] + self.max_wait):
+                self.evaluate(pending, pending_rows)
+                pending = []
+                pending_rows = 0
+
+    def evaluate(self, pending, num_rows):
+        """
+        Evaluate a batch of requests and send the outputs to their clients.
+
+        :param pending: The requests (see InferenceServer.serve).
+        :param num_rows: Total number of rows of the requests.
+        """
+
+        rows = numpy.zeros((num_rows, self.nn.num_inputs), dtype=numpy.float32)
+        offset = 0
+
+        for sock, arrival, row_lengths, indices, values in pending:
+            row_ids = numpy.repeat(numpy.arange(offset, offset + len(row_lengths)), row_lengths)
+            rows[row_ids, indices] = values
+            offset += len(row_lengths)
+
+        outputs = numpy.asarray(self.nn.evaluate_batch(rows), dtype=numpy.float64)
+        offset = 0
+        now = time.time()
+
+        for sock, arrival, row_lengths, indices, values in pending:
+            try:
+                sock.sendall(outputs[offset:offset + len(row_lengths)].tostring())
+            except socket.error:
+                # The client is gone (its connection is closed when select reports it)
+                pass
+
+            offset += len(row_lengths)
+
+            self.latency.add((now - arrival) * 1e6)
+
+        self.requests += len(pending)
+        self.rows += num_rows
+        self.batches += 1
+        self.batch_rows.add(num_rows)
@@ -0,0 +1,227 @@
+"""
+linear_nn.py
+
+Provides a linear model with the interface of a single-output neural network. It is meant for sparse feature vectors
+with a few tens of active features (see FeatureEncoder, BoardFeatureEncoder and CategoryFeatureEncoder in encoders.py):
+evaluating and training cost O(number of active features), so it can be trained for many more episodes than the neural
+networks in the same time.
+"""
+
+import collections
+
+import numpy
+
+import checkpoint
+from nn import NN
+
+
+class LinearNN(object):
+    """
+    Class that provides a linear model (a weighted sum of the inputs plus a bias) with the interface of a single-output
+    neural network.
+    """
+
+    # Features supported natively (see nn.CAPABILITIES)
+    capabilities = frozenset(["train", "sparse", "batch", "accumulator", "checkpoint", "shared", "state"])
+
+    def __init__(self, num_inputs, learning_rate, momentum, src_file=None, step_size=0.1):
+        """
+        Constructor for a linear model.
+
+        :param num_inputs: Number of inputs to the model.
+        :param learning_rate: Learning rate of the model: it scales the step size by learning_rate / NN.learning_rate.
+        :param momentum: Ignored.
+        :param src_file: If None, then all the weights are initialized with 0. Otherwise, the model is loaded from the
+        file (a checkpoint written by LinearNN.write_to_file).
+        :param step_size: Step size of the updates at the default learning rate (NN.learning_rate). Each update is
+        divided by the squared norm of the inputs (normalized least mean squares), so the step size does not depend on
+        the number of active features. It is set through the backend options of NN (e.g. nn_backend_options of
+        QLTrainer).
+        """
+
+        self.num_inputs = num_inputs
+        self.base_step_size = step_size
+        self.set_learning_rate(learning_rate)
+
+        # The weights and the bias live in a single flat array (the bias is the last element)
+        self.params = numpy.zeros(num_inputs + 1)
+        self.w, self.b = self.params[:num_inputs], self.params[num_inputs:]
+
+        if src_file is not None:
+            arrays, metadata = checkpoint.read_checkpoint(src_file, mmap=False)
+            self.set_weights(arrays, metadata)
+
+    def set_learning_rate(self, learning_rate):
+        """
+        Change the learning rate used when training the model (the step size changes in proportion).
+
+        :param learning_rate: New learning rate.
+        """
+
+        self.learning_rate = learning_rate
+        self.step_size = self.base_step_size * learning_rate / NN.learning_rate
+
+    def use_params(self, flat):
+        """
+        Move the weights into an existing array (e.g. one in shared memory, see NN.share_weights). The weights are
+        copied into it and, from then on, read and updated in place there.
+
+        :param flat: A float64 array with self.num_inputs + 1 elements.
+        """
+
+        flat[:] = self.params
+        self.params = flat
+        self.w, self.b = self.params[:self.num_inputs], self.params[self.num_inputs:]
+
+    def get_weights(self):
+        """
+        Get a copy of the weights (see checkpoint.py).
+
+        :return: A tuple (arrays, metadata): arrays is an ordered dictionary with the float32 weights (w) and bias (b).
+        """
+
+        arrays = collections.OrderedDict()
+        arrays["w"] = self.w.astype(numpy.float32)
+        arrays["b"] = self.b.astype(numpy.float32)
+
+        return arrays, {}
+
+    def set_weights(self, arrays, metadata):
+        """
+        Replace the weights.
+
+        :param arrays: Arrays returned by LinearNN.get_weights() (or read from a checkpoint).
+        :param metadata: Ignored.
+        """
+
+        if "w" not in arrays or arrays["w"].shape != (self.num_inputs, ):
+            raise ValueError("The weights do not belong to a linear model with " + str(self.num_inputs) + " inputs")
+
+        self.w[:] = arrays["w"]
+        self.b[:] = arrays["b"]
+
+    def get_state(self):
+        """
+        Get a copy of the exact weights (see NN.get_state). The updates have no other state.
+
+        :return: A tuple (arrays, metadata): arrays is an ordered dictionary with the float64 array params.
+        """
+
+        arrays = collections.OrderedDict()
+        arrays["params"] = self.params.copy()
+
+        return arrays, {}
+
+    def set_state(self, arrays, metadata):
+        """
+        Restore the weights (see LinearNN.get_state).
+
+        :param arrays: An ordered dictionary with the array params.
+        :param metadata: Ignored.
+        """
+
+        if "params" not in arrays or arrays["params"].shape != self.params.shape:
+            raise ValueError("The state does not belong to a linear model with " + str(self.num_inputs) + " inputs")
+
+        self.params[:] = arrays["params"]
+
+    def write_to_file(self, dst_file):
+        """
+        Write the model to a file (as a checkpoint).
+
+        :param dst_file: Name of the file where to write the model.
+        """
+
+        arrays, metadata = self.get_weights()
+        metadata["num_inputs"] = self.num_inputs
+
+        checkpoint.write_checkpoint(dst_file, arrays, metadata)
+
+    def train_with_datapoint(self, inputs, target):
+        """
+        Train the model with a single data point.
+
+        :param inputs: Inputs to the model (as a list).
+        :param target: Target output (as a number).
+        """
+
+        indices = numpy.flatnonzero(inputs)
+        self.train_with_sparse_datapoint(indices, numpy.asarray(inputs, dtype=numpy.float64)[indices], target)
+
+    def train_with_sparse_datapoint(self, indices, values, target):
+        """
+        Train the model with a single data point given in sparse form (only the weights of the non-zero inputs change).
+
+        :param indices: Indices of the non-zero inputs (as a list, without repetitions).
+        :param values: Values of the non-zero inputs (as a list).
+        :param target: Target output (as a number).
+        """
+
+        values = numpy.asarray(values, dtype=numpy.float64)
+        error = target - self.evaluate_sparse(indices, values)
+
+        # The bias behaves like an extra input that is always 1
+        step = self.step_size * error / (values.dot(values) + 1.0)
+
+        self.w[indices] += step * values
+        self.b[0] += step
+
+    def evaluate(self, inputs):
+        """
+        Get the output of the model given the specified inputs.
+
+        :param inputs: Inputs to the model (as a list).
+        :return: The output of the model (as a number).
+        """
+
+        return float(self.w.dot(inputs) + self.b[0])
+
+    def evaluate_batch(self, rows):
+        """
+        Get the outputs of the model for a batch of inputs.
+
+        :param rows: An array with one row of inputs per data point.
+        :return: The outputs of the model (as a list of numbers).
+        """
+
+        return (numpy.asarray(rows).dot(self.w) + self.b[0]).tolist()
+
+    def evaluate_sparse(self, indices, values):
+        """
+        Get the output of the model given the specified inputs in sparse form.
+
+        :param indices: Indices of the non-zero inputs (as a list).
+        :param values: Values of the non-zero inputs (as a list).
+        :return: The output of the model (as a number).
+        """
+
+        return float(self.w[indices].dot(values) + self.b[0])
+
+    def accumulate(self, indices, values, pre_activation=None):
+        """
+        Add the contribution of some sparse inputs to the output (a linear model has no hidden layer, so its
+        "pre-activation" is the output itself).
+
+        :param indices: Indices of the inputs to add (as a list).
+        :param values: Values of the inputs to add (as a list). Negative values remove inputs.
+        :param pre_activation: Output to start from. If None, start from the bias (i.e. no inputs).
+        :return: The new output.
+        """
+
+        if pre_activation is None:
+            pre_activation = float(self.b[0])
+
+        if len(indices) == 0:
+            return pre_activation
+
+        return pre_activation + float(self.w[indices].dot(values))
+
+    def evaluate_pre_activation(self, pre_activation):
+        """
+        Get the output of the model given the value returned by LinearNN.accumulate(...).
+
+        :param pre_activation: Value returned by LinearNN.accumulate(...).
+        :return: The output of the model (as a number).
+        """
+
+        return pre_activation
@@ -12,11 +12,21 @@ class Ludo(object):
     Class that provides a controller for a Ludo game.
     """
 
-    def __init__(self, players):
+    def __init__(self, players, seed=None):
         """
         Constructor for a new Ludo game.
+
+        :param players: The players, in the order of their turns.
+        :param seed: If not None, the game rolls its dice (and chooses the starting player) with a random generator of
+        its own seeded with it, so that games with the same seed get the same rolls whatever the players do. Otherwise,
+        the global random generator is used.
         """
 
+        if seed is None:
+            self.rng = random
+        else:
+            self.rng = random.Random(seed)
+
         # Specify the player types
         self.players = players
 
@@ -26,7 +36,7 @@ class Ludo(object):
             player.state[0] = 1.00
 
         # Randomly choose which player starts the game
-        self.player_turn = random.randint(0, 3)
+        self.player_turn = self.rng.randint(0, 3)
 
     @staticmethod
     def player_wins(player):
@@ -42,6 +52,19 @@ class Ludo(object):
 
         return False
 
+    def winner(self):
+        """
+        Get the player who won the game.
+
+        :return: The index of the player who won, or None if the game is not over.
+        """
+
+        for p in range(len(self.players)):
+            if Ludo.player_wins(self.players[p]):
+                return p
+
+        return None
+
     def roll_dice(self):
         """
         Roll a dice.
@@ -49,7 +72,7 @@ class Ludo(object):
         :return: A random integer between 1 and 6 (inclusive).
         """
 
-        return random.randint(1, 6)
+        return self.rng.randint(1, 6)
 
     def play(self):
         """
@@ -76,3 +99,40 @@ class Ludo(object):
             self.player_turn = (self.player_turn + 1) % 4
 
             turn += 1
+
+    def play_steps(self):
+        """
+        Play a Ludo game like Ludo.play(), as a generator that yields whenever a player needs the outputs of a neural
+        network (see Player.move_steps). The outputs are sent back to the generator, so that the network can be
+        evaluated for several games at once (see game_scheduler.py).
+        """
+
+        # Keep track of the turn number as a timestamp
+        turn = 0
+
+        while True:
+            cur_player = self.players[self.player_turn]
+
+            # Roll dice
+            dice = self.roll_dice()
+
+            # Prompt player for a move, passing on its requests
+            steps = cur_player.move_steps(dice, self.players, turn)
+            outputs = None
+
+            while True:
+                try:
+                    request = steps.send(outputs)
+                except StopIteration:
+                    break
+
+                outputs = yield request
+
+            # Check for a winner
+            if Ludo.player_wins(cur_player):
+                return
+
+            # Next player
+            self.player_turn = (self.player_turn + 1) % 4
+
+            turn += 1
@@ -0,0 +1,349 @@
+"""
+metrics.py
+
+Provides a metrics stream for long trainings: counters, gauges and streaming histograms are aggregated in memory (an
+event is a dictionary update) and a record of them is appended to a file every few seconds, as JSON lines or CSV. The
+throughput (e.g. episodes and turns per second) and the learning signals (e.g. the distributions of the TD errors and of
+the Q values) can then be followed while the training runs.
+"""
+
+import collections
+import csv
+import json
+import os
+import time
+
+
+class Histogram(object):
+    """
+    Class that counts values in buckets whose bounds are powers of 2.
+    """
+
+    def __init__(self, num_buckets=32):
+        """
+        Construct a new empty histogram.
+
+        :param num_buckets: Number of buckets: bucket 0 counts the values below 1 and bucket i counts the values
+        between 2^(i-1) and 2^i (the last bucket also counts all the larger values).
+        """
+
+        self.counts = [0, ] * num_buckets
+        self.total = 0
+
+    def add(self, value):
+        """
+        Count a value.
+
+        :param value: A non-negative number.
+        """
+
+        bucket = 0 if value < 1 else int(value).bit_length()
+        self.counts[min(bucket, len(self.counts) - 1)] += 1
+        self.total += 1
+
+    def percentile(self, p):
+        """
+        Get an upper bound of a percentile of the values.
+
+        :param p: A percentage between 0 and 100.
+        :return: The upper bound of the bucket that contains the percentile (0 if the histogram is empty).
+        """
+
+        needed = p * self.total / 100.0
+        count = 0
+
+        for bucket in range(len(self.counts)):
+            count += self.counts[bucket]
+
+            if count >= needed and count > 0:
+                return 2 ** bucket
+
+        return 0
+
+    def reset(self):
+        """
+        Forget all the values.
+        """
+
+        self.counts = [0, ] * len(self.counts)
+        self.total = 0
+
+    def to_dict(self):
+        """
+        Get a summary of the histogram.
+
+        :return: A dictionary with the number of values, the 50th, 90th and 99th percentiles and the count of each
+        bucket (keyed by its upper bound).
+        """
+
+        return {"count": self.total,
+                "p50": self.percentile(50),
+                "p90": self.percentile(90),
+                "p99": self.percentile(99),
+                "buckets": dict((2 ** b, c) for b, c in enumerate(self.counts) if c > 0)}
+
+
+class RangeHistogram(object):
+    """
+    Class that counts values of any sign in equal buckets over a range (plus one bucket below and one above it), with
+    their mean, minimum and maximum. NaN values are counted apart.
+    """
+
+    def __init__(self, low, high, num_buckets=40):
+        """
+        Construct a new empty histogram.
+
+        :param low: Lower bound of the range.
+        :param high: Upper bound of the range.
+        :param num_buckets: Number of buckets in the range.
+        """
+
+        self.low = low
+        self.high = high
+        self.num_buckets = num_buckets
+        self.width = (high - low) / float(num_buckets)
+        self.reset()
+
+    def add(self, value):
+        """
+        Count a value.
+
+        :param value: A number.
+        """
+
+        # NaN is the only value that differs from itself
+        if value != value:
+            self.nans += 1
+            return
+
+        if value < self.low:
+            bucket = 0
+        elif value >= self.high:
+            bucket = len(self.counts) - 1
+        else:
+            bucket = 1 + int((value - self.low) / self.width)
+
+        self.counts[bucket] += 1
+        self.total += 1
+        self.sum += value
+
+        if value < self.min:
+            self.min = value
+
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        """
+        Get an upper bound of a percentile of the values.
+
+        :param p: A percentage between 0 and 100.
+        :return: The upper bound of the bucket that contains the percentile (the maximum for the bucket above the range,
+        0 if the histogram is empty).
+        """
+
+        needed = p * self.total / 100.0
+        count = 0
+
+        for bucket in range(len(self.counts)):
+            count += self.counts[bucket]
+
+            if count >= needed and count > 0:
+                return min(self.low + bucket * self.width, self.max)
+
+        return 0
+
+    def reset(self):
+        """
+        Forget all the values.
+        """
+
+        self.counts = [0, ] * (self.num_buckets + 2)
+        self.total = 0
+        self.nans = 0
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+
+    def to_dict(self):
+        """
+        Get a summary of the histogram.
+
+        :return: A dictionary with the number of values, the number of NaN values, the mean, the minimum, the maximum,
+        the 1st, 50th, 90th and 99th percentiles and the number of values below and above the range.
+        """
+
+        if self.total == 0:
+            return {"count": 0, "nans": self.nans}
+
+        return {"count": self.total,
+                "nans": self.nans,
+                "mean": self.sum / self.total,
+                "min": self.min,
+                "max": self.max,
+                "p1": self.percentile(1),
+                "p50": self.percentile(50),
+                "p90": self.percentile(90),
+                "p99": self.percentile(99),
+                "below": self.counts[0],
+                "above": self.counts[-1]}
+
+
+class Metrics(object):
+    """
+    Class that aggregates metrics in memory and appends a record of them to a file every few seconds. Counters are
+    cumulative (their rates over the last interval are recorded too), gauges keep their last value and histograms are
+    emptied after each record.
+    """
+
+    # Columns of the histograms in CSV records (the JSON records have the whole summary)
+    csv_summary = ["count", "mean", "p50", "p90", "p99"]
+
+    def __init__(self, dst_file, interval=10.0, append=False):
+        """
+        Construct a new metrics stream.
+
+        :param dst_file: Name of the file where to write the records (created or overwritten). Files ending in .csv get
+        a CSV line per record (with the columns of the first record). Other files get a JSON object per line.
+        :param interval: Seconds between records (see Metrics.maybe_flush).
+        :param append: If True, the records are appended to those already in the file (e.g. when a training is
+        resumed). CSV records keep the columns of the existing header.
+        """
+
+        self.dst_file = dst_file
+        self.interval = interval
+        self.csv = dst_file.endswith(".csv")
+        self.csv_writer = None
+        self.csv_columns = None
+
+        if append and self.csv and os.path.exists(dst_file):
+            with open(dst_file, "rb") as f:
+                self.csv_columns = next(csv.reader(f), None)
+
+        self.file = open(dst_file, "a" if append else "w")
+
+        self.counters = collections.OrderedDict()
+        self.gauges = collections.OrderedDict()
+        self.histograms = collections.OrderedDict()
+
+        # Counters at the last record, for their rates
+        self.start_time = time.time()
+        self.last_time = self.start_time
+        self.last_counters = {}
+        self.next_flush = self.start_time + interval
+
+    def count(self, name, n=1):
+        """
+        Increase a counter (created at 0 on first use).
+
+        :param name: Name of the counter.
+        :param n: Increase.
+        """
+
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def set(self, name, value):
+        """
+        Set a gauge.
+
+        :param name: Name of the gauge.
+        :param value: A number.
+        """
+
+        self.gauges[name] = value
+
+    def add_histogram(self, name, histogram):
+        """
+        Add a histogram.
+
+        :param name: Name of the histogram.
+        :param histogram: A Histogram or a RangeHistogram.
+        """
+
+        self.histograms[name] = histogram
+
+    def observe(self, name, value):
+        """
+        Count a value in a histogram (see Metrics.add_histogram).
+
+        :param name: Name of the histogram.
+        :param value: A number.
+        """
+
+        self.histograms[name].add(value)
+
+    def maybe_flush(self):
+        """
+        Write a record if the interval has passed since the last one. Call it regularly (e.g. after every episode).
+        """
+
+        if time.time() >= self.next_flush:
+            self.flush()
+
+    def record(self):
+        """
+        Get a record of the current metrics.
+
+        :return: An ordered dictionary with the time, the seconds since the stream started, the counters, their rates
+        per second since the last record, the gauges and the summaries of the histograms.
+        """
+
+        now = time.time()
+        seconds = max(now - self.last_time, 1e-9)
+
+        record = collections.OrderedDict()
+        record["time"] = now
+        record["elapsed"] = now - self.start_time
+        record["counters"] = self.counters.copy()
+        record["rates"] = collections.OrderedDict((name, (value - self.last_counters.get(name, 0)) / seconds)
+                                                  for name, value in self.counters.items())
+        record["gauges"] = self.gauges.copy()
+        record["histograms"] = collections.OrderedDict((name, histogram.to_dict())
+                                                       for name, histogram in self.histograms.items())
+
+        return record
+
+    def flush(self):
+        """
+        Write a record and empty the histograms.
+        """
+
+        record = self.record()
+
+        if not self.csv:
+            self.file.write(json.dumps(record) + "\n")
+        else:
+            # Flat columns: counters, rates (name/s), gauges and a few numbers of each histogram (name.number)
+            row = collections.OrderedDict([("time", record["time"]), ("elapsed", record["elapsed"])])
+            row.update(record["counters"])
+            row.update((name + "/s", rate) for name, rate in record["rates"].items())
+            row.update(record["gauges"])
+
+            for name, summary in record["histograms"].items():
+                row.update((name + "." + key, summary.get(key, "")) for key in Metrics.csv_summary)
+
+            if self.csv_writer is None:
+                if self.csv_columns is not None:
+                    self.csv_writer = csv.DictWriter(self.file, self.csv_columns, restval="", extrasaction="ignore")
+                else:
+                    self.csv_writer = csv.DictWriter(self.file, row.keys(), restval="", extrasaction="ignore")
+                    self.csv_writer.writeheader()
+
+            self.csv_writer.writerow(row)
+
+        self.file.flush()
+
+        for histogram in self.histograms.values():
+            histogram.reset()
+
+        self.last_time = record["time"]
+        self.last_counters = dict(self.counters)
+        self.next_flush = self.last_time + self.interval
+
+    def close(self):
+        """
+        Write a last record and close the file.
+        """
+
+        self.flush()
+        self.file.close()
@@ -4,7 +4,64 @@ nn.py
 Provides an interface for a single-output neural network.
 """
 
-from fann_nn import FANN
+import importlib
+import multiprocessing
+import os
+
+import numpy
+
+import checkpoint
+from encoders import default_encoder_name
+from encoders import get_encoder
+
+# Available backends (name -> (module, class)). Modules are only imported when a backend is used, so that e.g. FANN is
+# not needed to run the other backends.
+BACKENDS = {"fann": ("fann_nn", "FANN"),
+            "numpy": ("numpy_nn", "NumpyNN"),
+            "dummy": ("dummy_nn", "DummyNN"),
+            "linear": ("linear_nn", "LinearNN"),
+            "table": ("table_nn", "TableNN"),
+            "frozen": ("frozen_nn", "FrozenNN"),
+            "server": ("server_nn", "ServerNN")}
+
+# Features a backend may support (listed in its capabilities attribute):
+#   train: the weights can be trained
+#   sparse: evaluate_sparse(...) and train_with_sparse_datapoint(...)
+#   batch: evaluate_batch(...)
+#   batch_train: train_with_batch(...)
+#   accumulator: accumulate(...) and evaluate_pre_activation(...)
+#   checkpoint: get_weights() and set_weights(...)
+#   shared: a params array of float64 weights and use_params(...) (see NN.share_weights)
+#   state: get_state() and set_state(...), the exact weights and the state of the training (see NN.get_state)
+CAPABILITIES = frozenset(["train", "sparse", "batch", "batch_train", "accumulator", "checkpoint", "shared", "state"])
+
+
+def register_backend(name, module_name, class_name):
+    """
+    Make a backend available by name.
+
+    :param name: Name of the backend.
+    :param module_name: Name of the module that defines the backend.
+    :param class_name: Name of the backend's class in the module.
+    """
+
+    BACKENDS[name] = (module_name, class_name)
+
+
+def get_backend(name):
+    """
+    Get the class of a backend (importing its module if necessary).
+
+    :param name: Name of the backend.
+    :return: The class of the backend.
+    """
+
+    if name not in BACKENDS:
+        raise ValueError("Unknown neural network backend: " + str(name))
+
+    module_name, class_name = BACKENDS[name]
+
+    return getattr(importlib.import_module(module_name), class_name)
 
 
 class NN(object):
@@ -16,26 +73,334 @@ class NN(object):
     learning_rate = 0.005
     momentum = 0.1
 
-    def __init__(self, num_inputs, src_file=None):
+    # Backend used when none is specified (it can also be set with the LUDO_NN_BACKEND environment variable)
+    default_backend = os.environ.get("LUDO_NN_BACKEND", "fann")
+
+    def __init__(self, num_inputs, src_file=None, backend=None, encoder=None, learning_rate=None, momentum=None,
+                 backend_options=None):
         """
         Constructor for a single-output neural network.
 
         :param num_inputs: Number of inputs to the neural network.
         :param src_file: If None, then a neural network with random weights is initialized. Otherwise, the neural
-        network is loaded from the file.
+        network is loaded from the file (a binary checkpoint or a file in the backend's own format).
+        :param backend: Name of the backend (see BACKENDS): e.g. "fann" to use FANN, "numpy" to use the NumPy
+        implementation (which evaluates and trains sparse inputs without expanding them), "linear" to use a linear model
+        (with a feature encoder), "table" to use a hashed table (with an abstract encoder), "server" to use the network
+        of an inference server (see inference_server.py) or "dummy" to play without a network. If None,
+        NN.default_backend is used. Frozen models (see frozen_nn.py) are always loaded with the "frozen" backend.
+        :param encoder: Name of the encoder that produces the inputs of the network (see encoders.py). If None, the
+        encoder recorded in src_file is used, or the default encoder for num_inputs.
+        :param learning_rate: Learning rate of this network. If None, NN.learning_rate is used. The backends with a
+        step size of their own (linear and table) scale it by learning_rate / NN.learning_rate.
+        :param momentum: Learning momentum of this network. If None, NN.momentum is used.
+        :param backend_options: A dictionary of extra arguments of the backend's constructor, e.g. {"max_bytes": ...}
+        for the memory budget of the table backend or {"step_size": ...} for the step size of the linear and table
+        backends. They are ignored when a frozen model is loaded.
+        """
+
+        # Binary checkpoints are loaded into a network initialized with random weights (except frozen models, which are
+        # loaded directly). Either way, the file is read only once.
+        checkpoint_file = None
+        frozen = False
+        metadata = {}
+
+        if src_file is not None and checkpoint.is_checkpoint(src_file):
+            arrays, metadata = checkpoint.read_checkpoint(src_file)
+
+            if "precision" in metadata:
+                backend = "frozen"
+                frozen = True
+            else:
+                checkpoint_file = src_file
+                src_file = None
+
+        if backend is None:
+            backend = NN.default_backend
+
+        self.backend = backend
+        self.learning_rate = NN.learning_rate if learning_rate is None else learning_rate
+        self.momentum = NN.momentum if momentum is None else momentum
+        self.backend_options = dict(backend_options) if backend_options is not None and not frozen else {}
+
+        if frozen:
+            self.nn = get_backend(backend)(num_inputs, self.learning_rate, self.momentum, src_file, (arrays, metadata))
+        else:
+            self.nn = get_backend(backend)(num_inputs, self.learning_rate, self.momentum, src_file,
+                                           **self.backend_options)
+        self.capabilities = self.nn.capabilities
+
+        if checkpoint_file is not None:
+            if not self.supports("checkpoint"):
+                raise ValueError("The " + backend + " backend cannot load " + checkpoint_file)
+
+            if metadata.get("num_inputs", num_inputs) != num_inputs:
+                raise ValueError(checkpoint_file + " contains a network with " + str(metadata["num_inputs"]) +
+                                 " inputs")
+
+            self.nn.set_weights(arrays, metadata)
+
+        self.num_inputs = num_inputs
+
+        # The encoder the network is trained with is recorded in its checkpoints
+        if encoder is None:
+            encoder = metadata.get("encoder", default_encoder_name(num_inputs))
+
+        self.encoder = get_encoder(encoder)
+
+        if self.encoder.num_inputs != num_inputs:
+            raise ValueError("The " + encoder + " encoder produces " + str(self.encoder.num_inputs) + " inputs, not " +
+                             str(num_inputs))
+
+        # Incremented every time the weights change (so that values computed from them can be discarded, see
+        # NN.next_version). Once the weights are shared (see NN.share_weights), the counter is shared too.
+        self.shared_version = None
+        self.version = 0
+
+        # A read-only network cannot be trained (its outputs never change)
+        self.read_only = not self.supports("train")
+
+        # Memo of outputs (see NN.enable_cache)
+        self.cache = None
+
+    @property
+    def version(self):
+        """
+        Version of the weights (see NN.__init__).
+        """
+
+        if self.shared_version is not None:
+            return self.shared_version.value
+
+        return self.local_version
+
+    @version.setter
+    def version(self, value):
+        if self.shared_version is not None:
+            self.shared_version.value = value
+        else:
+            self.local_version = value
+
+    def next_version(self):
+        """
+        Increment the version of the weights. A shared version is incremented under its lock, so that the increments of
+        concurrent processes are not lost.
+        """
+
+        if self.shared_version is not None:
+            with self.shared_version.get_lock():
+                self.shared_version.value += 1
+        else:
+            self.local_version += 1
+
+    def share_weights(self):
+        """
+        Move the weights (and their version) into shared memory, so that processes forked afterwards (see
+        multiprocessing) read and train the same weights as this one. Updates of the weights are not synchronized:
+        concurrent updates of the same weight may overwrite each other (Hogwild! style), which rarely matters with
+        sparse inputs. The version is incremented under a lock (see NN.next_version).
+        """
+
+        if not self.supports("shared"):
+            raise ValueError("The weights of the " + self.backend + " backend cannot be shared")
+
+        if self.shared_version is not None:
+            return
+
+        params = multiprocessing.RawArray("d", len(self.nn.params))
+        self.nn.use_params(numpy.frombuffer(params, dtype=numpy.float64))
+
+        version = self.version
+        self.shared_version = multiprocessing.Value("l", version)
+
+    def supports(self, capability):
+        """
+        Determine if the backend supports a feature natively (see CAPABILITIES). NN provides the missing features in
+        terms of the basic ones, but more slowly.
+
+        :param capability: Name of the feature.
+        :return: True if the backend supports the feature. False otherwise.
+        """
+
+        return capability in self.capabilities
+
+    def enable_cache(self, max_bytes):
+        """
+        Remember the outputs of the network by key (see NN.lookup and NN.store).
+
+        :param max_bytes: Memory budget (in bytes) for the cache. If None, the cache is disabled.
+        """
+
+        if max_bytes is None:
+            self.cache = None
+        else:
+            from eval_cache import EvalCache
+
+            self.cache = EvalCache(max_bytes)
+
+    def lookup(self, key):
+        """
+        Get the output of the network remembered for a key, if any. Outputs computed with older weights are never
+        returned.
+
+        :param key: A compact key that identifies the inputs (e.g. a packed board state and an action).
+        :return: The output of the neural network (as a number) or None if it is not known.
+        """
+
+        if self.cache is None:
+            return None
+
+        return self.cache.get(key, self.version)
+
+    def store(self, key, value):
+        """
+        Remember the output of the network for a key (only if the cache is enabled).
+
+        :param key: A compact key that identifies the inputs (e.g. a packed board state and an action).
+        :param value: The output of the neural network for those inputs.
+        """
+
+        if self.cache is not None:
+            self.cache.put(key, value, self.version)
+
+    def evaluate_keys(self, keys, packed, actions):
+        """
+        Get the outputs of the network for a list of inputs. The outputs are looked up in the cache first (see
+        NN.lookup), and the inputs that are not cached are evaluated together (in a single batch) and cached.
+
+        :param keys: A key for each input (see NN.lookup).
+        :param packed: The packed board state of each input.
+        :param actions: The action of each input (see Encoder.encode_batch).
+        :return: A list with the output for each input.
+        """
+
+        values = [self.lookup(key) for key in keys]
+        missing = [i for i in range(len(values)) if values[i] is None]
+
+        if len(missing) > 0:
+            rows = self.encoder.encode_batch([packed[i] for i in missing], [actions[i] for i in missing])
+
+            for i, value in zip(missing, self.evaluate_batch(rows)):
+                values[i] = value
+                self.store(keys[i], value)
+
+        return values
+
+    def check_writable(self):
+        """
+        Make sure the network can be trained.
+        """
+
+        if self.read_only:
+            raise RuntimeError("Cannot train a read-only neural network")
+
+    def sparse_to_dense(self, indices, values):
+        """
+        Expand sparse inputs into a full list of inputs.
+
+        :param indices: Indices of the non-zero inputs (as a list).
+        :param values: Values of the non-zero inputs (as a list).
+        :return: Inputs to the neural network (as a list).
         """
 
-        self.nn = FANN(num_inputs, NN.learning_rate, NN.momentum, src_file)
+        inputs = [0.0, ] * self.num_inputs
+
+        for i in range(len(indices)):
+            inputs[indices[i]] = values[i]
+
+        return inputs
 
     def write_to_file(self, dst_file):
         """
-        Write the neural network to a file.
+        Write the neural network to a file (in the backend's own format).
 
         :param dst_file: Name of the file where to write the network.
         """
 
         self.nn.write_to_file(dst_file)
 
+    def get_weights(self):
+        """
+        Get a snapshot of the weights of the neural network.
+
+        :return: A tuple (arrays, metadata) suitable for checkpoint.write_checkpoint(...): arrays is an ordered
+        dictionary of float32 arrays and metadata is a dictionary.
+        """
+
+        arrays, metadata = self.nn.get_weights()
+        metadata["num_inputs"] = self.num_inputs
+        metadata["encoder"] = self.encoder.name
+
+        return arrays, metadata
+
+    def set_weights(self, arrays, metadata):
+        """
+        Replace the weights of the neural network.
+
+        :param arrays: Arrays returned by NN.get_weights() (or read from a checkpoint).
+        :param metadata: Metadata returned by NN.get_weights() (or read from a checkpoint).
+        """
+
+        self.check_writable()
+        self.nn.set_weights(arrays, metadata)
+        self.next_version()
+
+    def get_state(self):
+        """
+        Get a snapshot of everything needed to resume training the neural network (see QLTrainer.get_state): the
+        exact weights and the state of the training algorithm (e.g. the momentum terms), if the backend supports it.
+        Otherwise, the weights (see NN.get_weights).
+
+        :return: A tuple (arrays, metadata) suitable for checkpoint.write_checkpoint(...).
+        """
+
+        if not self.supports("state"):
+            return self.get_weights()
+
+        arrays, metadata = self.nn.get_state()
+        metadata["num_inputs"] = self.num_inputs
+        metadata["encoder"] = self.encoder.name
+
+        return arrays, metadata
+
+    def set_state(self, arrays, metadata):
+        """
+        Restore a snapshot taken with NN.get_state().
+
+        :param arrays: Arrays returned by NN.get_state() (or read from a checkpoint).
+        :param metadata: Metadata returned by NN.get_state() (or read from a checkpoint).
+        """
+
+        self.check_writable()
+
+        if self.supports("state"):
+            self.nn.set_state(arrays, metadata)
+        else:
+            self.nn.set_weights(arrays, metadata)
+
+        self.next_version()
+
+    def set_learning_rate(self, learning_rate):
+        """
+        Change the learning rate of the neural network (e.g. after a rollback, see health.py).
+
+        :param learning_rate: New learning rate (see NN.__init__).
+        """
+
+        self.check_writable()
+        self.nn.set_learning_rate(learning_rate)
+        self.learning_rate = learning_rate
+
+    def write_checkpoint(self, dst_file):
+        """
+        Write the neural network to a binary checkpoint file (atomically).
+
+        :param dst_file: Name of the file where to write the network.
+        """
+
+        arrays, metadata = self.get_weights()
+        checkpoint.write_checkpoint(dst_file, arrays, metadata)
+
     def train_with_datapoint(self, inputs, target):
         """
         Train the neural network with a single data point.
@@ -44,7 +409,47 @@ class NN(object):
         :param target: Target output (as a number).
         """
 
+        self.check_writable()
         self.nn.train_with_datapoint(inputs, target)
+        self.next_version()
+
+    def train_with_sparse_datapoint(self, indices, values, target):
+        """
+        Train the neural network with a single data point given in sparse form. Backends without sparse support are
+        trained with the expanded inputs.
+
+        :param indices: Indices of the non-zero inputs (as a list).
+        :param values: Values of the non-zero inputs (as a list).
+        :param target: Target output (as a number).
+        """
+
+        self.check_writable()
+
+        if self.supports("sparse"):
+            self.nn.train_with_sparse_datapoint(indices, values, target)
+        else:
+            self.nn.train_with_datapoint(self.sparse_to_dense(indices, values), target)
+
+        self.next_version()
+
+    def train_with_batch(self, rows, targets):
+        """
+        Train the neural network with a batch of data points. Backends without batch training are trained with one data
+        point at a time.
+
+        :param rows: A float32 array with one row of inputs per data point (see Encoder.encode_batch).
+        :param targets: Target outputs (as a list of numbers).
+        """
+
+        self.check_writable()
+
+        if self.supports("batch_train"):
+            self.nn.train_with_batch(rows, targets)
+        else:
+            for row, target in zip(rows, targets):
+                self.nn.train_with_datapoint(row.tolist(), target)
+
+        self.next_version()
 
     def evaluate(self, inputs):
         """
@@ -54,4 +459,71 @@ class NN(object):
         :return: The output of the neural network (as a number).
         """
 
-        return self.nn.evaluate(inputs)
\ No newline at end of file
+        return self.nn.evaluate(inputs)
+
+    def evaluate_batch(self, rows):
+        """
+        Get the outputs of the neural network for a batch of inputs.
+
+        :param rows: A float32 array with one row of inputs per data point (see Encoder.encode_batch).
+        :return: The outputs of the neural network (as a list of numbers).
+        """
+
+        if self.supports("batch"):
+            return self.nn.evaluate_batch(rows)
+
+        return [self.nn.evaluate(row.tolist()) for row in rows]
+
+    def evaluate_sparse(self, indices, values):
+        """
+        Get the output of the neural network given the specified inputs in sparse form. Backends without sparse support
+        are evaluated with the expanded inputs.
+
+        :param indices: Indices of the non-zero inputs (as a list).
+        :param values: Values of the non-zero inputs (as a list).
+        :return: The output of the neural network (as a number).
+        """
+
+        if self.supports("sparse"):
+            return self.nn.evaluate_sparse(indices, values)
+
+        return self.nn.evaluate(self.sparse_to_dense(indices, values))
+
+    def accumulate(self, indices, values, pre_activation=None):
+        """
+        Add the contribution of some sparse inputs to the weighted sums of the hidden neurons. Backends that cannot
+        expose their hidden layer keep the sparse inputs themselves (as a dictionary) instead of the weighted sums.
+
+        :param indices: Indices of the inputs to add (as a list).
+        :param values: Values of the inputs to add (as a list). Negative values remove inputs.
+        :param pre_activation: Value returned by an earlier call. If None, start with no inputs.
+        :return: The new weighted sums of the hidden neurons (pre_activation is not modified).
+        """
+
+        if self.supports("accumulator"):
+            return self.nn.accumulate(indices, values, pre_activation)
+
+        active = {} if pre_activation is None else dict(pre_activation)
+
+        for i in range(len(indices)):
+            value = active.get(indices[i], 0.0) + values[i]
+
+            if value != 0:
+                active[indices[i]] = value
+            else:
+                active.pop(indices[i], None)
+
+        return active
+
+    def evaluate_pre_activation(self, pre_activation):
+        """
+        Get the output of the neural network given the weighted sums of the hidden neurons.
+
+        :param pre_activation: Value returned by NN.accumulate(...).
+        :return: The output of the neural network (as a number).
+        """
+
+        if self.supports("accumulator"):
+            return self.nn.evaluate_pre_activation(pre_activation)
+
+        return self.evaluate_sparse(pre_activation.keys(), pre_activation.values())
@@ -0,0 +1,509 @@
+"""
+numpy_nn.py
+
+Provides an interface for a single-output neural network implemented in NumPy. The network has the same shape as the
+one created by FANN (one hidden layer of 20 symmetric sigmoid neurons and a linear output) and can read and write
+FANN's text format, but it also supports sparse inputs.
+"""
+
+import collections
+import re
+
+import numpy
+
+
+class NumpyNN(object):
+    """
+    Class that provides an interface for a single-output neural network in NumPy.
+    """
+
+    # Features supported natively (see nn.CAPABILITIES)
+    capabilities = frozenset(["train", "sparse", "batch", "batch_train", "accumulator", "checkpoint", "shared",
+                              "state"])
+
+    # Number of neurons in the hidden layer
+    num_hidden = 20
+
+    # FANN's default activation steepness for the hidden and output layers
+    default_steepness = 0.5
+
+    def __init__(self, num_inputs, learning_rate, momentum, src_file=None):
+        """
+        Constructor for a single-output neural network.
+
+        :param num_inputs: Number of inputs to the neural network.
+        :param learning_rate: Learning rate to use when training the neural network.
+        :param momentum: Learning momentum to use when training the neural network.
+        :param src_file: If None, then a neural network with random weights is initialized. Otherwise, the neural
+        network is loaded from the file (in FANN's text format).
+        """
+
+        self.num_inputs = num_inputs
+        self.learning_rate = learning_rate
+        self.momentum = momentum
+
+        self.hidden_steepness = NumpyNN.default_steepness
+        self.output_steepness = NumpyNN.default_steepness
+
+        # All the weights live in a single flat array. The layers are views into it: w1 has one row per input so that
+        # a sparse input only touches a few rows.
+        self.params = numpy.zeros(NumpyNN.num_params(num_inputs))
+        self.w1, self.b1, self.w2, self.b2 = self.views(self.params)
+
+        # Previous weight updates (for the momentum term)
+        self.deltas = numpy.zeros(self.params.shape)
+        self.d_w1, self.d_b1, self.d_w2, self.d_b2 = self.views(self.deltas)
+
+        # Number of updates of the first layer so far, and number of them when each of its rows was last updated (the
+        # momentum term of a row skipped by sparse updates has decayed once per skipped update)
+        self.updates = 0
+        self.row_updates = numpy.zeros(num_inputs, dtype=numpy.int64)
+
+        if src_file is not None:
+            # Initialize neural network from file
+            self.read_from_file(src_file)
+        else:
+            # Same range as FANN's default random initialization
+            self.params[:] = numpy.random.uniform(-0.1, 0.1, self.params.shape)
+
+    def set_learning_rate(self, learning_rate):
+        """
+        Change the learning rate used when training the neural network.
+
+        :param learning_rate: New learning rate.
+        """
+
+        self.learning_rate = learning_rate
+
+    @staticmethod
+    def num_params(num_inputs):
+        """
+        Get the number of weights (including biases) of a network with the given number of inputs.
+
+        :param num_inputs: Number of inputs to the neural network.
+        :return: The number of weights.
+        """
+
+        return (num_inputs + 2) * NumpyNN.num_hidden + 1
+
+    def views(self, flat):
+        """
+        Split a flat array of weights into the weights of each layer.
+
+        :param flat: Array with NumpyNN.num_params(self.num_inputs) elements.
+        :return: A tuple (w1, b1, w2, b2) of views into flat.
+        """
+
+        n_i = self.num_inputs
+        n_h = NumpyNN.num_hidden
+
+        w1 = flat[:n_i * n_h].reshape((n_i, n_h))
+        b1 = flat[n_i * n_h:(n_i + 1) * n_h]
+        w2 = flat[(n_i + 1) * n_h:(n_i + 2) * n_h]
+        b2 = flat[(n_i + 2) * n_h:]
+
+        return w1, b1, w2, b2
+
+    def use_params(self, flat):
+        """
+        Move the weights into an existing array (e.g. one in shared memory, see NN.share_weights). The weights are
+        copied into it and, from then on, read and updated in place there.
+
+        :param flat: A float64 array with NumpyNN.num_params(self.num_inputs) elements.
+        """
+
+        flat[:] = self.params
+        self.params = flat
+        self.w1, self.b1, self.w2, self.b2 = self.views(self.params)
+
+    def get_weights(self):
+        """
+        Get a copy of the weights of each layer (see checkpoint.py).
+
+        :return: A tuple (arrays, metadata): arrays is an ordered dictionary with the float32 arrays w1 (one row per
+        input), b1, w2 and b2. metadata is a dictionary with the activation steepnesses.
+        """
+
+        arrays = collections.OrderedDict()
+        arrays["w1"] = self.w1.astype(numpy.float32)
+        arrays["b1"] = self.b1.astype(numpy.float32)
+        arrays["w2"] = self.w2.astype(numpy.float32)
+        arrays["b2"] = self.b2.astype(numpy.float32)
+
+        metadata = {"hidden_steepness": self.hidden_steepness,
+                    "output_steepness": self.output_steepness}
+
+        return arrays, metadata
+
+    def set_weights(self, arrays, metadata):
+        """
+        Replace the weights of each layer (see NumpyNN.get_weights).
+
+        :param arrays: An ordered dictionary with the arrays w1, b1, w2 and b2.
+        :param metadata: A dictionary with the activation steepnesses.
+        """
+
+        self.w1[:] = arrays["w1"]
+        self.b1[:] = arrays["b1"]
+        self.w2[:] = arrays["w2"]
+        self.b2[:] = arrays["b2"]
+
+        self.hidden_steepness = metadata.get("hidden_steepness", NumpyNN.default_steepness)
+        self.output_steepness = metadata.get("output_steepness", NumpyNN.default_steepness)
+
+        # The momentum terms refer to the old weights
+        self.deltas[:] = 0.0
+
+    def get_state(self):
+        """
+        Get a copy of the exact weights and of the momentum terms (see NN.get_state).
+
+        :return: A tuple (arrays, metadata): arrays is an ordered dictionary with the float64 arrays params and deltas,
+        and the row_updates of the first layer (see NumpyNN.row_momentum). metadata is a dictionary with the activation
+        steepnesses and the number of updates of the first layer.
+        """
+
+        arrays = collections.OrderedDict()
+        arrays["params"] = self.params.copy()
+        arrays["deltas"] = self.deltas.copy()
+        arrays["row_updates"] = self.row_updates.copy()
+
+        metadata = {"hidden_steepness": self.hidden_steepness,
+                    "output_steepness": self.output_steepness,
+                    "updates": self.updates}
+
+        return arrays, metadata
+
+    def set_state(self, arrays, metadata):
+        """
+        Restore the weights and the momentum terms (see NumpyNN.get_state).
+
+        :param arrays: An ordered dictionary with the arrays params, deltas and row_updates.
+        :param metadata: A dictionary with the activation steepnesses and the number of updates of the first layer.
+        """
+
+        if "params" not in arrays or arrays["params"].shape != self.params.shape:
+            raise ValueError("The state does not belong to a network with " + str(self.num_inputs) + " inputs")
+
+        self.params[:] = arrays["params"]
+        self.deltas[:] = arrays["deltas"]
+
+        # States saved without the row updates resume as if every row had just been updated
+        self.updates = metadata.get("updates", 0)
+        self.row_updates[:] = arrays["row_updates"] if "row_updates" in arrays else self.updates
+
+        self.hidden_steepness = metadata.get("hidden_steepness", NumpyNN.default_steepness)
+        self.output_steepness = metadata.get("output_steepness", NumpyNN.default_steepness)
+
+    def read_from_file(self, src_file):
+        """
+        Load the weights from a file written by FANN (or by NumpyNN.write_to_file).
+
+        :param src_file: Name of the file where to read the network from.
+        """
+
+        with open(src_file, "r") as f:
+            lines = f.read().splitlines()
+
+        fields = {}
+
+        for line in lines:
+            if "=" in line:
+                key, value = line.split("=", 1)
+                fields[key] = value
+
+        layer_sizes = [int(s) for s in fields["layer_sizes"].split()]
+
+        if layer_sizes != [self.num_inputs + 1, NumpyNN.num_hidden + 1, 2]:
+            raise ValueError("Unsupported network shape in " + src_file + ": " + fields["layer_sizes"])
+
+        neurons = re.findall(r"\((\d+), (\d+), ([-+0-9.eE]+)\)",
+                             fields["neurons (num_inputs, activation_function, activation_steepness)"])
+        connections = re.findall(r"\((\d+), ([-+0-9.eE]+)\)", fields["connections (connected_to_neuron, weight)"])
+
+        # The steepness of the first hidden neuron and of the output neuron apply to the whole layer
+        self.hidden_steepness = float(neurons[self.num_inputs + 1][2])
+        self.output_steepness = float(neurons[self.num_inputs + 1 + NumpyNN.num_hidden + 1][2])
+
+        # Neurons are numbered consecutively across layers (each layer ends with a bias neuron)
+        hidden_begin = self.num_inputs + 1
+        c = 0
+
+        for j in range(NumpyNN.num_hidden):
+            for k in range(self.num_inputs + 1):
+                to_neuron = int(connections[c][0])
+                weight = float(connections[c][1])
+                c += 1
+
+                if to_neuron == self.num_inputs:
+                    self.b1[j] = weight
+                else:
+                    self.w1[to_neuron, j] = weight
+
+        for k in range(NumpyNN.num_hidden + 1):
+            to_neuron = int(connections[c][0]) - hidden_begin
+            weight = float(connections[c][1])
+            c += 1
+
+            if to_neuron == NumpyNN.num_hidden:
+                self.b2[0] = weight
+            else:
+                self.w2[to_neuron] = weight
+
+    def write_to_file(self, dst_file):
+        """
+        Write the neural network to a file in FANN's text format.
+
+        :param dst_file: Name of the file where to write the network.
+        """
+
+        n_i = self.num_inputs
+        n_h = NumpyNN.num_hidden
+
+        neurons = ["(0, 0, 0.00000000000000000000e+00)", ] * (n_i + 1)
+        neurons += ["(%d, 5, %.20e)" % (n_i + 1, self.hidden_steepness), ] * n_h
+        neurons += ["(0, 5, %.20e)" % self.hidden_steepness]
+        neurons += ["(%d, 0, %.20e)" % (n_h + 1, self.output_steepness)]
+        neurons += ["(0, 0, %.20e)" % self.output_steepness]
+
+        connections = []
+
+        for j in range(n_h):
+            for k in range(n_i):
+                connections.append("(%d, %.20e)" % (k, self.w1[k, j]))
+
+            connections.append("(%d, %.20e)" % (n_i, self.b1[j]))
+
+        for j in range(n_h):
+            connections.append("(%d, %.20e)" % (n_i + 1 + j, self.w2[j]))
+
+        connections.append("(%d, %.20e)" % (n_i + 1 + n_h, self.b2[0]))
+
+        with open(dst_file, "w") as f:
+            f.write("FANN_FLO_2.1\n")
+            f.write("num_layers=3\n")
+            f.write("learning_rate=%f\n" % self.learning_rate)
+            f.write("connection_rate=1.000000\n")
+            f.write("network_type=0\n")
+            f.write("learning_momentum=%f\n" % self.momentum)
+            f.write("training_algorithm=0\n")
+            f.write("train_error_function=1\n")
+            f.write("train_stop_function=0\n")
+            f.write("cascade_output_change_fraction=0.010000\n")
+            f.write("quickprop_decay=-0.000100\n")
+            f.write("quickprop_mu=1.750000\n")
+            f.write("rprop_increase_factor=1.200000\n")
+            f.write("rprop_decrease_factor=0.500000\n")
+            f.write("rprop_delta_min=0.000000\n")
+            f.write("rprop_delta_max=50.000000\n")
+            f.write("rprop_delta_zero=0.100000\n")
+            f.write("cascade_output_stagnation_epochs=12\n")
+            f.write("cascade_candidate_change_fraction=0.010000\n")
+            f.write("cascade_candidate_stagnation_epochs=12\n")
+            f.write("cascade_max_out_epochs=150\n")
+            f.write("cascade_min_out_epochs=50\n")
+            f.write("cascade_max_cand_epochs=150\n")
+            f.write("cascade_min_cand_epochs=50\n")
+            f.write("cascade_num_candidate_groups=2\n")
+            f.write("bit_fail_limit=3.49999994039535522461e-01\n")
+            f.write("cascade_candidate_limit=1.00000000000000000000e+03\n")
+            f.write("cascade_weight_multiplier=4.00000000000000022204e-01\n")
+            f.write("cascade_activation_functions_count=10\n")
+            f.write("cascade_activation_functions=3 5 7 8 10 11 14 15 16 17 \n")
+            f.write("cascade_activation_steepnesses_count=4\n")
+            f.write("cascade_activation_steepnesses=2.50000000000000000000e-01 5.00000000000000000000e-01 "
+                    "7.50000000000000000000e-01 1.00000000000000000000e+00 \n")
+            f.write("layer_sizes=%d %d 2 \n" % (n_i + 1, n_h + 1))
+            f.write("scale_included=0\n")
+            f.write("neurons (num_inputs, activation_function, activation_steepness)=" + " ".join(neurons) + " \n")
+            f.write("connections (connected_to_neuron, weight)=" + " ".join(connections) + " \n")
+
+    def hidden_from_pre_activation(self, pre_activation):
+        """
+        Apply the hidden layer activation (FANN's SIGMOID_SYMMETRIC, i.e. tanh(steepness * x)).
+
+        :param pre_activation: Weighted sums of the hidden neurons (including the bias).
+        :return: Outputs of the hidden neurons.
+        """
+
+        return numpy.tanh(self.hidden_steepness * pre_activation)
+
+    def output_from_hidden(self, hidden):
+        """
+        Compute the (linear) output of the network from the outputs of the hidden neurons.
+
+        :param hidden: Outputs of the hidden neurons.
+        :return: The output of the neural network (as a number).
+        """
+
+        return float(self.output_steepness * (hidden.dot(self.w2) + self.b2[0]))
+
+    def row_momentum(self, rows=None):
+        """
+        Get the momentum factor of the rows of the first layer for the next update, and count the update. A row that
+        was not updated for k updates gets momentum ** k, as if its momentum term had decayed at each of them.
+
+        :param rows: Indices of the rows updated. If None, all the rows are updated.
+        :return: An array with the factor of each row (as a column).
+        """
+
+        if rows is None:
+            rows = slice(None)
+
+        skipped = self.updates + 1 - self.row_updates[rows]
+
+        self.updates += 1
+        self.row_updates[rows] = self.updates
+
+        return (self.momentum ** skipped)[:, numpy.newaxis]
+
+    def train_output_layer(self, hidden, target):
+        """
+        Backpropagate the error of a single data point through the output layer and update its weights.
+
+        :param hidden: Outputs of the hidden neurons for the data point.
+        :param target: Target output (as a number).
+        :return: The error terms of the hidden neurons (to update the first layer).
+        """
+
+        output = self.output_from_hidden(hidden)
+        delta_o = self.output_steepness * (target - output)
+        delta_h = delta_o * self.w2 * self.hidden_steepness * (1.0 - hidden * hidden)
+
+        self.d_w2[:] = self.learning_rate * delta_o * hidden + self.momentum * self.d_w2
+        self.d_b2[:] = self.learning_rate * delta_o + self.momentum * self.d_b2
+        self.d_b1[:] = self.learning_rate * delta_h + self.momentum * self.d_b1
+
+        self.w2 += self.d_w2
+        self.b2 += self.d_b2
+        self.b1 += self.d_b1
+
+        return delta_h
+
+    def train_with_datapoint(self, inputs, target):
+        """
+        Train the neural network with a single data point (incremental backpropagation with momentum).
+
+        :param inputs: Inputs to the neural network (as a list).
+        :param target: Target output (as a number).
+        """
+
+        x = numpy.asarray(inputs, dtype=numpy.float64)
+        hidden = self.hidden_from_pre_activation(x.dot(self.w1) + self.b1)
+
+        delta_h = self.train_output_layer(hidden, target)
+
+        self.d_w1[:] = self.learning_rate * numpy.outer(x, delta_h) + self.row_momentum() * self.d_w1
+        self.w1 += self.d_w1
+
+    def train_with_sparse_datapoint(self, indices, values, target):
+        """
+        Train the neural network with a single data point given in sparse form. Only the rows of the first layer that
+        correspond to non-zero inputs are updated (their momentum terms included, see NumpyNN.row_momentum).
+
+        :param indices: Indices of the non-zero inputs (as a list).
+        :param values: Values of the non-zero inputs (as a list).
+        :param target: Target output (as a number).
+        """
+
+        values = numpy.asarray(values, dtype=numpy.float64)
+        hidden = self.hidden_from_pre_activation(values.dot(self.w1[indices]) + self.b1)
+
+        delta_h = self.train_output_layer(hidden, target)
+
+        d_rows = self.learning_rate * numpy.outer(values, delta_h) + self.row_momentum(indices) * self.d_w1[indices]
+        self.d_w1[indices] = d_rows
+        self.w1[indices] += d_rows
+
+    def train_with_batch(self, rows, targets):
+        """
+        Train the neural network with a batch of data points at once: the gradients of all the data points are computed
+        with a single matrix product per layer and added up in a single update (with momentum).
+
+        :param rows: An array with one row of inputs per data point.
+        :param targets: Target outputs (as a list or array of numbers).
+        """
+
+        x = numpy.asarray(rows, dtype=numpy.float64)
+        hidden = self.hidden_from_pre_activation(x.dot(self.w1) + self.b1)
+        outputs = self.output_steepness * (hidden.dot(self.w2) + self.b2[0])
+
+        delta_o = self.output_steepness * (numpy.asarray(targets, dtype=numpy.float64) - outputs)
+        delta_h = delta_o[:, numpy.newaxis] * self.w2 * self.hidden_steepness * (1.0 - hidden * hidden)
+
+        self.d_w2[:] = self.learning_rate * delta_o.dot(hidden) + self.momentum * self.d_w2
+        self.d_b2[:] = self.learning_rate * delta_o.sum() + self.momentum * self.d_b2
+        self.d_b1[:] = self.learning_rate * delta_h.sum(axis=0) + self.momentum * self.d_b1
+        self.d_w1[:] = self.learning_rate * x.T.dot(delta_h) + self.row_momentum() * self.d_w1
+
+        self.w2 += self.d_w2
+        self.b2 += self.d_b2
+        self.b1 += self.d_b1
+        self.w1 += self.d_w1
+
+    def evaluate(self, inputs):
+        """
+        Get the output of the neural network given the specified inputs.
+
+        :param inputs: Inputs to the neural network (as a list).
+        :return: The output of the neural network (as a number).
+        """
+
+        x = numpy.asarray(inputs, dtype=numpy.float64)
+
+        return self.output_from_hidden(self.hidden_from_pre_activation(x.dot(self.w1) + self.b1))
+
+    def accumulate(self, indices, values, pre_activation=None):
+        """
+        Add the contribution of some sparse inputs to the weighted sums of the hidden neurons.
+
+        :param indices: Indices of the inputs to add (as a list).
+        :param values: Values of the inputs to add (as a list). Negative values remove inputs.
+        :param pre_activation: Weighted sums to start from. If None, start from the biases (i.e. no inputs).
+        :return: The new weighted sums of the hidden neurons (pre_activation is not modified).
+        """
+
+        if pre_activation is None:
+            pre_activation = self.b1
+
+        if len(indices) == 0:
+            return pre_activation.copy()
+
+        return pre_activation + numpy.asarray(values, dtype=numpy.float64).dot(self.w1[indices])
+
+    def evaluate_pre_activation(self, pre_activation):
+        """
+        Get the output of the neural network given the weighted sums of the hidden neurons.
+
+        :param pre_activation: Weighted sums of the hidden neurons (see NumpyNN.accumulate).
+        :return: The output of the neural network (as a number).
+        """
+
+        return self.output_from_hidden(self.hidden_from_pre_activation(pre_activation))
+
+    def evaluate_batch(self, rows):
+        """
+        Get the outputs of the neural network for a batch of inputs (with a single matrix product per layer).
+
+        :param rows: An array with one row of inputs per data point.
+        :return: The outputs of the neural network (as a list of numbers).
+        """
+
+        pre_activation = numpy.asarray(rows).dot(self.w1) + self.b1
+        hidden = self.hidden_from_pre_activation(pre_activation)
+
+        return (self.output_steepness * (hidden.dot(self.w2) + self.b2[0])).tolist()
+
+    def evaluate_sparse(self, indices, values):
+        """
+        Get the output of the neural network given the specified inputs in sparse form. The first layer is computed as
+        a weighted sum of the rows of the non-zero inputs only.
+
+        :param indices: Indices of the non-zero inputs (as a list).
+        :param values: Values of the non-zero inputs (as a list).
+        :return: The output of the neural network (as a number).
+        """
+
+        pre_activation = numpy.asarray(values, dtype=numpy.float64).dot(self.w1[indices]) + self.b1
+
+        return self.output_from_hidden(self.hidden_from_pre_activation(pre_activation))
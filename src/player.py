@@ -5,6 +5,7 @@ Defines a generic Ludo player through the Player class.
 """
 
 import copy
+import random
 
 
 class PlayerKind:
@@ -41,6 +42,20 @@ def GetFullKind(kind):
 SafeSquares = [0, 1, 9, 14, 22, 27, 35, 40, 48]
 
 
+def get_encoder(name):
+    """
+    Get a registered encoder (see encoders.py). The encoders are imported the first time a player encodes inputs for a
+    neural network, so that the game and the players without one do not need NumPy.
+
+    :param name: Name of the encoder.
+    :return: The encoder.
+    """
+
+    import encoders
+
+    return encoders.get_encoder(name)
+
+
 class Player(object):
     """
     Class that defines a generic Ludo player. Actual players should inherit from this class.
@@ -81,6 +96,10 @@ class Player(object):
         # Timestamp of when self.action was taken (turn number)
         self.timestamp = -1
 
+        # Random generator of the player's own choices (a random.Random of its own makes them independent of the other
+        # players, see QLTrainer.test_paired)
+        self.rng = random
+
     def __deepcopy__(self, memo):
         """
         Overwrite the way a Player object is deep copied. We only want to copy the player's id and state. We don't want
@@ -214,6 +233,45 @@ class Player(object):
 
         return simple_relative_board_state
 
+    def pack_board_state(self, board_state):
+        """
+        Get a compact representation of a board state as seen by this player. It can be used as a key to identify
+        positions.
+
+        :param board_state: The board state with 4 players.
+        :return: A tuple of 16 integers between 0 and 58: the positions of the 4 pieces of this player (in ascending
+        order), then those of the next player (in its own coordinates), and so on.
+        """
+
+        packed = []
+
+        for p_order in range(0, 4):
+            for l, s in enumerate(board_state[(self.id + p_order) % 4].state):
+                if s != 0:
+                    packed.extend([l, ] * int(s * 4))
+
+        return tuple(packed)
+
+    def successor_inputs(self, packed, successors, afterstate):
+        """
+        Describe the neural network inputs of a list of successors as seen by this player (see NN.evaluate_keys).
+
+        :param packed: The board the successors come from, packed by self.pack_board_state(...).
+        :param successors: The successors (see Player.get_next_states).
+        :param afterstate: If True, the inputs are the boards reached by the successors. Otherwise, they are the actions
+        taken from packed.
+        :return: A tuple (keys, packed boards, actions) with an element for each successor.
+        """
+
+        if afterstate:
+            keys = [self.pack_board_state(s['new_state']) for s in successors]
+
+            return keys, keys, [None, ] * len(keys)
+
+        actions = [s['action'] for s in successors]
+
+        return [(packed, action) for action in actions], [packed, ] * len(actions), actions
+
     def transition_is_defensive(self, old_board_state, action, new_board_state):
         """
         Decide if a specific state transition was a defensive move.
@@ -457,55 +515,74 @@ class Player(object):
         else:
             return None
 
-    def board_state_and_action_to_nn_inputs(self, board_state, action):
+    def board_state_and_action_to_nn_inputs(self, board_state, action, encoder="full"):
         """
         Transform a state-action pair to an input suitable for a neural network.
 
         :param board_state: The board state with 4 players.
         :param action: The action as a tuple (src, dst).
-        :return: A list of 238 elements: the first 59 elements represent the state of the current player. The next
-        59 elements represent the state of the next player. And so on. The last two elements represent the action
-        normalized between 0 and 1.
+        :param encoder: Name of the encoder to use (see encoders.py). With the default "full" encoder, the input is a
+        list of 238 elements: the first 59 elements represent the state of the current player. The next 59 elements
+        represent the state of the next player. And so on. The last two elements represent the action normalized
+        between 0 and 1. With the "compact" encoder, the input lists the positions of the 16 pieces followed by the
+        action (all normalized between 0 and 1).
+        :return: A list with the inputs.
         """
 
-        compact = False
+        return get_encoder(encoder).encode(self.pack_board_state(board_state), action)
 
-        if not compact:
-            inputs = [0.0, ] * 238
+    def board_state_to_sparse_nn_inputs(self, board_state):
+        """
+        Transform a board state to the board part of a sparse input suitable for a neural network (see
+        board_state_and_action_to_sparse_nn_inputs(...)).
 
-            # First, put the state of all players
-            i = 0
+        :param board_state: The board state with 4 players.
+        :return: A tuple (indices, values) where indices lists the positions of the non-zero board elements among the
+        238 inputs and values lists their values.
+        """
 
-            for p_order in range(0, 4):
-                for s in board_state[(self.id + p_order) % 4].state:
-                    inputs[i] = s
-                    i += 1
+        return get_encoder("full").board_sparse(self.pack_board_state(board_state))
 
-            # Next, put the action
-            inputs[236] = action[0] / 58.0
-            inputs[237] = action[1] / 58.0
+    def packed_board_state_to_sparse_nn_inputs(self, packed):
+        """
+        Same as board_state_to_sparse_nn_inputs(...), but for a board state packed by pack_board_state(...) (which is
+        cheaper to transform since it only lists the 16 pieces).
 
-            return inputs
-        else:
-            inputs = [0.0, ] * 18
-            inputs_i = 0
+        :param packed: The board state as seen by this player, packed by pack_board_state(...).
+        :return: A tuple (indices, values) where indices lists the positions of the non-zero board elements among the
+        238 inputs and values lists their values.
+        """
+
+        return get_encoder("full").board_sparse(packed)
+
+    def action_to_sparse_nn_inputs(self, action):
+        """
+        Transform an action to the action part of a sparse input suitable for a neural network (see
+        board_state_and_action_to_sparse_nn_inputs(...)).
+
+        :param action: The action as a tuple (src, dst).
+        :return: A tuple (indices, values) where indices lists the positions of the non-zero action elements among the
+        238 inputs and values lists their values.
+        """
 
-            tmp = copy.deepcopy(board_state)
+        return get_encoder("full").action_sparse(action)
 
-            for pi in range(0, 4):
-                for i in range(len(tmp[(self.id + pi) % 4].state)):
-                    while tmp[(self.id + pi) % 4].state[i] > 0.0:
-                        inputs[inputs_i] = i
-                        inputs_i += 1
-                        tmp[(self.id + pi) % 4].state[i] -= 0.25
+    def board_state_and_action_to_sparse_nn_inputs(self, board_state, action):
+        """
+        Transform a state-action pair to a sparse input suitable for a neural network. This is the same input as the
+        one produced by board_state_and_action_to_nn_inputs(...), but only the non-zero elements are listed (at most 16
+        board cells plus the two action elements).
 
-            inputs[16] = action[0]
-            inputs[17] = action[1]
+        :param board_state: The board state with 4 players.
+        :param action: The action as a tuple (src, dst).
+        :return: A tuple (indices, values) where indices lists the positions of the non-zero elements among the 238
+        inputs and values lists their values.
+        """
 
-            for i in range(len(inputs)):
-                inputs[i] /= 58.0
+        indices, values = self.board_state_to_sparse_nn_inputs(board_state)
+        action_indices, action_values = self.action_to_sparse_nn_inputs(action)
 
-            return inputs
+        return indices + action_indices, values + action_values
 
     def move(self, dice_value, players, timestamp):
         """
@@ -519,8 +596,33 @@ class Player(object):
         :param timestamp: Turn number to associate with the move if successful.
         """
 
-        # Get the possible new states
-        successors = self.get_next_states(dice_value, players)
+        self.make_move(self.get_next_states(dice_value, players), players, timestamp)
+
+    def move_steps(self, dice_value, players, timestamp):
+        """
+        Make a move like Player.move(...), as a generator that yields whenever the player needs the outputs of a neural
+        network (see Ludo.play_steps). Each request is a tuple (nn, keys, packed boards, actions) for NN.evaluate_keys,
+        and the outputs are sent back to the generator. This player makes no requests.
+
+        :param dice_value: The value of the dice roll.
+        :param players: Current board state with 4 players.
+        :param timestamp: Turn number to associate with the move if successful.
+        """
+
+        self.move(dice_value, players, timestamp)
+
+        # A generator without requests
+        return
+        yield
+
+    def make_move(self, successors, players, timestamp):
+        """
+        Select one of the possible new states and apply it to the board state (see Player.move).
+
+        :param successors: The possible new states (see Player.get_next_states). If None, nothing changes.
+        :param players: Current board state with 4 players.
+        :param timestamp: Turn number to associate with the move if successful.
+        """
 
         # Select the new state
         if successors is not None:
@@ -5,11 +5,13 @@ Defines a Q-Learning Ludo player through the QLPlayer class.
 """
 
 import copy
-import math
-import random
 
+from accumulator import Accumulator
+from health import NumericalError
+from health import healthy
 from player import Player
 from player import PlayerKind
+from rewards import shaped_rewards
 
 
 class QLPlayer(Player):
@@ -21,12 +23,24 @@ class QLPlayer(Player):
     learning_rate = 0.5
     discount_rate = 0.95
 
-    def __init__(self, id, train=False, nn=None, epsilon=0.0):
+    def __init__(self, id, train=False, nn=None, epsilon=0.0, afterstate=False, target=None, replay=None, learn=True,
+                 learning_rate=None, discount_rate=None, metrics=None):
         """
         Construct a new Q-Learning player.
 
         :param: train: If True, the player trains the neural network while playing. Otherwise, it just plays.
         :param: nn: A PyBrain neural network to use for this player.
+        :param: afterstate: If True, the neural network (with 236 inputs) estimates the value of the board reached by a
+        move (the afterstate) instead of the value of a state-action pair (with 238 inputs).
+        :param: target: A TargetNetwork (see target_nn.py) to compute the estimates of optimal future value with. If
+        None, they are computed with nn itself.
+        :param: replay: A ReplayBuffer (see replay_buffer.py) where to store the transitions the player is trained with.
+        :param: learn: If False (in the train mode), the player only stores its transitions in replay without training
+        the neural network (e.g. an actor of actor_learner.py).
+        :param: learning_rate: The Q-Learning rate of this player. If None, QLPlayer.learning_rate is used.
+        :param: discount_rate: The discount rate of this player. If None, QLPlayer.discount_rate is used.
+        :param: metrics: A Metrics stream (see metrics.py) where to count the turns, the evaluations of the neural
+        network and the updates, and to observe the Q values and the TD errors. If None, nothing is measured.
         """
 
         # Initialize a generic player
@@ -34,12 +48,97 @@ class QLPlayer(Player):
 
         # QLPlayer-specific section
         self.old_board_state = None
+        self.old_packed = None
         self.old_to_new_action = None
         self.new_board_state = None
         self.train = train
         self.nn = nn
         self.epsilon = epsilon
+        self.afterstate = afterstate
+        self.target = target
+        self.replay = replay
+        self.learn = learn
         self.cum_reward = 0.0
+        self.learning_rate = QLPlayer.learning_rate if learning_rate is None else learning_rate
+        self.discount_rate = QLPlayer.discount_rate if discount_rate is None else discount_rate
+        self.metrics = metrics
+
+        # Values of the successors of the current move, if they were requested in advance (see QLPlayer.move_steps)
+        self.prefetched = None
+
+        # Hidden layer accumulators for old_board_state (as seen by this player) and for new_board_state (as seen by the
+        # next player). They are created on first use and then updated incrementally from one turn to the next.
+        self.accumulator = None
+        self.next_accumulator = None
+
+    def successor_values(self, player, accumulator, packed, successors, values=None):
+        """
+        Evaluate a list of successors with the neural network from the perspective of the player who would move. The
+        values are looked up in the cache of the network first (see NN.lookup). With backends that have no accumulator
+        but evaluate batches (e.g. the "server" backend), the other successors are evaluated in a single batch.
+
+        :param player: The player who would move (this player or the copy of another player in a board state).
+        :param accumulator: An accumulator holding the inputs of the board the successors come from (as seen by player).
+        :param packed: The board the successors come from, packed by player.pack_board_state(...).
+        :param successors: The successors to evaluate (see Player.get_next_states).
+        :param values: In the afterstate mode, a dictionary with the values of the afterstates evaluated so far (keyed
+        by Player.pack_board_state). It is updated with the new values, so that identical afterstates (e.g. reached
+        with different dice values) are evaluated only once.
+        :return: A list with the value of each successor.
+        """
+
+        q_values = []
+
+        if self.afterstate and values is None:
+            values = {}
+
+        # Without incremental evaluation, each successor would be a request of its own (e.g. a round trip to an
+        # inference server, see server_nn.py): the successors that are not cached are evaluated in a single batch
+        if not self.nn.supports("accumulator") and self.nn.supports("batch"):
+            keys, boards, actions = player.successor_inputs(packed, successors, self.afterstate)
+
+            if not self.afterstate:
+                return self.nn.evaluate_keys(keys, boards, actions)
+
+            new_keys = []
+
+            for key in keys:
+                if key not in values and key not in new_keys:
+                    new_keys.append(key)
+
+            if len(new_keys) > 0:
+                values.update(zip(new_keys, self.nn.evaluate_keys(new_keys, new_keys, [None, ] * len(new_keys))))
+
+            return [values[key] for key in keys]
+
+        if self.afterstate:
+            for s in successors:
+                key = player.pack_board_state(s['new_state'])
+
+                if key not in values:
+                    value = self.nn.lookup(key)
+
+                    if value is None:
+                        # Afterstates differ from the current board in a few cells only
+                        indices, deltas = accumulator.changes_to(*self.nn.encoder.board_sparse(key))
+                        value = accumulator.evaluate(indices, deltas)
+                        self.nn.store(key, value)
+
+                    values[key] = value
+
+                q_values.append(values[key])
+        else:
+            for s in successors:
+                key = (packed, s['action'])
+                value = self.nn.lookup(key)
+
+                if value is None:
+                    value = accumulator.evaluate(*self.nn.encoder.action_sparse(s['action'], packed))
+                    self.nn.store(key, value)
+
+                q_values.append(value)
+
+        return q_values
 
     def reward(self):
         """
@@ -59,44 +158,84 @@ class QLPlayer(Player):
             # Calculate in two different ways
             simple_way = True
 
-            # Convert the old board state to inputs for the neural network
-            old_inputs = self.board_state_and_action_to_nn_inputs(self.old_board_state, self.old_to_new_action)
-
-            # Now, apply the Q-Learning update: start by finding Q(s_t, a)
-            old_q = self.nn.evaluate(old_inputs)
-
-            # Then the estimate of optimal future value: 0 when the new state is a final state
+            # Find out if the new state is a final state
             final_state = False
-            min_q_est = 0
-            max_q_est = 0
 
             for p in self.new_board_state:
                 if p.state[58] == 1:
                     final_state = True
                     break
 
-            if not final_state:
-                min_q_est = float("inf")
-                max_q_est = float("-inf")
-
-                if simple_way:
-                    next_player = self.new_board_state[(self.id + 1) % 4]
+            # The board the next player moves from and its successors for all the dice values (also the actions
+            # available to the next player, for the replay buffer)
+            next_player = self.new_board_state[(self.id + 1) % 4]
+            next_packed = next_player.pack_board_state(self.new_board_state)
+            new_successors = []
 
-                    for dice in range(1, 6 + 1):
-                        new_successors = next_player.get_next_states(dice, self.new_board_state)
+            if not final_state:
+                for dice in range(1, 6 + 1):
+                    successors = next_player.get_next_states(dice, self.new_board_state)
+
+                    if successors is not None:
+                        new_successors.extend(successors)
+
+            next_actions = [s['action'] for s in new_successors]
+
+            # Without learning, just keep the transition for someone else to train with
+            if not self.learn:
+                self.replay.add(self.old_packed, self.old_to_new_action, self.cum_reward, final_state, next_packed,
+                                next_actions)
+                self.cum_reward = 0.0
+                return
+
+            # Convert the old board state to inputs for the neural network and apply the Q-Learning update: start by
+            # finding Q(s_t, a) (the accumulator holds old_board_state). In the afterstate mode, Q(s_t, a) is the value
+            # of the board reached by the action.
+            if self.afterstate:
+                old_key = self.pack_board_state(self.new_board_state)
+                old_indices, old_values = self.nn.encoder.board_sparse(old_key)
+                old_q = self.nn.lookup(old_key)
+
+                if old_q is None:
+                    old_q = self.accumulator.evaluate(*self.accumulator.changes_to(old_indices, old_values))
+            else:
+                old_key = (self.old_packed, self.old_to_new_action)
+                old_indices, old_values = self.nn.encoder.sparse(self.old_packed, self.old_to_new_action)
+                old_q = self.nn.lookup(old_key)
 
-                        if new_successors is not None:
-                            for s in new_successors:
-                                new_inputs = next_player.board_state_and_action_to_nn_inputs(self.new_board_state,
-                                                                                             s['action'])
+                if old_q is None:
+                    old_q = self.accumulator.evaluate(*self.nn.encoder.action_sparse(self.old_to_new_action,
+                                                                                     self.old_packed))
 
-                                new_q_est = self.nn.evaluate(new_inputs)
+            # Then the estimate of optimal future value: 0 when the new state is a final state
+            min_q_est = 0
+            max_q_est = 0
 
-                                if new_q_est > max_q_est:
-                                    max_q_est = new_q_est
+            if not final_state:
+                min_q_est = float("inf")
+                max_q_est = float("-inf")
 
-                                if new_q_est < min_q_est:
-                                    min_q_est = new_q_est
+                if simple_way:
+                    # The successors are evaluated together
+                    if self.target is not None:
+                        self.target.refresh_if_needed()
+                        estimates = self.target.successor_values(next_player, next_packed, new_successors,
+                                                                 self.afterstate)
+                    else:
+                        # All the successors are evaluated with respect to the board they come from
+                        if self.next_accumulator is None:
+                            self.next_accumulator = Accumulator(self.nn)
+
+                        self.next_accumulator.refresh(*self.nn.encoder.board_sparse(next_packed))
+                        estimates = self.successor_values(next_player, self.next_accumulator, next_packed,
+                                                          new_successors)
+
+                    for new_q_est in estimates:
+                        if new_q_est > max_q_est:
+                            max_q_est = new_q_est
+
+                        if new_q_est < min_q_est:
+                            min_q_est = new_q_est
                 else:
                     # Get all possible successors until it's this player's turn again
                     cur_state1 = self.new_board_state
@@ -140,10 +279,11 @@ class QLPlayer(Player):
 
                                                 for s4 in new_successors4:
                                                     # It's this player's turn
-                                                    new_inputs = self.board_state_and_action_to_nn_inputs(cur_state4,
-                                                                                                          s4['action'])
+                                                    new_indices, new_values = \
+                                                        self.board_state_and_action_to_sparse_nn_inputs(cur_state4,
+                                                                                                        s4['action'])
 
-                                                    new_q_est = self.nn.evaluate(new_inputs)
+                                                    new_q_est = self.nn.evaluate_sparse(new_indices, new_values)
 
                                                     if new_q_est > max_q_est:
                                                         max_q_est = new_q_est
@@ -154,18 +294,52 @@ class QLPlayer(Player):
             if min_q_est == float("inf"):
                 min_q_est = 0
 
-            # Calculate the new Q value (alpha = 0.5, gamma = 0.95)
+            # Calculate the new Q value
             if simple_way:
-                new_q = old_q + QLPlayer.learning_rate * (self.cum_reward - QLPlayer.discount_rate * max_q_est - old_q)
+                new_q = old_q + self.learning_rate * (self.cum_reward - self.discount_rate * max_q_est - old_q)
             else:
-                new_q = old_q + QLPlayer.learning_rate * (self.cum_reward - QLPlayer.discount_rate * max_q_est - old_q)
+                new_q = old_q + self.learning_rate * (self.cum_reward - self.discount_rate * max_q_est - old_q)
+
+            # A diverging target is caught before it reaches the weights (see health.py)
+            if not healthy(new_q):
+                raise NumericalError("Unhealthy Q-Learning target",
+                                     {"player": self.id, "packed": self.old_packed, "action": self.old_to_new_action,
+                                      "afterstate": self.afterstate, "indices": old_indices, "values": old_values,
+                                      "reward": self.cum_reward, "old_q": old_q, "max_q_est": max_q_est,
+                                      "target": new_q})
 
             # Train the neural network with this data point
-            self.nn.train_with_datapoint(old_inputs, new_q)
+            self.nn.train_with_sparse_datapoint(old_indices, old_values, new_q)
+
+            if self.metrics is not None:
+                self.metrics.count("updates")
+                self.metrics.count("nn_evaluations", len(new_successors) + 1)
+                self.metrics.observe("td_error", self.cum_reward - self.discount_rate * max_q_est - old_q)
+
+            # Keep the transition to train with it again later
+            if self.replay is not None:
+                self.replay.add(self.old_packed, self.old_to_new_action, self.cum_reward, final_state, next_packed,
+                                next_actions)
 
         # Reset the accumulated reward
         self.cum_reward = 0.0
 
+    def move_steps(self, dice_value, players, timestamp):
+        """
+        Override the parent method. The values of all the successors are requested at once, before choosing one of
+        them.
+        """
+
+        successors = self.get_next_states(dice_value, players)
+
+        # A player that always moves randomly does not need the values
+        if successors is not None and not (self.train and self.epsilon >= 1.0):
+            keys, packed, actions = self.successor_inputs(self.pack_board_state(players), successors, self.afterstate)
+            self.prefetched = yield (self.nn, keys, packed, actions)
+
+        self.make_move(successors, players, timestamp)
+        self.prefetched = None
+
     def select_new_state(self, board_state, successors, timestamp):
         """
         Override the parent method in order to implement the Q-Learning strategy.
@@ -174,31 +348,49 @@ class QLPlayer(Player):
         # Store the current state as the old state
         self.old_board_state = copy.deepcopy(board_state)
 
+        # Bring the accumulator to the current board (only the cells that changed since the last turn are applied)
+        if self.accumulator is None:
+            self.accumulator = Accumulator(self.nn)
+
+        self.old_packed = self.pack_board_state(self.old_board_state)
+        self.accumulator.refresh(*self.nn.encoder.board_sparse(self.old_packed))
+
+        if self.metrics is not None:
+            self.metrics.count("turns")
+
         # Use an epsilon-greedy policy to choose the next successor when training (otherwise choose the best)
-        if self.train and random.uniform(0, 1) < self.epsilon:
-            successor_index = random.randint(0, len(successors) - 1)
-        else:
-            # Evaluate each successor using the neural network and choose the best (ties are broken randomly)
-            q_values = []
+        if self.train and self.rng.uniform(0, 1) < self.epsilon:
+            successor_index = self.rng.randint(0, len(successors) - 1)
 
-            for successor_index in range(len(successors)):
-                action = successors[successor_index]["action"]
-                q_values.append(self.nn.evaluate(self.board_state_and_action_to_nn_inputs(self.old_board_state,
-                                                                                          action)))
+            if self.metrics is not None:
+                self.metrics.count("random_moves")
+        else:
+            # Evaluate each successor using the neural network (unless the values were requested in advance) and choose
+            # the best (ties are broken randomly)
+            if self.prefetched is not None:
+                q_values = self.prefetched
+            else:
+                q_values = self.successor_values(self, self.accumulator, self.old_packed, successors)
 
             max_q_value = max(q_values)
 
-            if math.isnan(max_q_value):
-                print "Got NaN!"
-                exit()
-            else:
-                successor_candidates = []
+            if self.metrics is not None:
+                self.metrics.count("nn_evaluations", len(q_values))
+                self.metrics.observe("q_value", max_q_value)
+
+            # The sum is NaN or infinite if any of the values is
+            if not healthy(sum(q_values)):
+                raise NumericalError("Unhealthy Q values",
+                                     {"player": self.id, "packed": self.old_packed, "afterstate": self.afterstate,
+                                      "actions": [s["action"] for s in successors], "q_values": q_values})
 
-                for i in range(len(q_values)):
-                    if q_values[i] == max_q_value:
-                        successor_candidates.append(i)
+            successor_candidates = []
 
-                successor_index = successor_candidates[random.randint(0, len(successor_candidates) - 1)]
+            for i in range(len(q_values)):
+                if q_values[i] == max_q_value:
+                    successor_candidates.append(i)
+
+            successor_index = successor_candidates[self.rng.randint(0, len(successor_candidates) - 1)]
 
         # Store the action and the new state
         self.old_to_new_action = (successors[successor_index]["action"][0], successors[successor_index]["action"][1])
@@ -208,115 +400,24 @@ class QLPlayer(Player):
         # print "Chosen source position:    " + str(successors[successor_index]['action'][0])
         # print
 
-        # Assign rewards
-        cur_board_state = board_state
-        action = self.old_to_new_action
-        new_board_state = self.new_board_state
-
-        # Find out if the player won the game and reward players appropriately
-        if new_board_state[self.id].state[58] == 1.0:
-            # The current player won
-            self.cum_reward += 1.0
-
-            # The others lost: reward negatively
-            try:
-                cur_board_state[(self.id + 1) % 4].cum_reward += -1.0
-            except AttributeError:
-                pass
-
-            try:
-                cur_board_state[(self.id + 2) % 4].cum_reward += -1.0
-            except AttributeError:
-                pass
-
-            try:
-                cur_board_state[(self.id + 3) % 4].cum_reward += -1.0
-            except AttributeError:
-                pass
-
-        # Find out if the player released one of its pieces and reward appropriately
-        if new_board_state[self.id].state[0] < cur_board_state[self.id].state[0]:
-            self.cum_reward += 0.25
-
-        # Find out if a vulnerable piece was defended
-        src_piece_loc = action[0]
-
-        # A vulnerable piece must be in the circular track
-        if 1 <= src_piece_loc <= 51:
-            # A vulnerable piece must have been in a non-safe square
-            if src_piece_loc not in [1, 9, 14, 22, 27, 35, 40, 48]:
-                # A vulnerable piece must have been alone
-                if cur_board_state[self.id].state[src_piece_loc] == 0.25:
-                    # A vulnerable piece must have been within knocking range
-                    vulnerable = False
-
-                    for np in range(1, 4):
-                        # Transform the piece position to be as seen by opponent np
-                        src_piece_loc_in_np = (src_piece_loc - 13 * np) % 52
-
-                        # The only catch is that this transformation yields 0 for what's supposed to be square 52.
-                        # However, this is perfect for the next step.
-
-                        # Go through this opponent's pieces to see if any of them can knock the piece in question
-                        for op in range(1, 52):
-                            if cur_board_state[(self.id + np) % 4].state[op] == 0:
-                                continue
-
-                            if 0 < src_piece_loc_in_np - op <= 6:
-                                vulnerable = True
-                                break
-
-                        if vulnerable:
-                            self.cum_reward += 0.2
-                            break
-
-        # Find out if the player knocked a piece belonging to an opponent and reward appropriately
-        for np in range(1, 4):
-            diff = new_board_state[(self.id - np) % 4].state[0] - cur_board_state[(self.id - np) % 4].state[0]
-
-            if diff > 0:
-                self.cum_reward += 0.15 * diff * 4
-
-        # Find out if the player knocked a piece belonging to the previous player and reward that player negatively
-        diff = new_board_state[(self.id - 1) % 4].state[0] - cur_board_state[(self.id - 1) % 4].state[0]
-
-        if diff > 0 and timestamp > 0 and cur_board_state[(self.id - 1) % 4].timestamp == timestamp - 1:
-            try:
-                cur_board_state[(self.id - 1) % 4].cum_reward += -0.25
-            except AttributeError:
-                pass
-
-        # Find out if the current player moved a piece closest to home (not including pieces at the start)
-        """
-        cur_closest = 57
-
-        while True:
-            if cur_closest == 0:
-                # We reached the start area. No reward will be given
-                break
-            elif cur_board_state[self.id].state[cur_closest] > 0:
-                # We found a piece closest to home in the current board. Check if it moved
-                if new_board_state[self.id].state[cur_closest] < cur_board_state[self.id].state[cur_closest]:
-                    self.cum_reward += 0.1
-                break
-            else:
-                cur_closest -= 1
-        """
+        # Assign rewards: this player's own, and penalties to the other players (only the Q-Learning players keep them)
+        rewards = shaped_rewards(self.id, [p.state for p in board_state], self.old_to_new_action,
+                                 [p.state for p in self.new_board_state],
+                                 timestamp > 0 and board_state[(self.id - 1) % 4].timestamp == timestamp - 1)
 
-        # Find out if the current player formed a blockade (in the circular track) and reward appropriately
-        for l in range(1, 52):
-            # Ignore safe squares
-            if l in [1, 9, 14, 22, 27, 35, 40, 48]:
-                continue
+        self.cum_reward += rewards[self.id]
 
-            if new_board_state[self.id].state[l] >= 0.5 > cur_board_state[self.id].state[l]:
-                self.cum_reward += 0.05
-                break
+        for p in range(4):
+            if p != self.id and rewards[p] != 0.0:
+                try:
+                    board_state[p].cum_reward += rewards[p]
+                except AttributeError:
+                    pass
 
         # Commit rewards for this player and the previous ones
         for i in range(0, 4):
             try:
-                cur_board_state[(self.id - i) % 4].reward()
+                board_state[(self.id - i) % 4].reward()
             except AttributeError:
                 pass
 
@@ -5,9 +5,10 @@ Defines a Q-Learning Ludo player through the QLPlayer class.
 """
 
 import copy
-import math
-import random
 
+from encoders import get_encoder
+from health import NumericalError
+from health import healthy
 from player import Player
 from player import PlayerKind
 
@@ -54,29 +55,7 @@ class QLPlayer(Player):
         normalized between 0 and 1.
         """
 
-        inputs = [0.0, ] * 237
-
-        # First, put the state of all players
-        i = 0
-
-        for p_order in range(0, 4):
-            for s in board_state[(self.id + p_order) % 4].state:
-                inputs[i] = s
-                i += 1
-
-        # Next, put the action
-        if category == Player.DEFENSIVE_MOVE:
-            inputs[236] = 0.20
-        elif category == Player.AGGRESSIVE_MOVE:
-            inputs[236] = 0.40
-        elif category == Player.FAST_MOVE:
-            inputs[236] = 0.60
-        elif category == Player.RELEASE_MOVE:
-            inputs[236] = 0.80
-        elif category == Player.RANDOM_MOVE:
-            inputs[236] = 1.00
-
-        return inputs
+        return get_encoder("category").encode(self.pack_board_state(board_state), category)
 
     def reward(self):
         """
@@ -93,11 +72,12 @@ class QLPlayer(Player):
 
         # Provide the neural network with a training point
         if self.old_board_state is not None and self.old_to_new_cat is not None and self.new_board_state is not None:
-            # Convert the old board state to inputs for the neural network
-            old_inputs = self.board_state_and_category_to_nn_inputs(self.old_board_state, self.old_to_new_cat)
+            # Convert the old board state to (sparse) inputs for the neural network with the network's encoder
+            old_packed = self.pack_board_state(self.old_board_state)
+            old_indices, old_values = self.nn.encoder.sparse(old_packed, self.old_to_new_cat)
 
             # Now, apply the Q-Learning update: start by finding Q(s_t, a)
-            old_q = self.nn.evaluate(old_inputs)
+            old_q = self.nn.evaluate_sparse(old_indices, old_values)
 
             # Then the estimate of optimal future value: 0 when the new state is a final state
             final_state = False
@@ -142,11 +122,11 @@ class QLPlayer(Player):
                 # Delete duplicate categories
                 app_categories = list(set(app_categories))
 
-                # Evaluate the categories
-                for c in app_categories:
-                    new_inputs = next_player.board_state_and_category_to_nn_inputs(self.new_board_state, c)
-                    new_q_est = self.nn.evaluate(new_inputs)
+                # Evaluate the categories (all at once)
+                next_packed = next_player.pack_board_state(self.new_board_state)
+                rows = self.nn.encoder.encode_batch([next_packed] * len(app_categories), app_categories)
 
+                for new_q_est in self.nn.evaluate_batch(rows):
                     if new_q_est > max_q_est:
                         max_q_est = new_q_est
 
@@ -162,8 +142,15 @@ class QLPlayer(Player):
             # Calculate the new Q value (alpha = 0.5, gamma = 0.95)
             new_q = old_q + QLPlayer.learning_rate * (self.cum_reward - QLPlayer.discount_rate * min_q_est - old_q)
 
+            # A diverging target is caught before it reaches the weights (see health.py)
+            if not healthy(new_q):
+                raise NumericalError("Unhealthy Q-Learning target",
+                                     {"player": self.id, "indices": old_indices, "values": old_values,
+                                      "reward": self.cum_reward, "old_q": old_q, "min_q_est": min_q_est,
+                                      "target": new_q})
+
             # Train the neural network with this data point
-            self.nn.train_with_datapoint(old_inputs, new_q)
+            self.nn.train_with_sparse_datapoint(old_indices, old_values, new_q)
 
         # Reset the accumulated reward
         self.cum_reward = 0.0
@@ -213,15 +200,14 @@ class QLPlayer(Player):
             print "P" + str(self.id) + ": Categories: " + str(app_categories)
 
         # Use an epsilon-greedy policy to choose the next category when training (otherwise choose the best)
-        if self.train and random.uniform(0, 1) < self.epsilon:
+        if self.train and self.rng.uniform(0, 1) < self.epsilon:
             # Choose a random category
-            self.old_to_new_cat = app_categories[random.randint(0, len(app_categories) - 1)]
+            self.old_to_new_cat = app_categories[self.rng.randint(0, len(app_categories) - 1)]
         else:
             # Evaluate each action category using the neural network and choose the best (ties are broken randomly)
-            q_values = []
-
-            for c in app_categories:
-                q_values.append(self.nn.evaluate(self.board_state_and_category_to_nn_inputs(self.old_board_state, c)))
+            old_packed = self.pack_board_state(self.old_board_state)
+            rows = self.nn.encoder.encode_batch([old_packed] * len(app_categories), app_categories)
+            q_values = self.nn.evaluate_batch(rows)
 
             if QLPlayer.debug:
                 print "P" + str(self.id) + ": Q values: " + str(q_values)
@@ -231,17 +217,19 @@ class QLPlayer(Player):
             if QLPlayer.debug:
                 print "P" + str(self.id) + ": Max Q value: " + str(max_q_value)
 
-            if math.isnan(max_q_value):
-                print "Got NaN!"
-                exit()
-            else:
-                cat_candidates = []
+            # The sum is NaN or infinite if any of the values is
+            if not healthy(sum(q_values)):
+                raise NumericalError("Unhealthy Q values",
+                                     {"player": self.id, "packed": old_packed, "categories": app_categories,
+                                      "q_values": q_values})
+
+            cat_candidates = []
 
-                for i in range(len(q_values)):
-                    if q_values[i] == max_q_value:
-                        cat_candidates.append(i)
+            for i in range(len(q_values)):
+                if q_values[i] == max_q_value:
+                    cat_candidates.append(i)
 
-                self.old_to_new_cat = app_categories[cat_candidates[random.randint(0, len(cat_candidates) - 1)]]
+            self.old_to_new_cat = app_categories[cat_candidates[self.rng.randint(0, len(cat_candidates) - 1)]]
 
         if QLPlayer.debug:
             print "P" + str(self.id) + ": Chosen category: " + str(self.old_to_new_cat)
@@ -253,7 +241,7 @@ class QLPlayer(Player):
             if successors[i]['categories'] & self.old_to_new_cat > 0:
                 s_with_category.append(i)
 
-        successor_index = s_with_category[random.randint(0, len(s_with_category) - 1)]
+        successor_index = s_with_category[self.rng.randint(0, len(s_with_category) - 1)]
 
         # Store the action and the new state
         self.old_to_new_action = (successors[successor_index]["action"][0], successors[successor_index]["action"][1])
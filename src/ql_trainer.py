@@ -4,12 +4,30 @@ ql_trainer.py
 Provides a controller to train a Q-Learning neural network in the Ludo game.
 """
 
+import collections
+import math
 import random
 
+import numpy
+
+from background_eval import BackgroundEvaluator
+from checkpoint import CheckpointWriter
+from checkpoint import read_checkpoint
+from metrics import Metrics
+from metrics import RangeHistogram
+from frozen_nn import export_frozen
+from health import HealthMonitor
+from health import NumericalError
 from ludo import Ludo
 from ql_player import QLPlayer
+from replay_buffer import PrioritizedReplayBuffer
+from replay_buffer import ReplayBuffer
+from replay_buffer import train_from_replay
 from rnd_player import RandomPlayer
+from target_nn import TargetNetwork
 from mixed_strategy_player import MixedStrategyPlayer
+from encoders import get_encoder
+from game_scheduler import GameScheduler
 from nn import NN
 
 
@@ -18,152 +36,743 @@ class QLTrainer(Ludo):
     Class that provides a Q-Learning trainer for a Ludo game.
     """
 
-    def __init__(self, num_episodes, nn_file_dst, nn_file_src=None, debug=False):
+    # Initial probability of a random move (see QLTrainer.epsilon)
+    max_epsilon = 0.9
+
+    # Number of training episodes between tests, and number of games of each test (see QLTrainer.print_tests)
+    test_every = 20000
+    num_test_games = 1000
+
+    # Number of training episodes between checkpoints (and saved training states, see QLTrainer.get_state)
+    checkpoint_every = 1000
+
+    # Seconds between the records of the metrics stream (see QLTrainer.create_metrics)
+    metrics_interval = 10.0
+
+    # Factor of the learning rate of the network after each rollback to the last good weights, and number of rollbacks
+    # after which the training gives up (see health.py)
+    rollback_lr_decay = 0.5
+    max_rollbacks = 10
+
+    def __init__(self, num_episodes, nn_file_dst, nn_file_src=None, debug=False, nn_backend=None, afterstate=False,
+                 cache_bytes=None, keep_checkpoints=3, nn_encoder=None, target_update=None, replay_capacity=None,
+                 replay_batch_size=32, replay_batches=4, replay_file=None, replay_alpha=None, learning_rate=None,
+                 discount_rate=None, nn_learning_rate=None, nn_momentum=None, nn_backend_options=None):
         """
         Constructor for a new trainer.
 
         :param: num_episodes: Number of episodes to train the network with.
-        :param nn_file_dst: The name of a file where to store the resulting neural network.
+        :param nn_file_dst: The name of a file where to store the resulting neural network (as a binary checkpoint).
         :param nn_file_src: The name of a file where to retrieve an existing neural network and use it as the starting
         point. If no file is provided, the neural network will be initialize with random weights.
         :param debug: If True, print debugging information.
+        :param nn_backend: Name of the implementation of the neural network (see NN). If None, the default backend is
+        used.
+        :param afterstate: If True, the Q-Learning players learn the values of afterstates (see QLPlayer).
+        :param cache_bytes: Memory budget (in bytes) for a cache of neural network outputs. If None, no cache is used.
+        :param keep_checkpoints: Number of periodic checkpoints to keep next to nn_file_dst (as nn_file_dst.<episode>).
+        :param nn_encoder: Name of the encoder of the neural network inputs (see encoders.py). If None, "board" is used
+        for afterstate values and "full" otherwise. Linear models (nn_backend="linear") need a feature encoder:
+        "board_features" or "features".
+        :param target_update: If not None, the estimates of optimal future value are computed with a target network
+        (see target_nn.py) refreshed every target_update training updates. Otherwise, they are computed with the
+        network being trained.
+        :param replay_capacity: If not None, the transitions are also stored in a replay buffer (see replay_buffer.py)
+        of this many transitions, and the network is trained with batches sampled from it after every episode.
+        :param replay_batch_size: Number of transitions in each replay batch.
+        :param replay_batches: Number of replay batches after every episode.
+        :param replay_file: If not None, the replay buffer is memory-mapped from files named after replay_file.
+        :param replay_alpha: If not None, transitions are replayed in proportion to their last error to the power of
+        replay_alpha (see PrioritizedReplayBuffer). Otherwise, they are replayed uniformly.
+        :param learning_rate: The Q-Learning rate of the players. If None, QLPlayer.learning_rate is used.
+        :param discount_rate: The discount rate of the players. If None, QLPlayer.discount_rate is used.
+        :param nn_learning_rate: The learning rate of the network. If None, NN.learning_rate is used.
+        :param nn_momentum: The learning momentum of the network. If None, NN.momentum is used.
+        :param nn_backend_options: A dictionary of extra arguments of the backend of the network (e.g. the memory budget
+        of a table or the step size of a linear model, see NN).
         """
 
         # Initialize a Ludo game
         Ludo.__init__(self, [])
 
         # Members specific to QLTrainer
-        self.nn = NN(238, nn_file_src)
+        if nn_encoder is None:
+            nn_encoder = "board" if afterstate else "full"
+
+        self.nn = NN(get_encoder(nn_encoder).num_inputs, nn_file_src, nn_backend, nn_encoder, nn_learning_rate,
+                     nn_momentum, nn_backend_options)
+        self.afterstate = afterstate
+        self.learning_rate = learning_rate
+        self.discount_rate = discount_rate
+        self.metrics = None
+        self.monitor = None
+
+        self.nn.enable_cache(cache_bytes)
         self.num_episodes = num_episodes
         self.nn_file_dst = nn_file_dst
+        self.keep_checkpoints = keep_checkpoints
+        self.target_update = target_update
+
+        self.replay = None
+        self.replay_batch_size = replay_batch_size
+        self.replay_batches = replay_batches
+
+        if replay_capacity is not None:
+            if replay_alpha is not None:
+                self.replay = PrioritizedReplayBuffer(replay_capacity, replay_file, replay_alpha)
+            else:
+                self.replay = ReplayBuffer(replay_capacity, replay_file)
         self.debug = debug
 
-    def train(self, test=False):
-        # Keep track of how many times each player wins
-        wins = [0, ] * 4
+        # Progress of the training: first episode to play, wins of each player, rows of the learning curve and rollbacks
+        # after numerical errors so far (restored by QLTrainer.load_state)
+        self.first_episode = 0
+        self.wins = [0, ] * 4
+        self.curve = []
+        self.rollbacks = 0
 
-        # For the epsilon greedy strategy, start with 0.9 and decrease linearly to 0
-        max_epsilon = 0.9
-        epsilon = max_epsilon
+        # Parts of a restored state that are applied when training starts (see QLTrainer.load_state)
+        self.target_state = None
+        self.random_states = None
 
-        if self.debug:
-            print "===================================================================================================="
-            print "| TRAINING STARTED                                                                                 |"
-            print "===================================================================================================="
-            print
+    def epsilon(self, episode):
+        """
+        Get the exploration rate of the epsilon greedy strategy for an episode: it starts with QLTrainer.max_epsilon and
+        decreases linearly to 0 over the first 10% of the episodes.
 
-        # Test initially
-        if test:
-            print "%-10d %20.2f %20.2f" % (0,
-                                           self.test(1000, "1_QL_AGAINST_3_RANDOM")[0],
-                                           self.test(1000, "1_QL_AGAINST_3_EXPERT")[0])
+        :param episode: Number of the episode (starting with 0).
+        :return: The probability of a random move.
+        """
+
+        if episode == 0:
+            return QLTrainer.max_epsilon
+
+        # The rate is decreased after each episode
+        episode -= 1
+
+        if episode < 0.1 * self.num_episodes:
+            return ((0.1 * self.num_episodes - 1) - episode) * QLTrainer.max_epsilon / (0.1 * self.num_episodes - 1)
+
+        return 0
+
+    def training_players(self, epsilon, target=None, learn=True):
+        """
+        Create the players of a training episode: four Q-Learning players that share the network.
+
+        :param epsilon: The probability of a random move (see QLPlayer).
+        :param target: A target network for the estimates of optimal future value (see target_nn.py), or None.
+        :param learn: If False, the players only store their transitions in the replay buffer (see QLPlayer).
+        :return: A list with the players.
+        """
 
-        for episode in range(self.num_episodes):
+        return [QLPlayer(id=p, train=True, nn=self.nn, epsilon=epsilon, afterstate=self.afterstate, target=target,
+                         replay=self.replay, learn=learn, learning_rate=self.learning_rate,
+                         discount_rate=self.discount_rate, metrics=self.metrics)
+                for p in range(4)]
+
+    def play_episode(self, epsilon, target=None, learn=True):
+        """
+        Play a training episode (see QLTrainer.training_players).
+
+        :param epsilon: The probability of a random move (see QLPlayer).
+        :param target: A target network for the estimates of optimal future value (see target_nn.py), or None.
+        :param learn: If False, the players only store their transitions in the replay buffer (see QLPlayer).
+        :return: The index of the player who won.
+        """
+
+        # Players to train with
+        self.players = self.training_players(epsilon, target, learn)
+
+        # Always start with the player 0
+        self.player_turn = 0
+
+        # Initially, all players are at the starting positions
+        for player in self.players:
+            player.state = [0.0, ] * 59
+            player.state[0] = 1.00
+
+        # Start the episode
+        self.play()
+
+        return self.winner()
+
+    def training_episodes(self, target=None, interleave=None):
+        """
+        Play the training episodes.
+
+        :param target: A target network for the estimates of optimal future value (see target_nn.py), or None.
+        :param interleave: If not None, this many episodes are played at once (see game_scheduler.py). Otherwise, the
+        episodes are played one after the other.
+        :return: A generator of the index of the player who won each episode, as each episode ends (None for an episode
+        ended by a numerical error, see QLTrainer.recover). Episodes are started only when the generator is resumed.
+        """
+
+        if interleave is None:
+            for episode in range(self.first_episode, self.num_episodes):
+                if self.debug:
+                    print "Training episode " + str(episode + 1) + "/" + str(self.num_episodes) + "..."
+
+                try:
+                    winner = self.play_episode(self.epsilon(episode), target)
+                except NumericalError as error:
+                    self.recover(error, episode, target)
+                    winner = None
+
+                yield winner
+        else:
+            episode = self.first_episode
+
+            # After a numerical error, the episodes in progress are dropped and played again from the start
+            while episode < self.num_episodes:
+                try:
+                    for game in GameScheduler(interleave).play(self.training_games(target, episode)):
+                        episode += 1
+                        yield game.winner()
+                except NumericalError as error:
+                    self.recover(error, episode, target)
+
+    def training_games(self, target=None, first_episode=None):
+        """
+        Create the training episodes as separate games (see QLTrainer.training_episodes).
+
+        :param target: A target network for the estimates of optimal future value (see target_nn.py), or None.
+        :param first_episode: Number of the first episode. If None, QLTrainer.first_episode is used.
+        :return: A generator of Ludo games.
+        """
+
+        if first_episode is None:
+            first_episode = self.first_episode
+
+        for episode in range(first_episode, self.num_episodes):
             if self.debug:
                 print "Training episode " + str(episode + 1) + "/" + str(self.num_episodes) + "..."
 
-            # Players to train with
-            self.players = [QLPlayer(id=0, train=True, nn=self.nn, epsilon=epsilon),
-                            QLPlayer(id=1, train=True, nn=self.nn, epsilon=epsilon),
-                            QLPlayer(id=2, train=True, nn=self.nn, epsilon=epsilon),
-                            QLPlayer(id=3, train=True, nn=self.nn, epsilon=epsilon)]
+            game = Ludo(self.training_players(self.epsilon(episode), target))
 
             # Always start with the player 0
-            self.player_turn = 0
+            game.player_turn = 0
 
-            # Initially, all players are at the starting positions
-            for player in self.players:
-                player.state = [0.0, ] * 59
-                player.state[0] = 1.00
+            yield game
 
-            # Start the episode
-            self.play()
+    def recover(self, error, episode, target=None):
+        """
+        Recover from a numerical error: roll the network back to its last good weights with a lower learning rate (see
+        HealthMonitor.recover) and refresh the target network from them.
 
-            # Count wins
-            for p in range(len(self.players)):
-                if self.players[p].state[58] == 1.0:
-                    wins[p] += 1
+        :param error: The NumericalError.
+        :param episode: Number of the episode where the error happened.
+        :param target: The target network (see target_nn.py), or None.
+        :raise NumericalError: The error itself if the training cannot recover from it (see HealthMonitor.recover).
+        """
 
-            # Decrease epsilon
-            if episode < 0.1 * self.num_episodes:
-                epsilon = ((0.1 * self.num_episodes - 1) - episode) * max_epsilon / (0.1 * self.num_episodes - 1)
-            else:
-                epsilon = 0
+        self.monitor.recover(error, episode)
 
-            if self.debug:
-                print
+        if target is not None:
+            target.refresh()
+
+        if self.metrics is not None:
+            self.metrics.count("rollbacks")
+            self.metrics.set("nn_learning_rate", self.nn.learning_rate)
+
+    def print_tests(self, episode, evaluator=None, nn=None):
+        """
+        Test the network against both test settings and print a row of the learning curve: the episode and the
+        percentages of wins against random and against expert players.
 
-            # Test regularly
-            if test and episode > 0:
-                if episode % 20000 == 0:
-                    print "%-10d %20.2f %20.2f" % (episode,
-                                                   self.test(1000, "1_QL_AGAINST_3_RANDOM")[0],
-                                                   self.test(1000, "1_QL_AGAINST_3_EXPERT")[0])
+        :param episode: Number of training episodes so far.
+        :param evaluator: If not None, the tests run in the background on a snapshot of the weights and the row is
+        printed when they are done (see BackgroundEvaluator). Otherwise, they run now.
+        :param nn: The neural network to test. If None, the trainer's network is used.
+        """
+
+        if nn is None:
+            nn = self.nn
+
+        if evaluator is not None:
+            evaluator.submit(episode, nn)
+        else:
+            row = self.test_row(episode, nn)
+
+            print "%-10d %20.2f %20.2f" % row
+            self.curve.append(row)
+
+    def test_row(self, episode, nn=None):
+        """
+        Test the network against both test settings (with QLTrainer.num_test_games games each).
+
+        :param episode: Number of training episodes so far.
+        :param nn: The neural network to test. If None, the trainer's network is used.
+        :return: A row of the learning curve: a tuple (episode, percentage of wins against random players, percentage
+        of wins against expert players).
+        """
+
+        return (episode,
+                self.test(QLTrainer.num_test_games, "1_QL_AGAINST_3_RANDOM", nn)[0],
+                self.test(QLTrainer.num_test_games, "1_QL_AGAINST_3_EXPERT", nn)[0])
+
+    def state_file(self):
+        """
+        Get the name of the file where the training state is saved (see QLTrainer.get_state).
+
+        :return: The name of the file, next to nn_file_dst.
+        """
+
+        return self.nn_file_dst + ".state"
+
+    def get_state(self, next_episode, target=None):
+        """
+        Get a snapshot of everything needed to resume training (see QLTrainer.resume): the exact weights and training
+        state of the network, the progress of the training, the states of the random generators, the replay buffer and
+        the target network.
+
+        :param next_episode: Number of the next episode to play.
+        :param target: The target network (see target_nn.py), or None.
+        :return: A tuple (arrays, metadata) suitable for checkpoint.write_checkpoint(...). The names of the arrays are
+        prefixed with the part they belong to ("nn.", "replay." or "target.").
+        """
+
+        arrays = collections.OrderedDict()
+        metadata = {"episode": next_episode,
+                    "num_episodes": self.num_episodes,
+                    "wins": list(self.wins),
+                    "curve": [list(row) for row in self.curve],
+                    "random": random.getstate()}
+
+        # The state of NumPy's generator is a name, an array of keys and a few numbers
+        numpy_state = numpy.random.get_state()
+        arrays["numpy_random"] = numpy_state[1]
+        metadata["numpy_random"] = list(numpy_state[2:])
+
+        parts = [("nn", self.nn)]
+
+        if self.replay is not None:
+            parts.append(("replay", self.replay))
+
+        if target is not None:
+            parts.append(("target", target))
+
+        for name, part in parts:
+            part_arrays, part_metadata = part.get_state()
+
+            for array_name, array in part_arrays.items():
+                arrays[name + "." + array_name] = array
+
+            metadata[name] = part_metadata
+
+        metadata["nn_version"] = self.nn.version
+
+        # Rollbacks lower the learning rate of the network (see health.py): a resumed training keeps the lower rate and
+        # the remaining rollbacks
+        metadata["nn_learning_rate"] = self.nn.learning_rate
+        metadata["rollbacks"] = self.monitor.rollbacks if self.monitor is not None else self.rollbacks
 
-            # Save the neural network to the specified file every 1000 episodes
-            if episode % 1000 == 0:
-                self.nn.write_to_file(self.nn_file_dst)
+        return arrays, metadata
 
-        # Save the final neural network to the specified file
-        self.nn.write_to_file(self.nn_file_dst)
+    def load_state(self, src_file):
+        """
+        Restore a snapshot of the training (see QLTrainer.get_state) saved to a file. The target network, if any, and
+        the random generators are restored when training starts.
+
+        :param src_file: Name of the file.
+        :raise ValueError: If the file does not hold a usable state of this training (nothing is restored then).
+        """
+
+        arrays, metadata = read_checkpoint(src_file, mmap=False)
+
+        # The state is checked before any of it is restored
+        for key in ["episode", "num_episodes", "wins", "curve", "random", "numpy_random", "nn", "nn_version"]:
+            if key not in metadata:
+                raise ValueError(src_file + " is not a training state (no " + key + ")")
+
+        if metadata["num_episodes"] != self.num_episodes:
+            raise ValueError(src_file + " belongs to a training of " + str(metadata["num_episodes"]) + " episodes")
+
+        if not 0 <= metadata["episode"] <= self.num_episodes:
+            raise ValueError(src_file + " resumes at episode " + str(metadata["episode"]))
+
+        if metadata["nn"].get("encoder", self.nn.encoder.name) != self.nn.encoder.name:
+            raise ValueError(src_file + " belongs to a network with the " + metadata["nn"]["encoder"] + " encoder")
+
+        if not 0.0 < metadata.get("nn_learning_rate", self.nn.learning_rate) < float("inf"):
+            raise ValueError(src_file + " has a learning rate of " + str(metadata["nn_learning_rate"]))
+
+        for name, array in arrays.items():
+            if array.dtype.kind == "f" and not numpy.isfinite(array).all():
+                raise ValueError(src_file + " holds values that are not finite in " + name)
+
+        # Split the arrays by part
+        parts = {"nn": collections.OrderedDict(), "replay": collections.OrderedDict(),
+                 "target": collections.OrderedDict()}
+
+        for name, array in arrays.items():
+            if "." in name:
+                part, array_name = name.split(".", 1)
+                parts[part][array_name] = array
+
+        self.nn.set_state(parts["nn"], metadata["nn"])
+        self.nn.version = metadata["nn_version"]
+
+        # States saved before rollbacks were recorded keep the learning rate of the network
+        if "nn_learning_rate" in metadata:
+            self.nn.set_learning_rate(metadata["nn_learning_rate"])
+
+        self.rollbacks = metadata.get("rollbacks", 0)
+
+        if "replay" in metadata:
+            if self.replay is None:
+                raise ValueError(src_file + " belongs to a training with a replay buffer")
+
+            self.replay.set_state(parts["replay"], metadata["replay"])
+
+        self.target_state = None
+
+        if "target" in metadata:
+            self.target_state = (parts["target"], metadata["target"])
+
+        self.first_episode = metadata["episode"]
+        self.wins = metadata["wins"]
+        self.curve = [tuple(row) for row in metadata["curve"]]
+
+        # JSON turned the tuples of the states of the random generators into lists
+        version, internal_state, gauss_next = metadata["random"]
+        pos, has_gauss, cached_gaussian = metadata["numpy_random"]
+
+        self.random_states = ((version, tuple(internal_state), gauss_next),
+                              ("MT19937", arrays["numpy_random"], pos, has_gauss, cached_gaussian))
+
+    def resume(self, test=False, interleave=None, test_processes=None, metrics_file=None):
+        """
+        Resume a training that was interrupted from its last saved state (see QLTrainer.state_file) and print the
+        learning curve so far. Serial training resumes exactly where it was saved. With interleave, the episodes that
+        were in progress are played again from the start.
+
+        :param test: See QLTrainer.train.
+        :param interleave: See QLTrainer.train.
+        :param test_processes: See QLTrainer.train. The tests that were running in the background are lost.
+        :param metrics_file: See QLTrainer.train. The records are appended to those of the interrupted training.
+        """
+
+        self.load_state(self.state_file())
+
+        if test:
+            for row in self.curve:
+                print "%-10d %20.2f %20.2f" % row
+
+        self.train(test, interleave, test_processes, metrics_file)
+
+    def create_metrics(self, dst_file, append=False):
+        """
+        Create the metrics stream of a training: counters of episodes, turns, random moves, evaluations of the neural
+        network, updates, replay batches and wins of each player, the exploration rate, and histograms of the Q values
+        of the moves, of the TD errors of the updates and of the mean errors of the replay batches.
+
+        :param dst_file: Name of the file where to write the records (see Metrics).
+        :param append: If True, the records are appended to those already in the file (see Metrics).
+        :return: A Metrics stream.
+        """
+
+        metrics = Metrics(dst_file, QLTrainer.metrics_interval, append)
+
+        # The counters are created now so that every record (and every CSV column) has them
+        for name in ["episodes", "turns", "random_moves", "nn_evaluations", "updates", "replay_batches", "wins.0",
+                     "wins.1", "wins.2", "wins.3"]:
+            metrics.count(name, 0)
+
+        metrics.add_histogram("q_value", RangeHistogram(-2.0, 2.0))
+        metrics.add_histogram("td_error", RangeHistogram(-2.0, 2.0))
+        metrics.add_histogram("replay_error", RangeHistogram(0.0, 2.0))
+
+        return metrics
+
+    def train(self, test=False, interleave=None, test_processes=None, metrics_file=None):
+        # Keep track of how many times each player wins
+        wins = self.wins
+
+        # The throughput and the learning signals are streamed to metrics_file (the players are given the stream). A
+        # resumed training adds its records to those of the interrupted one.
+        if metrics_file is not None:
+            self.metrics = self.create_metrics(metrics_file, self.first_episode > 0)
+
+        # Frozen copy of the network for the estimates of optimal future value
+        target = None
+
+        if self.target_update is not None:
+            target = TargetNetwork(self.nn, self.target_update)
+
+            if self.target_state is not None:
+                target.set_state(*self.target_state)
+                self.target_state = None
+
+        # The weights are checked at every checkpoint and rolled back to the last good ones after a numerical error,
+        # with a diagnostic file next to the checkpoints (see health.py)
+        self.monitor = HealthMonitor(self.nn, self.nn_file_dst, QLTrainer.rollback_lr_decay, QLTrainer.max_rollbacks,
+                                     rollbacks=self.rollbacks)
+        self.monitor.save_good()
+
+        # The random generators of a restored state are restored last (creating the target network draws random
+        # weights)
+        if self.random_states is not None:
+            random.setstate(self.random_states[0])
+            numpy.random.set_state(self.random_states[1])
+            self.random_states = None
+
+        if self.debug:
+            print "===================================================================================================="
+            print "| TRAINING STARTED                                                                                 |"
+            print "===================================================================================================="
+            print
+
+        # The metrics stream, the test pool and the checkpoint writers are stopped even if the training fails (the
+        # checkpoints already queued are still written)
+        evaluator = None
+        writer = None
+        state_writer = None
+        completed = False
+
+        try:
+            # With test_processes, the tests run in a pool of that many processes while training goes on (the pool is
+            # started before the checkpoint writers' threads)
+            if test and test_processes is not None:
+                evaluator = BackgroundEvaluator(test_processes, self.nn.backend, self.afterstate,
+                                                QLTrainer.num_test_games, self.curve, self.nn.backend_options)
+
+            # Checkpoints and training states are written in the background while training goes on
+            writer = CheckpointWriter(self.nn_file_dst, self.keep_checkpoints)
+            state_writer = CheckpointWriter(self.state_file(), 0)
+
+            # Test initially (the tests evaluate the network too, so they can fail like the training episodes)
+            if test and self.first_episode == 0:
+                try:
+                    self.print_tests(0, evaluator)
+                except NumericalError as error:
+                    self.recover(error, 0, target)
+
+            # Play with the epsilon greedy strategy and count wins
+            for episode, winner in enumerate(self.training_episodes(target, interleave), self.first_episode):
+                if winner is not None:
+                    wins[winner] += 1
+
+                # Train again with past transitions
+                if self.replay is not None and len(self.replay) >= self.replay_batch_size:
+                    try:
+                        for b in range(self.replay_batches):
+                            error = train_from_replay(self.nn, self.replay, self.replay_batch_size, self.afterstate,
+                                                      target, self.learning_rate, self.discount_rate)
+
+                            if self.metrics is not None:
+                                self.metrics.count("replay_batches")
+                                self.metrics.observe("replay_error", error)
+                    except NumericalError as error:
+                        self.recover(error, episode, target)
+
+                if self.metrics is not None:
+                    self.metrics.count("episodes")
+                    self.metrics.set("epsilon", self.epsilon(episode))
+
+                    if winner is not None:
+                        self.metrics.count("wins.%d" % winner)
+
+                    self.metrics.maybe_flush()
+
+                if self.debug:
+                    print
+
+                # Test regularly
+                try:
+                    if test and episode > 0:
+                        if episode % QLTrainer.test_every == 0:
+                            self.print_tests(episode, evaluator)
+
+                    if evaluator is not None:
+                        evaluator.print_ready()
+                except NumericalError as error:
+                    self.recover(error, episode, target)
+
+                # Save the neural network to the specified file regularly, with the state to resume training (only
+                # healthy weights are saved)
+                if episode % QLTrainer.checkpoint_every == 0:
+                    try:
+                        self.monitor.save_good()
+                    except NumericalError as error:
+                        self.recover(error, episode, target)
+
+                    arrays, metadata = self.nn.get_weights()
+                    metadata["episode"] = episode
+                    writer.save(arrays, metadata, episode)
+
+                    arrays, metadata = self.get_state(episode + 1, target)
+                    state_writer.save(arrays, metadata)
+
+            # Wait for the tests still running
+            if evaluator is not None:
+                try:
+                    evaluator.close()
+                except NumericalError as error:
+                    self.recover(error, self.num_episodes, target)
+
+            # Save the final neural network to the specified file
+            try:
+                self.monitor.save_good()
+            except NumericalError as error:
+                self.recover(error, self.num_episodes, target)
+
+            arrays, metadata = self.nn.get_weights()
+            metadata["episode"] = self.num_episodes
+            writer.save(arrays, metadata, self.num_episodes)
+
+            arrays, metadata = self.get_state(self.num_episodes, target)
+            state_writer.save(arrays, metadata)
+
+            completed = True
+        finally:
+            # The last records are written even if the training fails (they lead up to the failure)
+            if self.metrics is not None:
+                self.metrics.close()
+                self.metrics = None
+
+            for w in (writer, state_writer):
+                if w is not None:
+                    w.close(completed)
+
+            if evaluator is not None and not completed:
+                evaluator.terminate()
 
         # Display the percentage of wins
-        for w in range(len(wins)):
-            wins[w] = wins[w] * 100.0 / self.num_episodes
+        wins = [w * 100.0 / self.num_episodes for w in wins]
 
         if self.debug:
             print "Wins: " + str(wins)
             print
 
+            if self.monitor.rollbacks > 0:
+                print "Rollbacks after numerical errors: " + str(self.monitor.rollbacks)
+                print
+
+            if target is not None:
+                print "Target network refreshes: " + str(target.refreshes)
+                print "Target network cache hit rate: %.2f%%" % (target.target.cache.hit_rate() * 100.0)
+                print
+
             print "===================================================================================================="
             print "| TRAINING ENDED                                                                                   |"
             print "===================================================================================================="
             print
 
-    def test(self, games, setting):
-        # Keep track of how many times each player wins
-        wins = [0, ] * 4
+    def test_players(self, setting, nn):
+        """
+        Create the players of a test game.
 
-        if self.debug:
-            print "===================================================================================================="
-            print "| TESTING STARTED                                                                                  |"
-            print "===================================================================================================="
-            print
+        :param setting: "1_QL_AGAINST_3_RANDOM" or "1_QL_AGAINST_3_EXPERT".
+        :param nn: The neural network of the Q-Learning player.
+        :return: A list with the players.
+        """
+
+        if setting == "1_QL_AGAINST_3_RANDOM":
+            return [QLPlayer(id=0, train=False, nn=nn, epsilon=0, afterstate=self.afterstate),
+                    RandomPlayer(id=1),
+                    RandomPlayer(id=2),
+                    RandomPlayer(id=3)]
+        elif setting == "1_QL_AGAINST_3_EXPERT":
+            return [QLPlayer(id=0, train=False, nn=nn, epsilon=0, afterstate=self.afterstate),
+                    MixedStrategyPlayer(id=1),
+                    MixedStrategyPlayer(id=2),
+                    MixedStrategyPlayer(id=3)]
+
+    def test_games(self, games, setting, nn):
+        """
+        Create test games (see QLTrainer.test).
+
+        :param games: Number of games.
+        :param setting: "1_QL_AGAINST_3_RANDOM" or "1_QL_AGAINST_3_EXPERT".
+        :param nn: The neural network of the Q-Learning player.
+        :return: A generator of Ludo games.
+        """
 
         for episode in range(games):
             if self.debug:
                 print "Testing game " + str(episode + 1) + "/" + str(games) + "..."
 
-            # Players to test with
-            if setting == "1_QL_AGAINST_3_RANDOM":
-                self.players = [QLPlayer(id=0, train=False, nn=self.nn, epsilon=0),
-                                RandomPlayer(id=1),
-                                RandomPlayer(id=2),
-                                RandomPlayer(id=3)]
-            elif setting == "1_QL_AGAINST_3_EXPERT":
-                self.players = [QLPlayer(id=0, train=False, nn=self.nn, epsilon=0),
-                                MixedStrategyPlayer(id=1),
-                                MixedStrategyPlayer(id=2),
-                                MixedStrategyPlayer(id=3)]
+            game = Ludo(self.test_players(setting, nn))
 
             # Always start with the player 0
-            self.player_turn = 0
+            game.player_turn = 0
 
-            # Initially, all players are at the starting positions
-            for player in self.players:
-                player.state = [0.0, ] * 59
-                player.state[0] = 1.00
+            yield game
 
-            # Start the episode
-            self.play()
+    def test_winners(self, games, setting, nn, interleave=None):
+        """
+        Play test games without training (see QLTrainer.test).
 
-            # Count wins
-            for p in range(len(self.players)):
-                if self.players[p].state[58] == 1:
-                    wins[p] += 1
+        :param games: Number of games to play.
+        :param setting: "1_QL_AGAINST_3_RANDOM" or "1_QL_AGAINST_3_EXPERT".
+        :param nn: The neural network of the Q-Learning player.
+        :param interleave: If not None, this many games are played at once (see QLTrainer.test).
+        :return: A generator of the winner of each game (None if a game had no winner).
+        """
 
-            if self.debug:
-                print
+        if interleave is not None:
+            for game in GameScheduler(interleave).play(self.test_games(games, setting, nn)):
+                yield game.winner()
+        else:
+            for episode in range(games):
+                if self.debug:
+                    print "Testing game " + str(episode + 1) + "/" + str(games) + "..."
+
+                # Players to test with
+                self.players = self.test_players(setting, nn)
+
+                # Always start with the player 0
+                self.player_turn = 0
+
+                # Initially, all players are at the starting positions
+                for player in self.players:
+                    player.state = [0.0, ] * 59
+                    player.state[0] = 1.00
+
+                # Start the episode
+                self.play()
+
+                if self.debug:
+                    print
+
+                yield self.winner()
+
+    def test(self, games, setting, nn=None, interleave=None):
+        """
+        Play test games without training.
+
+        :param games: Number of games to play.
+        :param setting: "1_QL_AGAINST_3_RANDOM" or "1_QL_AGAINST_3_EXPERT".
+        :param nn: The neural network of the Q-Learning player. If None, the trainer's network is used. Play-only
+        networks (e.g. a frozen model, see frozen_nn.py) can be shared by many test processes.
+        :param interleave: If not None, this many games are played at once and the evaluations of the neural network
+        are batched across them (see game_scheduler.py). Otherwise, the games are played one after the other.
+        :return: The percentage of wins of each player.
+        """
+
+        if nn is None:
+            nn = self.nn
+
+        # Keep track of how many times each player wins
+        wins = [0, ] * 4
+
+        if self.debug:
+            print "===================================================================================================="
+            print "| TESTING STARTED                                                                                  |"
+            print "===================================================================================================="
+            print
+
+        # The network does not change while testing: cached outputs stay valid for all the games (it can be trained
+        # again afterwards, even if a test fails)
+        read_only = nn.read_only
+        nn.read_only = True
+
+        try:
+            for winner in self.test_winners(games, setting, nn, interleave):
+                if winner is not None:
+                    wins[winner] += 1
+        finally:
+            nn.read_only = read_only
 
         # Display the percentage of wins
         for w in range(len(wins)):
@@ -173,6 +782,10 @@ class QLTrainer(Ludo):
             print "Wins: " + str(wins)
             print
 
+            if nn.cache is not None:
+                print "Cache hit rate: %.2f%%" % (nn.cache.hit_rate() * 100.0)
+                print
+
         if self.debug:
             print "===================================================================================================="
             print "| TESTING ENDED                                                                                    |"
@@ -181,18 +794,146 @@ class QLTrainer(Ludo):
 
         return wins
 
-trainer = QLTrainer(500000 + 1, '01102016_nn_exp_1.txt', debug=False)
+    def test_sequential(self, setting, stopping, max_games=1000, nn=None, interleave=None):
+        """
+        Play test games without training until a sequential test decides (or max_games are played).
+
+        :param setting: "1_QL_AGAINST_3_RANDOM" or "1_QL_AGAINST_3_EXPERT".
+        :param stopping: The test of the win rate of the Q-Learning player (e.g. SPRT(0.40) for "win rate >= 40%", see
+        sequential_test.py). Its games are counted from where it is.
+        :param max_games: Maximum number of games to play.
+        :param nn: The neural network of the Q-Learning player. If None, the trainer's network is used.
+        :param interleave: If not None, this many games are played at once (see QLTrainer.test). The games still
+        running when the test decides are not counted.
+        :return: A tuple (percentage of wins, (low, high) percentages of its confidence interval, number of games
+        played, decision of the test). The decision is None if max_games were played without deciding.
+        """
+
+        if nn is None:
+            nn = self.nn
+
+        # The network does not change while testing: cached outputs stay valid for all the games
+        read_only = nn.read_only
+        nn.read_only = True
+
+        games = 0
+        decision = None
+
+        try:
+            for winner in self.test_winners(max_games, setting, nn, interleave):
+                stopping.add(winner == 0)
+                games += 1
+                decision = stopping.decision()
+
+                if decision is not None:
+                    break
+        finally:
+            nn.read_only = read_only
+
+        low, high = stopping.interval()
+
+        if self.debug:
+            print "Win percentage: %.2f (%.2f - %.2f) after %d games, decision: %s" % \
+                (stopping.estimate() * 100.0, low * 100.0, high * 100.0, games, decision)
+            print
+
+        return stopping.estimate() * 100.0, (low * 100.0, high * 100.0), games, decision
+
+    def test_paired(self, games, setting, nn_a, nn_b, seed=0):
+        """
+        Compare two neural networks with common random numbers: game by game, both play the test setting with the same
+        dice (see Ludo), the same starting player (rotated across the games) and, for each player, a random generator of
+        its own seeded the same way (see Player.rng), so the random choices of the opponents do not depend on how many
+        the Q-Learning player makes (e.g. to break ties). Most of the luck cancels out in the differences of the
+        results, so fewer games are needed than with two independent tests.
+
+        :param games: Number of games each network plays.
+        :param setting: "1_QL_AGAINST_3_RANDOM" or "1_QL_AGAINST_3_EXPERT".
+        :param nn_a: The neural network of the Q-Learning player of the first candidate.
+        :param nn_b: The neural network of the Q-Learning player of the second candidate.
+        :param seed: Seed of the comparison. The games are seeded with seed * games, seed * games + 1, ...
+        :return: A tuple (percentage of wins of a, percentage of wins of b, mean paired difference of the percentages
+        (a - b), standard error of the difference).
+        :raise ValueError: If games is not positive.
+        """
+
+        if games < 1:
+            raise ValueError("A paired test needs at least one game, not " + str(games))
+
+        read_only = [nn_a.read_only, nn_b.read_only]
+        nn_a.read_only = True
+        nn_b.read_only = True
+
+        wins = [0, 0]
+        differences = []
+
+        try:
+            for game in range(games):
+                game_seed = seed * games + game
+                results = []
+
+                for nn in (nn_a, nn_b):
+                    players = self.test_players(setting, nn)
+
+                    for player in players:
+                        player.rng = random.Random(game_seed * 4 + player.id)
+
+                    ludo = Ludo(players, game_seed)
+                    ludo.player_turn = game % 4
+                    ludo.play()
+
+                    results.append(1 if ludo.winner() == 0 else 0)
+
+                wins[0] += results[0]
+                wins[1] += results[1]
+                differences.append(results[0] - results[1])
+        finally:
+            nn_b.read_only = read_only[1]
+            nn_a.read_only = read_only[0]
+
+        # Mean and standard error of the paired differences
+        mean = float(sum(differences)) / games
+        variance = 0.0
+
+        if games > 1:
+            variance = sum((d - mean) ** 2 for d in differences) / (games - 1)
+
+        error = math.sqrt(variance / games)
+
+        if self.debug:
+            # Standard error of the same difference with independent games, for comparison
+            p_a = float(wins[0]) / games
+            p_b = float(wins[1]) / games
+            independent_error = math.sqrt((p_a * (1.0 - p_a) + p_b * (1.0 - p_b)) / games)
+
+            print "Paired difference: %.2f +/- %.2f (independent tests: +/- %.2f)" % (mean * 100.0, error * 100.0,
+                                                                                     independent_error * 100.0)
+            print
+
+        return wins[0] * 100.0 / games, wins[1] * 100.0 / games, mean * 100.0, error * 100.0
+
+    def export_frozen(self, dst_file, precision="int8"):
+        """
+        Export the trained neural network as a frozen, quantized model for play-only uses (see frozen_nn.py).
+
+        :param dst_file: Name of the file where to write the frozen model.
+        :param precision: "int8" or "float16".
+        """
+
+        export_frozen(self.nn, dst_file, precision)
 
-print "Parameters:"
-print "================================================================================"
-print "QL Learning Rate: " + str(QLPlayer.learning_rate)
-print "QL Discount Rate: " + str(QLPlayer.discount_rate)
-print "NN Learning Rate: " + str(NN.learning_rate)
-print "NN Momentum:      " + str(NN.momentum)
-print "Training:         " + "4 QL Players"
-print
-print "%-10s %20s %20s" % ("Episodes", "RND Win Percentage", "XPT Win Percentage")
-print "================================================================================"
+if __name__ == "__main__":
+    trainer = QLTrainer(500000 + 1, '01102016_nn_exp_1.txt', debug=False)
 
-trainer.train(test=True)
+    print "Parameters:"
+    print "================================================================================"
+    print "QL Learning Rate: " + str(QLPlayer.learning_rate)
+    print "QL Discount Rate: " + str(QLPlayer.discount_rate)
+    print "NN Learning Rate: " + str(trainer.nn.learning_rate)
+    print "NN Momentum:      " + str(trainer.nn.momentum)
+    print "Training:         " + "4 QL Players"
+    print
+    print "%-10s %20s %20s" % ("Episodes", "RND Win Percentage", "XPT Win Percentage")
+    print "================================================================================"
 
+    trainer.train(test=True)
@@ -0,0 +1,580 @@
+"""
+replay_buffer.py
+
+Provides an experience replay buffer for the Q-Learning players (see QLPlayer), so that every transition can be used to
+train the neural network many times.
+
+Transitions are stored in preallocated NumPy ring arrays (optionally memory-mapped files, for buffers larger than the
+available memory) with packed board states (see Player.pack_board_state) instead of neural network inputs: a transition
+takes 88 bytes. The inputs are only encoded when a batch of transitions is sampled.
+"""
+
+import collections
+
+import numpy
+
+from encoders import apply_action
+from health import NumericalError
+from health import healthy
+from ql_player import QLPlayer
+
+# Maximum number of successors of a board state (at most one per piece for each of the 6 dice values)
+MAX_SUCCESSORS = 24
+
+
+class ReplayBuffer(object):
+    """
+    Class that stores the last transitions of the Q-Learning players. Each transition is made of the board state the
+    action was taken from, the action, the reward, whether the game ended, the board state the next player moves from
+    and the actions available to the next player (to recompute the estimate of optimal future value when sampled).
+    """
+
+    # Arrays of the buffer (name -> (type, shape of an element))
+    fields = collections.OrderedDict([("packed", (numpy.uint8, (16, ))),
+                                      ("action", (numpy.uint8, (2, ))),
+                                      ("reward", (numpy.float32, ())),
+                                      ("terminal", (numpy.bool_, ())),
+                                      ("next_packed", (numpy.uint8, (16, ))),
+                                      ("next_actions", (numpy.uint8, (MAX_SUCCESSORS, 2))),
+                                      ("num_next_actions", (numpy.uint8, ()))])
+
+    def __init__(self, capacity, spill_file=None):
+        """
+        Construct a new empty replay buffer.
+
+        :param capacity: Maximum number of transitions. When the buffer is full, the oldest transitions are replaced.
+        :param spill_file: If None, the arrays are kept in memory. Otherwise, each array is memory-mapped from a file
+        named spill_file.<array name>.npy (created or overwritten).
+        """
+
+        self.capacity = capacity
+        self.spill_file = spill_file
+        self.arrays = collections.OrderedDict()
+
+        for name, (dtype, shape) in ReplayBuffer.fields.items():
+            if spill_file is None:
+                self.arrays[name] = numpy.zeros((capacity, ) + shape, dtype=dtype)
+            else:
+                self.arrays[name] = numpy.lib.format.open_memmap(spill_file + "." + name + ".npy", mode="w+",
+                                                                 dtype=dtype, shape=(capacity, ) + shape)
+
+        # Number of transitions stored and index where the next one goes
+        self.size = 0
+        self.next_index = 0
+
+    def __len__(self):
+        """
+        Get the number of transitions stored.
+
+        :return: The number of transitions.
+        """
+
+        return self.size
+
+    def nbytes(self):
+        """
+        Get the size of the arrays.
+
+        :return: The number of bytes taken by the arrays.
+        """
+
+        return sum([array.nbytes for array in self.arrays.values()])
+
+    def add(self, packed, action, reward, terminal, next_packed, next_actions):
+        """
+        Store a transition.
+
+        :param packed: The board state the action was taken from (packed by the player who moved).
+        :param action: The action (source and destination of the piece that moved).
+        :param reward: The reward received for the action.
+        :param terminal: True if the action ended the game.
+        :param next_packed: The board state reached by the action, packed by the next player.
+        :param next_actions: The actions available to the next player for all the dice values.
+        :return: The index where the transition was stored.
+        """
+
+        i = self.next_index
+
+        self.arrays["packed"][i] = packed
+        self.arrays["action"][i] = action
+        self.arrays["reward"][i] = reward
+        self.arrays["terminal"][i] = terminal
+        self.arrays["next_packed"][i] = next_packed
+        self.arrays["num_next_actions"][i] = len(next_actions)
+
+        if len(next_actions) > 0:
+            self.arrays["next_actions"][i, :len(next_actions)] = next_actions
+
+        self.next_index = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+        return i
+
+    def add_batch(self, transitions):
+        """
+        Store several transitions.
+
+        :param transitions: A record array of transitions (see TransitionLog).
+        :return: An array with the indices where the transitions were stored.
+        """
+
+        indices = (self.next_index + numpy.arange(len(transitions))) % self.capacity
+
+        for name in ReplayBuffer.fields:
+            self.arrays[name][indices] = transitions[name]
+
+        self.next_index = (self.next_index + len(transitions)) % self.capacity
+        self.size = min(self.size + len(transitions), self.capacity)
+
+        return indices
+
+    def sample_indices(self, batch_size):
+        """
+        Choose transitions uniformly at random.
+
+        :param batch_size: Number of transitions to choose (with replacement).
+        :return: An array with the indices of the transitions.
+        """
+
+        return numpy.random.randint(0, self.size, batch_size)
+
+    def sample(self, batch_size):
+        """
+        Choose a batch of transitions.
+
+        :param batch_size: Number of transitions to choose (with replacement).
+        :return: A tuple (indices, weights) with the indices of the transitions and the weight of each one in the
+        updates (all 1 for uniform sampling).
+        """
+
+        return self.sample_indices(batch_size), numpy.ones(batch_size)
+
+    def update_priorities(self, indices, errors):
+        """
+        Report the errors of transitions after training with them (ignored by uniform sampling).
+
+        :param indices: Indices of the transitions.
+        :param errors: Differences between the new and the old Q values of the transitions.
+        """
+
+        pass
+
+    def get_state(self):
+        """
+        Get a snapshot of the buffer (see QLTrainer.get_state).
+
+        :return: A tuple (arrays, metadata): arrays is an ordered dictionary with the stored part of each array and
+        metadata is a dictionary with the size and the index where the next transition goes.
+        """
+
+        arrays = collections.OrderedDict()
+
+        for name, array in self.arrays.items():
+            arrays[name] = array[:self.size]
+
+        return arrays, {"size": self.size, "next_index": self.next_index}
+
+    def set_state(self, arrays, metadata):
+        """
+        Restore a snapshot taken with ReplayBuffer.get_state().
+
+        :param arrays: Arrays returned by ReplayBuffer.get_state() (or read from a checkpoint).
+        :param metadata: Metadata returned by ReplayBuffer.get_state() (or read from a checkpoint).
+        """
+
+        if metadata["size"] > self.capacity:
+            raise ValueError("The replay buffer cannot hold " + str(metadata["size"]) + " transitions")
+
+        self.size = metadata["size"]
+        self.next_index = metadata["next_index"] % self.capacity
+
+        for name, array in self.arrays.items():
+            array[:self.size] = arrays[name]
+
+    def flush(self):
+        """
+        Write the memory-mapped arrays to their files (if any).
+        """
+
+        if self.spill_file is not None:
+            for array in self.arrays.values():
+                array.flush()
+
+
+class TransitionLog(object):
+    """
+    Class that collects transitions (with the interface of ReplayBuffer.add) in a compact binary form that can be sent
+    to another process: each transition is a record with the fields of ReplayBuffer.
+    """
+
+    # Type of a transition record
+    dtype = numpy.dtype([(name, dtype, shape) for name, (dtype, shape) in ReplayBuffer.fields.items()])
+
+    def __init__(self):
+        """
+        Construct a new empty log.
+        """
+
+        self.records = []
+
+    def __len__(self):
+        """
+        Get the number of transitions collected.
+
+        :return: The number of transitions.
+        """
+
+        return len(self.records)
+
+    def add(self, packed, action, reward, terminal, next_packed, next_actions):
+        """
+        Collect a transition (see ReplayBuffer.add).
+
+        :return: The index of the transition in the log.
+        """
+
+        record = numpy.zeros((), dtype=TransitionLog.dtype)
+        record["packed"] = packed
+        record["action"] = action
+        record["reward"] = reward
+        record["terminal"] = terminal
+        record["next_packed"] = next_packed
+        record["num_next_actions"] = len(next_actions)
+
+        if len(next_actions) > 0:
+            record["next_actions"][:len(next_actions)] = next_actions
+
+        self.records.append(record)
+
+        return len(self.records) - 1
+
+    def pack(self):
+        """
+        Get the transitions collected so far as a string of bytes and empty the log.
+
+        :return: The records of the transitions, one after the other.
+        """
+
+        data = numpy.array(self.records, dtype=TransitionLog.dtype).tostring()
+        self.records = []
+
+        return data
+
+    @staticmethod
+    def unpack(data):
+        """
+        Get the transitions packed by TransitionLog.pack().
+
+        :param data: A string returned by TransitionLog.pack().
+        :return: A record array of transitions (see ReplayBuffer.add_batch).
+        """
+
+        return numpy.frombuffer(data, dtype=TransitionLog.dtype)
+
+
+class SumTree(object):
+    """
+    Class that keeps non-negative priorities in an array-backed binary tree where each node holds the sum of its
+    children. Priorities can be updated and sampled in proportion to their values in O(log n) operations, in batches.
+    """
+
+    def __init__(self, capacity):
+        """
+        Construct a new tree with all the priorities set to 0.
+
+        :param capacity: Number of priorities.
+        """
+
+        # The leaves start at index num_leaves (a power of 2) and the root is at index 1
+        self.num_leaves = 1
+
+        while self.num_leaves < capacity:
+            self.num_leaves *= 2
+
+        self.nodes = numpy.zeros(2 * self.num_leaves)
+
+    def total(self):
+        """
+        Get the sum of all the priorities.
+
+        :return: The sum of the priorities.
+        """
+
+        return float(self.nodes[1])
+
+    def get(self, indices):
+        """
+        Get some priorities.
+
+        :param indices: An array of indices.
+        :return: An array with the priorities.
+        """
+
+        return self.nodes[self.num_leaves + numpy.asarray(indices)]
+
+    def update(self, indices, priorities):
+        """
+        Set some priorities (the sums of their ancestors are recomputed level by level).
+
+        :param indices: An array of indices.
+        :param priorities: An array with the new priorities.
+        """
+
+        nodes = self.num_leaves + numpy.asarray(indices)
+        self.nodes[nodes] = priorities
+
+        while nodes[0] > 1:
+            nodes = numpy.unique(nodes // 2)
+            self.nodes[nodes] = self.nodes[2 * nodes] + self.nodes[2 * nodes + 1]
+
+    def find(self, values):
+        """
+        Find the indices whose cumulative priorities contain some values.
+
+        :param values: An array of values between 0 and the total of the priorities.
+        :return: An array with the index for each value.
+        """
+
+        values = numpy.array(values, dtype=numpy.float64)
+        nodes = numpy.ones(len(values), dtype=numpy.intp)
+
+        while nodes[0] < self.num_leaves:
+            left = self.nodes[2 * nodes]
+            right = values >= left
+
+            values -= left * right
+            nodes = 2 * nodes + right
+
+        return nodes - self.num_leaves
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    """
+    Class that stores the last transitions of the Q-Learning players and samples them in proportion to a priority
+    (derived from the error of their last update), with importance-sampling weights to correct the bias.
+    """
+
+    def __init__(self, capacity, spill_file=None, alpha=0.6, beta=0.4, epsilon=0.001):
+        """
+        Construct a new empty replay buffer.
+
+        :param capacity: Maximum number of transitions (see ReplayBuffer).
+        :param spill_file: Memory-mapped files for the transitions (see ReplayBuffer).
+        :param alpha: Exponent of the errors in the priorities (0 for uniform sampling).
+        :param beta: Exponent of the importance-sampling weights (1 to correct the bias completely).
+        :param epsilon: Minimum error of a transition (so that every transition can be sampled).
+        """
+
+        ReplayBuffer.__init__(self, capacity, spill_file)
+
+        self.tree = SumTree(capacity)
+        self.alpha = alpha
+        self.beta = beta
+        self.epsilon = epsilon
+
+        # New transitions get the highest priority seen so far (so that they are sampled at least once)
+        self.max_priority = 1.0
+
+    def add(self, packed, action, reward, terminal, next_packed, next_actions):
+        """
+        Override the parent method.
+        """
+
+        i = ReplayBuffer.add(self, packed, action, reward, terminal, next_packed, next_actions)
+        self.tree.update(numpy.array([i]), numpy.array([self.max_priority]))
+
+        return i
+
+    def add_batch(self, transitions):
+        """
+        Override the parent method.
+        """
+
+        indices = ReplayBuffer.add_batch(self, transitions)
+        self.tree.update(indices, numpy.repeat(self.max_priority, len(indices)))
+
+        return indices
+
+    def get_state(self):
+        """
+        Override the parent method. The priorities are included.
+        """
+
+        arrays, metadata = ReplayBuffer.get_state(self)
+        arrays["priorities"] = self.tree.get(numpy.arange(self.size))
+        metadata["max_priority"] = self.max_priority
+
+        return arrays, metadata
+
+    def set_state(self, arrays, metadata):
+        """
+        Override the parent method.
+        """
+
+        ReplayBuffer.set_state(self, arrays, metadata)
+        self.tree.update(numpy.arange(self.size), arrays["priorities"])
+        self.max_priority = metadata["max_priority"]
+
+    def sample(self, batch_size):
+        """
+        Override the parent method. The range of cumulative priorities is split in batch_size equal segments and one
+        transition is chosen in each.
+        """
+
+        total = self.tree.total()
+        segments = (numpy.arange(batch_size) + numpy.random.uniform(size=batch_size)) * total / batch_size
+        indices = numpy.minimum(self.tree.find(numpy.minimum(segments, total * (1.0 - 1e-12))), self.size - 1)
+
+        # Importance-sampling weights, normalized so that the largest one is 1
+        probabilities = numpy.maximum(self.tree.get(indices) / total, 1e-12)
+        weights = (self.size * probabilities) ** -self.beta
+
+        return indices, weights / weights.max()
+
+    def update_priorities(self, indices, errors):
+        """
+        Override the parent method.
+        """
+
+        priorities = (numpy.abs(errors) + self.epsilon) ** self.alpha
+        self.tree.update(indices, priorities)
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+
+
+def compute_targets(nn, buffer, indices, afterstate=False, target=None, learning_rate=None, discount_rate=None):
+    """
+    Compute the Q-Learning targets of some transitions of a replay buffer with the current weights (as QLPlayer.reward
+    does when the transitions happen).
+
+    :param nn: The neural network being trained (NN).
+    :param buffer: A ReplayBuffer.
+    :param indices: Indices of the transitions.
+    :param afterstate: If True, the neural network estimates the values of afterstates (see QLPlayer).
+    :param target: A TargetNetwork (see target_nn.py) to compute the estimates of optimal future value with. If None,
+    they are computed with nn itself.
+    :param learning_rate: The Q-Learning rate. If None, QLPlayer.learning_rate is used.
+    :param discount_rate: The discount rate. If None, QLPlayer.discount_rate is used.
+    :return: A tuple (rows, targets, errors): the inputs of the transitions (one row each), their new Q values and the
+    differences between the new and the old Q values.
+    """
+
+    arrays = buffer.arrays
+    packed = arrays["packed"][indices]
+    actions = [tuple(a) for a in arrays["action"][indices].tolist()]
+
+    # Inputs of the transitions (in an array of their own: encoders reuse their buffer between calls)
+    rows = numpy.zeros((len(indices), nn.encoder.num_inputs), dtype=numpy.float32)
+
+    if afterstate:
+        nn.encoder.encode_batch([apply_action(tuple(p), a) for p, a in zip(packed.tolist(), actions)],
+                                [None, ] * len(actions), rows)
+    else:
+        nn.encoder.encode_batch(packed, actions, rows)
+
+    # Successors of all the transitions, evaluated in a single batch
+    next_boards = []
+    next_actions = []
+    counts = []
+
+    for i in indices:
+        count = 0 if arrays["terminal"][i] else int(arrays["num_next_actions"][i])
+        next_packed = tuple(arrays["next_packed"][i].tolist())
+
+        for a in arrays["next_actions"][i, :count].tolist():
+            if afterstate:
+                next_boards.append(apply_action(next_packed, tuple(a)))
+                next_actions.append(None)
+            else:
+                next_boards.append(next_packed)
+                next_actions.append(tuple(a))
+
+        counts.append(count)
+
+    if target is not None:
+        target.refresh_if_needed()
+        evaluator = target.target
+    else:
+        evaluator = nn
+
+    next_values = []
+
+    if len(next_boards) > 0:
+        next_values = evaluator.evaluate_batch(evaluator.encoder.encode_batch(next_boards, next_actions))
+
+    if learning_rate is None:
+        learning_rate = QLPlayer.learning_rate
+
+    if discount_rate is None:
+        discount_rate = QLPlayer.discount_rate
+
+    # Q-Learning update (as in QLPlayer.reward)
+    old_q = nn.evaluate_batch(rows)
+    targets = []
+    offset = 0
+
+    for i in range(len(indices)):
+        max_q_est = max(next_values[offset:offset + counts[i]]) if counts[i] > 0 else 0.0
+        offset += counts[i]
+
+        reward = float(arrays["reward"][indices[i]])
+        targets.append(old_q[i] + learning_rate * (reward - discount_rate * max_q_est - old_q[i]))
+
+    errors = numpy.asarray(targets) - numpy.asarray(old_q)
+
+    return rows, targets, errors
+
+
+def train_with_transitions(nn, buffer, indices, weights=None, afterstate=False, target=None, learning_rate=None,
+                           discount_rate=None):
+    """
+    Train a neural network with a batch of transitions of a replay buffer. The updates are scaled by the weights of the
+    transitions, and the buffer is told their errors (see PrioritizedReplayBuffer).
+
+    :param nn: The neural network being trained (NN).
+    :param buffer: A ReplayBuffer (or PrioritizedReplayBuffer).
+    :param indices: Indices of the transitions.
+    :param weights: An array with the weight of each transition in the updates. If None, all the weights are 1.
+    :param afterstate: If True, the neural network estimates the values of afterstates (see QLPlayer).
+    :param target: A TargetNetwork (see compute_targets).
+    :param learning_rate: The Q-Learning rate (see compute_targets).
+    :param discount_rate: The discount rate (see compute_targets).
+    :return: The mean absolute difference between the new and the old Q values of the batch.
+    :raise NumericalError: If a target is not healthy (see health.py). The network is not trained with the batch.
+    """
+
+    rows, targets, errors = compute_targets(nn, buffer, indices, afterstate, target, learning_rate, discount_rate)
+
+    # The sum is NaN or infinite if any of the targets is
+    if not healthy(sum(targets)):
+        raise NumericalError("Replay batch with unhealthy targets",
+                             {"indices": indices, "targets": targets, "errors": errors,
+                              "packed": buffer.arrays["packed"][indices], "action": buffer.arrays["action"][indices],
+                              "reward": buffer.arrays["reward"][indices]})
+
+    if weights is None:
+        weights = numpy.ones(len(indices))
+
+    # Moving the target of a transition closer to its old value scales its update
+    nn.train_with_batch(rows, (numpy.asarray(targets) - errors * (1.0 - weights)).tolist())
+    buffer.update_priorities(indices, errors)
+
+    return float(numpy.abs(errors).mean())
+
+
+def train_from_replay(nn, buffer, batch_size, afterstate=False, target=None, learning_rate=None, discount_rate=None):
+    """
+    Train a neural network with a batch of transitions sampled from a replay buffer (see train_with_transitions).
+
+    :param nn: The neural network being trained (NN).
+    :param buffer: A ReplayBuffer (or PrioritizedReplayBuffer).
+    :param batch_size: Number of transitions in the batch.
+    :param afterstate: If True, the neural network estimates the values of afterstates (see QLPlayer).
+    :param target: A TargetNetwork (see compute_targets).
+    :param learning_rate: The Q-Learning rate (see compute_targets).
+    :param discount_rate: The discount rate (see compute_targets).
+    :return: The mean absolute difference between the new and the old Q values of the batch.
+    """
+
+    indices, weights = buffer.sample(batch_size)
+
+    return train_with_transitions(nn, buffer, indices, weights, afterstate, target, learning_rate, discount_rate)
@@ -0,0 +1,93 @@
+"""
+rewards.py
+
+Provides the reward rules of the Q-Learning players (see QLPlayer), so that the players and the dataset generator (see
+dataset_generator.py) shape the rewards of a move the same way.
+"""
+
+
+def shaped_rewards(player_id, cur_states, action, new_states, previous_moved):
+    """
+    Compute the rewards of a move with the reward rules of the Q-Learning players (see QLPlayer.select_new_state).
+
+    :param player_id: Index of the player who moved.
+    :param cur_states: The states of the 4 players before the move (see Player.state), indexed by player.
+    :param action: The action (source and destination of the piece that moved).
+    :param new_states: The states of the 4 players after the move, indexed by player.
+    :param previous_moved: True if the previous player moved in the last turn (it is then penalized when one of its
+    pieces is knocked).
+    :return: A list with the reward of each player: the reward of the player who moved and the penalties of the others.
+    """
+
+    rewards = [0.0, ] * 4
+
+    # Find out if the player won the game and reward players appropriately
+    if new_states[player_id][58] == 1.0:
+        # The current player won
+        rewards[player_id] += 1.0
+
+        # The others lost: reward negatively
+        rewards[(player_id + 1) % 4] += -1.0
+        rewards[(player_id + 2) % 4] += -1.0
+        rewards[(player_id + 3) % 4] += -1.0
+
+    # Find out if the player released one of its pieces and reward appropriately
+    if new_states[player_id][0] < cur_states[player_id][0]:
+        rewards[player_id] += 0.25
+
+    # Find out if a vulnerable piece was defended
+    src_piece_loc = action[0]
+
+    # A vulnerable piece must be in the circular track
+    if 1 <= src_piece_loc <= 51:
+        # A vulnerable piece must have been in a non-safe square
+        if src_piece_loc not in [1, 9, 14, 22, 27, 35, 40, 48]:
+            # A vulnerable piece must have been alone
+            if cur_states[player_id][src_piece_loc] == 0.25:
+                # A vulnerable piece must have been within knocking range
+                vulnerable = False
+
+                for np in range(1, 4):
+                    # Transform the piece position to be as seen by opponent np
+                    src_piece_loc_in_np = (src_piece_loc - 13 * np) % 52
+
+                    # The only catch is that this transformation yields 0 for what's supposed to be square 52.
+                    # However, this is perfect for the next step.
+
+                    # Go through this opponent's pieces to see if any of them can knock the piece in question
+                    for op in range(1, 52):
+                        if cur_states[(player_id + np) % 4][op] == 0:
+                            continue
+
+                        if 0 < src_piece_loc_in_np - op <= 6:
+                            vulnerable = True
+                            break
+
+                    if vulnerable:
+                        rewards[player_id] += 0.2
+                        break
+
+    # Find out if the player knocked a piece belonging to an opponent and reward appropriately
+    for np in range(1, 4):
+        diff = new_states[(player_id - np) % 4][0] - cur_states[(player_id - np) % 4][0]
+
+        if diff > 0:
+            rewards[player_id] += 0.15 * diff * 4
+
+    # Find out if the player knocked a piece belonging to the previous player and reward that player negatively
+    diff = new_states[(player_id - 1) % 4][0] - cur_states[(player_id - 1) % 4][0]
+
+    if diff > 0 and previous_moved:
+        rewards[(player_id - 1) % 4] += -0.25
+
+    # Find out if the current player formed a blockade (in the circular track) and reward appropriately
+    for l in range(1, 52):
+        # Ignore safe squares
+        if l in [1, 9, 14, 22, 27, 35, 40, 48]:
+            continue
+
+        if new_states[player_id][l] >= 0.5 > cur_states[player_id][l]:
+            rewards[player_id] += 0.05
+            break
+
+    return rewards
@@ -4,8 +4,6 @@ rnd_player.py
 Defines a random Ludo player through the RandomPlayer class.
 """
 
-import random
-
 from player import *
 
 
@@ -28,4 +26,4 @@ class RandomPlayer(Player):
         """
 
         # Pick a successor randomly
-        return random.randint(0, len(successors) - 1)
+        return self.rng.randint(0, len(successors) - 1)
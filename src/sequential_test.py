@@ -0,0 +1,206 @@
+"""
+sequential_test.py
+
+Provides sequential tests of a win rate: games are added one at a time and the test decides as soon as the results so
+far are enough to tell whether the win rate is above or below a threshold (see QLTrainer.test_sequential). Clearly good
+or clearly bad players are decided after a few hundred games instead of a fixed number of them.
+"""
+
+import math
+
+
+def normal_quantile(p):
+    """
+    Get the quantile of the standard normal distribution.
+
+    :param p: A probability between 0 and 1 (exclusive).
+    :return: The number z such that P(Z <= z) = p.
+    """
+
+    # Bisection on the cumulative distribution function
+    low = -10.0
+    high = 10.0
+
+    for i in range(100):
+        middle = (low + high) / 2.0
+
+        if 0.5 * (1.0 + math.erf(middle / math.sqrt(2.0))) < p:
+            low = middle
+        else:
+            high = middle
+
+    return (low + high) / 2.0
+
+
+class SequentialTest(object):
+    """
+    Base class of the sequential tests of the hypothesis "win rate >= threshold".
+    """
+
+    def __init__(self, threshold, confidence=0.95, min_games=0):
+        """
+        Construct a new test without games.
+
+        :param threshold: The win rate of the hypothesis (between 0 and 1).
+        :param confidence: Confidence level of the interval of the win rate (see SequentialTest.interval).
+        :param min_games: Number of games played before the test can decide.
+        """
+
+        self.threshold = threshold
+        self.confidence = confidence
+        self.min_games = min_games
+        self.z = normal_quantile(0.5 + confidence / 2.0)
+
+        self.games = 0
+        self.wins = 0
+
+    def add(self, win):
+        """
+        Add the result of a game.
+
+        :param win: True if the player won the game.
+        """
+
+        self.games += 1
+
+        if win:
+            self.wins += 1
+
+    def estimate(self):
+        """
+        Get the win rate so far.
+
+        :return: A number between 0 and 1 (0 if there are no games).
+        """
+
+        if self.games == 0:
+            return 0.0
+
+        return float(self.wins) / self.games
+
+    def interval(self):
+        """
+        Get the Wilson score interval of the win rate at the confidence level of the test.
+
+        :return: A tuple (low, high).
+        """
+
+        if self.games == 0:
+            return 0.0, 1.0
+
+        n = float(self.games)
+        p = self.estimate()
+        z2 = self.z * self.z
+
+        center = (p + z2 / (2.0 * n)) / (1.0 + z2 / n)
+        margin = self.z * math.sqrt(p * (1.0 - p) / n + z2 / (4.0 * n * n)) / (1.0 + z2 / n)
+
+        return max(0.0, center - margin), min(1.0, center + margin)
+
+    def decision(self):
+        """
+        Decide the test with the games so far.
+
+        :return: True if the win rate is at least the threshold, False if it is below it and None if there are not
+        enough games to decide yet.
+        """
+
+        raise NotImplementedError()
+
+
+class SPRT(SequentialTest):
+    """
+    Class that provides Wald's sequential probability ratio test: it compares the likelihood of the results under a win
+    rate of threshold - margin against threshold + margin. The win rates within the margin of the threshold are
+    considered too close to call (either decision is acceptable for them).
+    """
+
+    def __init__(self, threshold, margin=0.05, alpha=0.05, beta=0.05, confidence=0.95, min_games=0):
+        """
+        Construct a new test without games.
+
+        :param threshold: The win rate of the hypothesis (between 0 and 1).
+        :param margin: Half the width of the indifference region around the threshold.
+        :param alpha: Probability of deciding True when the win rate is threshold - margin.
+        :param beta: Probability of deciding False when the win rate is threshold + margin.
+        :param confidence: Confidence level of the interval of the win rate (see SequentialTest.interval).
+        :param min_games: Number of games played before the test can decide.
+        """
+
+        SequentialTest.__init__(self, threshold, confidence, min_games)
+
+        p0 = max(threshold - margin, 1e-6)
+        p1 = min(threshold + margin, 1.0 - 1e-6)
+
+        # Change of the log-likelihood ratio with a win and with a loss
+        self.win_step = math.log(p1 / p0)
+        self.loss_step = math.log((1.0 - p1) / (1.0 - p0))
+
+        # Bounds of the log-likelihood ratio where the test decides
+        self.lower = math.log(beta / (1.0 - alpha))
+        self.upper = math.log((1.0 - beta) / alpha)
+
+        self.llr = 0.0
+
+    def add(self, win):
+        """
+        Override the parent method.
+        """
+
+        SequentialTest.add(self, win)
+
+        if win:
+            self.llr += self.win_step
+        else:
+            self.llr += self.loss_step
+
+    def decision(self):
+        """
+        Override the parent method.
+        """
+
+        if self.games < self.min_games:
+            return None
+
+        if self.llr >= self.upper:
+            return True
+        elif self.llr <= self.lower:
+            return False
+
+        return None
+
+
+class IntervalTest(SequentialTest):
+    """
+    Class that decides as soon as the confidence interval of the win rate is on one side of the threshold. The interval
+    is looked at after every game, so the actual error rate is higher than 1 - confidence: use a high confidence and a
+    few min_games.
+    """
+
+    def __init__(self, threshold, confidence=0.99, min_games=50):
+        """
+        Construct a new test without games.
+
+        :param threshold: The win rate of the hypothesis (between 0 and 1).
+        :param confidence: Confidence level of the interval of the win rate.
+        :param min_games: Number of games played before the test can decide.
+        """
+
+        SequentialTest.__init__(self, threshold, confidence, min_games)
+
+    def decision(self):
+        """
+        Override the parent method.
+        """
+
+        if self.games < self.min_games:
+            return None
+
+        low, high = self.interval()
+
+        if low >= self.threshold:
+            return True
+        elif high < self.threshold:
+            return False
+
+        return None
@@ -0,0 +1,206 @@
+"""
+server_nn.py
+
+Provides a client of an inference server (see inference_server.py) with the interface of a single-output neural network.
+The network itself lives in the server process, which evaluates the requests of all its clients together. The client
+can only evaluate the network (it cannot train it).
+
+The client connects to the server whose address is in the LUDO_NN_SERVER environment variable (set by
+InferenceServer.start for the processes forked afterwards), so it can be selected like any other backend, e.g. with
+LUDO_NN_BACKEND=server.
+"""
+
+import json
+import os
+import socket
+import struct
+
+import numpy
+
+# Header of a request: number of rows and total number of non-zero inputs. A request with no rows asks for the
+# statistics of the server instead of outputs.
+REQUEST_HEADER = struct.Struct("<II")
+
+# Header of the statistics (length of a JSON document)
+STATS_HEADER = struct.Struct("<I")
+
+
+def recv_exactly(sock, num_bytes):
+    """
+    Receive a number of bytes from a socket.
+
+    :param sock: A connected socket.
+    :param num_bytes: Number of bytes to receive.
+    :return: A string with the bytes, or None if the connection was closed.
+    """
+
+    chunks = []
+
+    while num_bytes > 0:
+        chunk = sock.recv(num_bytes)
+
+        if len(chunk) == 0:
+            return None
+
+        chunks.append(chunk)
+        num_bytes -= len(chunk)
+
+    return "".join(chunks)
+
+
+def encode_request(row_lengths, indices, values):
+    """
+    Encode a request for the outputs of some sparse inputs.
+
+    :param row_lengths: Number of non-zero inputs of each row.
+    :param indices: Indices of the non-zero inputs of all the rows (one row after the other).
+    :param values: Values of the non-zero inputs of all the rows.
+    :return: A string with the request.
+    """
+
+    return (REQUEST_HEADER.pack(len(row_lengths), len(indices)) +
+            numpy.asarray(row_lengths, dtype=numpy.uint16).tostring() +
+            numpy.asarray(indices, dtype=numpy.uint16).tostring() +
+            numpy.asarray(values, dtype=numpy.float32).tostring())
+
+
+def request_stats(sock):
+    """
+    Get the statistics of an inference server (see InferenceServer.stats).
+
+    :param sock: A socket connected to the server.
+    :return: A dictionary.
+    """
+
+    sock.sendall(REQUEST_HEADER.pack(0, 0))
+    data = recv_exactly(sock, STATS_HEADER.size)
+
+    if data is None:
+        raise RuntimeError("The inference server closed the connection")
+
+    return json.loads(recv_exactly(sock, STATS_HEADER.unpack(data)[0]))
+
+
+class ServerNN(object):
+    """
+    Class that provides a client of an inference server with the interface of a single-output neural network.
+    """
+
+    # Features supported natively (see nn.CAPABILITIES)
+    capabilities = frozenset(["sparse", "batch"])
+
+    def __init__(self, num_inputs, learning_rate, momentum, src_file=None):
+        """
+        Constructor for a client of the inference server in LUDO_NN_SERVER.
+
+        :param num_inputs: Number of inputs to the neural network (it must match the network of the server).
+        :param learning_rate: Ignored.
+        :param momentum: Ignored.
+        :param src_file: Must be None (the network is loaded by the server).
+        """
+
+        if src_file is not None:
+            raise ValueError("The network of an inference server is loaded by the server, not from " + src_file)
+
+        self.num_inputs = num_inputs
+        self.address = os.environ.get("LUDO_NN_SERVER")
+
+        if self.address is None:
+            raise ValueError("No inference server (LUDO_NN_SERVER is not set)")
+
+        self.sock = None
+        self.pid = None
+
+        server_inputs = self.stats()["num_inputs"]
+
+        # The connection of the check is closed right away (the processes forked afterwards would inherit it): each
+        # process connects when it first asks for outputs
+        self.sock.close()
+        self.sock = None
+
+        if server_inputs != num_inputs:
+            raise ValueError("The inference server has a network with " + str(server_inputs) + " inputs, not " +
+                             str(num_inputs))
+
+    def connection(self):
+        """
+        Get the connection to the server. Each process has its own connection: a client copied into a forked process
+        connects again.
+
+        :return: A connected socket.
+        """
+
+        if self.sock is None or self.pid != os.getpid():
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(self.address)
+            self.pid = os.getpid()
+
+        return self.sock
+
+    def request(self, row_lengths, indices, values):
+        """
+        Get the outputs of the network of the server for some sparse inputs.
+
+        :param row_lengths: Number of non-zero inputs of each row.
+        :param indices: Indices of the non-zero inputs of all the rows (one row after the other).
+        :param values: Values of the non-zero inputs of all the rows.
+        :return: The outputs (as a list of numbers).
+        """
+
+        # A request without rows would ask for the statistics
+        if len(row_lengths) == 0:
+            return []
+
+        sock = self.connection()
+        sock.sendall(encode_request(row_lengths, indices, values))
+        data = recv_exactly(sock, 8 * len(row_lengths))
+
+        if data is None:
+            raise RuntimeError("The inference server closed the connection")
+
+        return numpy.frombuffer(data, dtype=numpy.float64).tolist()
+
+    def stats(self):
+        """
+        Get the statistics of the server (see InferenceServer.stats).
+
+        :return: A dictionary.
+        """
+
+        return request_stats(self.connection())
+
+    def evaluate(self, inputs):
+        """
+        Get the output of the neural network given the specified inputs.
+
+        :param inputs: Inputs to the neural network (as a list).
+        :return: The output of the neural network (as a number).
+        """
+
+        indices = numpy.flatnonzero(inputs)
+
+        return self.request([len(indices)], indices, numpy.asarray(inputs)[indices])[0]
+
+    def evaluate_batch(self, rows):
+        """
+        Get the outputs of the neural network for a batch of inputs (sent in a single request).
+
+        :param rows: An array with one row of inputs per data point.
+        :return: The outputs of the neural network (as a list of numbers).
+        """
+
+        rows = numpy.asarray(rows)
+        row_ids, indices = numpy.nonzero(rows)
+
+        return self.request(numpy.bincount(row_ids, minlength=len(rows)), indices, rows[row_ids, indices])
+
+    def evaluate_sparse(self, indices, values):
+        """
+        Get the output of the neural network given the specified inputs in sparse form.
+
+        :param indices: Indices of the non-zero inputs (as a list).
+        :param values: Values of the non-zero inputs (as a list).
+        :return: The output of the neural network (as a number).
+        """
+
+        return self.request([len(indices)], indices, values)[0]
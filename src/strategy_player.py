@@ -5,7 +5,6 @@ Defines a strategy based Ludo player through the StrategyPlayer class.
 """
 
 from player import *
-import random
 
 class StrategyPlayer(Player):
     """
@@ -30,7 +29,7 @@ class StrategyPlayer(Player):
         successorIndex = self.select_nonrandom_new_state(board_state, successors, timestamp)
 
         if (successorIndex == -1):
-            successorIndex = random.randint(0, len(successors) - 1)
+            successorIndex = self.rng.randint(0, len(successors) - 1)
 
         old_to_new_action = (successors[successorIndex]["action"][0], successors[successorIndex]["action"][1])
         new_board_state = successors[successorIndex]["new_state"]
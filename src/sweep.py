@@ -0,0 +1,306 @@
+"""
+sweep.py
+
+Provides a hyperparameter sweep for the Q-Learning trainer: each configuration (a point of a grid or of a random search
+over the parameters of QLTrainer, e.g. the learning rates) is trained in a process of its own, as many at once as there
+are processors. The learning curves are collected in one results table, and the configurations that fall clearly behind
+the others are stopped early (median stopping rule, see Sweep.should_stop).
+"""
+
+import csv
+import itertools
+import math
+import multiprocessing
+import random
+import Queue
+
+import numpy
+
+from ql_trainer import QLTrainer
+
+
+def grid(space):
+    """
+    Get all the configurations of a grid.
+
+    :param space: A dictionary (parameter name -> list of values).
+    :return: A list of configurations (dictionaries), one for each combination of values.
+    """
+
+    names = sorted(space.keys())
+
+    return [dict(zip(names, values)) for values in itertools.product(*[space[name] for name in names])]
+
+
+def random_search(space, num_configs, seed=None):
+    """
+    Draw random configurations.
+
+    :param space: A dictionary (parameter name -> values). The values are a list to choose from, a tuple (low, high) to
+    draw uniformly from or a tuple (low, high, "log") to draw log-uniformly from (e.g. for learning rates).
+    :param num_configs: Number of configurations.
+    :param seed: Seed of the random generator (None to draw different configurations every time).
+    :return: A list of configurations (dictionaries).
+    """
+
+    rng = random.Random(seed)
+    configs = []
+
+    for c in range(num_configs):
+        config = {}
+
+        for name in sorted(space.keys()):
+            values = space[name]
+
+            if isinstance(values, tuple):
+                if len(values) > 2 and values[2] == "log":
+                    config[name] = math.exp(rng.uniform(math.log(values[0]), math.log(values[1])))
+                else:
+                    config[name] = rng.uniform(values[0], values[1])
+            else:
+                config[name] = rng.choice(values)
+
+        configs.append(config)
+
+    return configs
+
+
+def format_value(value):
+    """
+    Format the value of a parameter for the results table.
+
+    :param value: The value.
+    :return: A short string.
+    """
+
+    if isinstance(value, float):
+        return "%.6g" % value
+
+    return str(value)
+
+
+class SweepTrainer(QLTrainer):
+    """
+    Class that trains a configuration of a sweep and sends its learning curve to the sweep.
+    """
+
+    def __init__(self, job, queue, num_episodes, nn_file_dst, **kwargs):
+        """
+        Constructor for a new trainer.
+
+        :param job: Number of the configuration in the sweep.
+        :param queue: Queue where to send the rows of the learning curve (with the number of the configuration).
+        :param num_episodes: Number of episodes to train the network with.
+        :param nn_file_dst: The name of a file where to store the resulting neural network.
+        :param kwargs: Other arguments of QLTrainer (the configuration).
+        """
+
+        QLTrainer.__init__(self, num_episodes, nn_file_dst, **kwargs)
+
+        self.job = job
+        self.queue = queue
+
+    def print_tests(self, episode, evaluator=None, nn=None):
+        """
+        Override the parent method. The rows are sent to the sweep instead of printed.
+        """
+
+        row = self.test_row(episode, nn)
+
+        self.curve.append(row)
+        self.queue.put((self.job, row))
+
+
+class Sweep(object):
+    """
+    Class that trains several configurations of QLTrainer in parallel processes.
+    """
+
+    # Seconds the sweep waits for rows before checking the processes
+    poll_interval = 0.5
+
+    def __init__(self, configs, num_episodes, nn_file_dst, processes=None, test_every=20000, test_games=1000,
+                 stop_margin=5.0, min_tests=2, **options):
+        """
+        Construct a new sweep.
+
+        :param configs: A list of configurations: dictionaries of arguments of QLTrainer (e.g. learning_rate,
+        discount_rate, nn_learning_rate, nn_momentum and nn_backend_options, see grid and random_search).
+        :param num_episodes: Number of training episodes of each configuration.
+        :param nn_file_dst: Prefix of the files where to store the networks (nn_file_dst.<number of the configuration>).
+        :param processes: Number of configurations trained at once. If None, one per CPU.
+        :param test_every: Number of training episodes between tests (see QLTrainer.test_every).
+        :param test_games: Number of games of each test (see QLTrainer.num_test_games).
+        :param stop_margin: A configuration is stopped when its percentage of wins against random players at a test is
+        below the median of the other configurations at the same test by more than stop_margin. If None, all the
+        configurations are trained to the end.
+        :param min_tests: Number of tests of a configuration (the initial one included) before it can be stopped.
+        :param options: Arguments of QLTrainer shared by all the configurations (e.g. nn_backend).
+        """
+
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+
+        self.configs = configs
+        self.num_episodes = num_episodes
+        self.nn_file_dst = nn_file_dst
+        self.processes = processes
+        self.test_every = test_every
+        self.test_games = test_games
+        self.stop_margin = stop_margin
+        self.min_tests = min_tests
+        self.options = options
+
+        # Rows of the learning curves sent by the trainers
+        self.queue = multiprocessing.Queue()
+
+        # Learning curve and status ("pending", "running", "done", "stopped" or "failed") of each configuration
+        self.curves = [[] for c in configs]
+        self.status = ["pending", ] * len(configs)
+
+    def run_job(self, job):
+        """
+        Train a configuration (runs in a process of its own).
+
+        :param job: Number of the configuration.
+        """
+
+        # Forked processes would otherwise roll the same dice
+        random.seed()
+        numpy.random.seed()
+
+        # The process is only used for this configuration: the class attributes can be changed
+        QLTrainer.test_every = self.test_every
+        QLTrainer.num_test_games = self.test_games
+
+        kwargs = dict(self.options)
+        kwargs.update(self.configs[job])
+
+        trainer = SweepTrainer(job, self.queue, self.num_episodes, "%s.%03d" % (self.nn_file_dst, job), **kwargs)
+        trainer.train(test=True)
+
+    def should_stop(self, job):
+        """
+        Decide if a configuration is clearly behind the others (median stopping rule): its last percentage of wins
+        against random players is below the median of the other configurations at the same number of episodes by more
+        than stop_margin.
+
+        :param job: Number of the configuration.
+        :return: True if the configuration should be stopped. False otherwise.
+        """
+
+        curve = self.curves[job]
+
+        if self.stop_margin is None or len(curve) < self.min_tests:
+            return False
+
+        episode, score = curve[-1][0], curve[-1][1]
+        others = [row[1] for other in range(len(self.curves)) if other != job
+                  for row in self.curves[other] if row[0] == episode]
+
+        # A median of fewer than two configurations is not enough to tell
+        if len(others) < 2:
+            return False
+
+        return score < numpy.median(others) - self.stop_margin
+
+    def run(self):
+        """
+        Train all the configurations, as many at once as there are processes, and print the results table.
+
+        :return: A list with a tuple (configuration, learning curve, status) for each configuration. The learning curve
+        is a list of rows (episode, percentage of wins against random players, percentage of wins against expert
+        players).
+        """
+
+        pending = list(range(len(self.configs)))
+        running = {}
+
+        print "%-6s %-10s %20s %20s" % ("Config", "Episodes", "RND Win Percentage", "XPT Win Percentage")
+        print "================================================================================"
+
+        while len(pending) > 0 or len(running) > 0:
+            # Start configurations while there are free processes
+            while len(pending) > 0 and len(running) < self.processes:
+                job = pending.pop(0)
+
+                running[job] = multiprocessing.Process(target=self.run_job, args=(job, ))
+                running[job].start()
+                self.status[job] = "running"
+
+            try:
+                job, row = self.queue.get(timeout=Sweep.poll_interval)
+            except Queue.Empty:
+                job = None
+
+            if job is not None:
+                self.curves[job].append(row)
+
+                print "%-6d %-10d %20.2f %20.2f" % ((job, ) + tuple(row))
+
+                # The trainer has just sent a row and is training again, not writing to the queue
+                if job in running and self.should_stop(job):
+                    running[job].terminate()
+                    running[job].join()
+                    del running[job]
+                    self.status[job] = "stopped"
+
+            for job, process in running.items():
+                if not process.is_alive():
+                    process.join()
+                    del running[job]
+                    self.status[job] = "done" if process.exitcode == 0 else "failed"
+
+        # Rows sent by the last trainers just before they ended
+        while True:
+            try:
+                job, row = self.queue.get(timeout=Sweep.poll_interval)
+            except Queue.Empty:
+                break
+
+            self.curves[job].append(row)
+
+        self.print_table()
+
+        return zip(self.configs, self.curves, self.status)
+
+    def print_table(self):
+        """
+        Print the results table: the configuration, the last row of its learning curve and its status.
+        """
+
+        names = sorted(set(name for config in self.configs for name in config))
+
+        header = " ".join("%16s" % name for name in names)
+
+        print
+        print "%-6s %s %-10s %10s %10s  %s" % ("Config", header, "Episodes", "RND Win", "XPT Win", "Status")
+
+        for job, config in enumerate(self.configs):
+            values = " ".join("%16s" % format_value(config.get(name, "-")) for name in names)
+
+            if len(self.curves[job]) > 0:
+                episode, rnd, xpt = self.curves[job][-1]
+                print "%-6d %s %-10d %10.2f %10.2f  %s" % (job, values, episode, rnd, xpt, self.status[job])
+            else:
+                print "%-6d %s %-10s %10s %10s  %s" % (job, values, "-", "-", "-", self.status[job])
+
+        print
+
+    def write_csv(self, dst_file):
+        """
+        Write all the learning curves to a CSV file (one line per row, with the configuration and its status).
+
+        :param dst_file: Name of the file.
+        """
+
+        names = sorted(set(name for config in self.configs for name in config))
+
+        with open(dst_file, "wb") as f:
+            writer = csv.writer(f)
+            writer.writerow(["config"] + names + ["episode", "rnd_win_percentage", "xpt_win_percentage", "status"])
+
+            for job, config in enumerate(self.configs):
+                for episode, rnd, xpt in self.curves[job]:
+                    writer.writerow([job] + [config.get(name, "") for name in names] +
+                                    [episode, rnd, xpt, self.status[job]])
@@ -0,0 +1,289 @@
+"""
+table_nn.py
+
+Provides a hashed table of values with the interface of a single-output neural network. Each distinct input (usually a
+coarse abstraction of the board plus an action category, see AbstractCategoryEncoder in encoders.py) has its own value.
+The values live in preallocated arrays (open addressing with a bounded number of probes), so lookups and updates take
+constant time and the memory used never exceeds a fixed budget: when the table is full, the least visited entries are
+evicted.
+"""
+
+import collections
+
+import numpy
+
+import checkpoint
+from nn import NN
+
+
+class TableNN(object):
+    """
+    Class that provides a hashed table of values with the interface of a single-output neural network.
+    """
+
+    # Features supported natively (see nn.CAPABILITIES)
+    capabilities = frozenset(["train", "sparse", "batch", "checkpoint"])
+
+    # Bytes per entry: key (int64), value (float64) and number of visits (uint32)
+    entry_bytes = 20
+
+    # Number of consecutive slots where an entry can be stored
+    max_probes = 8
+
+    # Value of the inputs that are not in the table
+    default_value = 0.0
+
+    def __init__(self, num_inputs, learning_rate, momentum, src_file=None, step_size=1.0, max_bytes=64 * 1024 * 1024):
+        """
+        Constructor for an empty table.
+
+        :param num_inputs: Number of inputs.
+        :param learning_rate: Learning rate of the table: it scales the step size by learning_rate / NN.learning_rate
+        (the step size is at most 1).
+        :param momentum: Ignored.
+        :param src_file: If None, then the table is empty. Otherwise, the table is loaded from the file (a checkpoint
+        written by TableNN.write_to_file).
+        :param step_size: Fraction of the way each update moves a value towards its target at the default learning rate
+        (NN.learning_rate). The Q-Learning players already apply their own learning rate to the targets, so by default
+        the target simply replaces the value. Like max_bytes, it is set through the backend options of NN.
+        :param max_bytes: Memory budget of the table (in bytes). A table loaded from a file (or with set_weights) is
+        also kept within the budget.
+        """
+
+        self.num_inputs = num_inputs
+        self.base_step_size = step_size
+        self.max_bytes = max_bytes
+        self.set_learning_rate(learning_rate)
+        self.allocate(self.budget_slots())
+
+        if src_file is not None:
+            arrays, metadata = checkpoint.read_checkpoint(src_file, mmap=False)
+            self.set_weights(arrays, metadata)
+
+    def set_learning_rate(self, learning_rate):
+        """
+        Change the learning rate used when training the table (the step size changes in proportion).
+
+        :param learning_rate: New learning rate.
+        """
+
+        self.learning_rate = learning_rate
+        self.step_size = min(1.0, self.base_step_size * learning_rate / NN.learning_rate)
+
+    def budget_slots(self):
+        """
+        Compute the size of the table allowed by the memory budget.
+
+        :return: The largest power of 2 of slots that fits in the budget.
+        """
+
+        num_slots = 1
+
+        while 2 * num_slots * TableNN.entry_bytes <= self.max_bytes:
+            num_slots *= 2
+
+        return num_slots
+
+    def allocate(self, num_slots):
+        """
+        Allocate an empty table.
+
+        :param num_slots: Number of slots (a power of 2).
+        """
+
+        self.mask = num_slots - 1
+
+        # Key 0 marks an empty slot
+        self.keys = numpy.zeros(num_slots, dtype=numpy.int64)
+        self.values = numpy.zeros(num_slots, dtype=numpy.float64)
+        self.visits = numpy.zeros(num_slots, dtype=numpy.uint32)
+
+        self.num_entries = 0
+        self.evictions = 0
+
+    def key(self, indices, values):
+        """
+        Compute the key of an input.
+
+        :param indices: Indices of the non-zero inputs (as a list, in any order).
+        :param values: Values of the non-zero inputs (as a list).
+        :return: A non-zero 63-bit integer.
+        """
+
+        # Values are rounded so that float32 and float64 versions of the same input have the same key
+        items = sorted(zip(indices, [round(v, 6) for v in values]))
+
+        return (hash(tuple(items)) & 0x7fffffffffffffff) or 1
+
+    def find(self, key, insert=False):
+        """
+        Find the slot of a key.
+
+        :param key: A key returned by TableNN.key(...).
+        :param insert: If True and the key is not in the table, store it (with the default value) in an empty slot or,
+        if there is none, in place of the least visited entry among the slots where it can be stored.
+        :return: The index of the slot, or None if the key is not in the table (and insert is False).
+        """
+
+        first = key & self.mask
+        victim = None
+
+        for probe in range(TableNN.max_probes):
+            slot = (first + probe) & self.mask
+            slot_key = self.keys[slot]
+
+            if slot_key == key:
+                return slot
+
+            if slot_key == 0:
+                if not insert:
+                    return None
+
+                self.num_entries += 1
+                victim = slot
+                break
+
+            if victim is None or self.visits[slot] < self.visits[victim]:
+                victim = slot
+
+        if not insert:
+            return None
+
+        if self.keys[victim] != 0:
+            self.evictions += 1
+
+        self.keys[victim] = key
+        self.values[victim] = TableNN.default_value
+        self.visits[victim] = 0
+
+        return victim
+
+    def get_weights(self):
+        """
+        Get a copy of the table (see checkpoint.py).
+
+        :return: A tuple (arrays, metadata): arrays is an ordered dictionary with the keys, values and visits of the
+        slots.
+        """
+
+        arrays = collections.OrderedDict()
+        arrays["keys"] = self.keys.copy()
+        arrays["values"] = self.values.copy()
+        arrays["visits"] = self.visits.copy()
+
+        return arrays, {"num_entries": self.num_entries}
+
+    def set_weights(self, arrays, metadata):
+        """
+        Replace the table. If the size of the given table is not the one allowed by the memory budget, its entries are
+        stored again in a table of the right size (when it is smaller, the least visited entries are evicted).
+
+        :param arrays: Arrays returned by TableNN.get_weights() (or read from a checkpoint).
+        :param metadata: Metadata returned by TableNN.get_weights() (or read from a checkpoint).
+        """
+
+        if "keys" not in arrays:
+            raise ValueError("The arrays do not contain a table")
+
+        self.allocate(self.budget_slots())
+
+        if len(arrays["keys"]) == len(self.keys):
+            self.keys[:] = arrays["keys"]
+            self.values[:] = arrays["values"]
+            self.visits[:] = arrays["visits"]
+            self.num_entries = int(numpy.count_nonzero(self.keys))
+            return
+
+        # The most visited entries are stored last, so they evict the others when there is no room for all of them
+        keys = numpy.asarray(arrays["keys"])
+        values = numpy.asarray(arrays["values"])
+        visits = numpy.asarray(arrays["visits"])
+        occupied = numpy.flatnonzero(keys)
+
+        for i in occupied[numpy.argsort(visits[occupied], kind="mergesort")]:
+            slot = self.find(int(keys[i]), insert=True)
+            self.values[slot] = values[i]
+            self.visits[slot] = visits[i]
+
+    def write_to_file(self, dst_file):
+        """
+        Write the table to a file (as a checkpoint).
+
+        :param dst_file: Name of the file where to write the table.
+        """
+
+        arrays, metadata = self.get_weights()
+        metadata["num_inputs"] = self.num_inputs
+
+        checkpoint.write_checkpoint(dst_file, arrays, metadata)
+
+    def train_with_datapoint(self, inputs, target):
+        """
+        Move the value of an input towards a target.
+
+        :param inputs: Inputs (as a list).
+        :param target: Target output (as a number).
+        """
+
+        indices = numpy.flatnonzero(inputs)
+        self.train_with_sparse_datapoint(indices.tolist(), [inputs[i] for i in indices], target)
+
+    def train_with_sparse_datapoint(self, indices, values, target):
+        """
+        Move the value of an input given in sparse form towards a target.
+
+        :param indices: Indices of the non-zero inputs (as a list).
+        :param values: Values of the non-zero inputs (as a list).
+        :param target: Target output (as a number).
+        """
+
+        slot = self.find(self.key(indices, values), insert=True)
+
+        self.values[slot] += self.step_size * (target - self.values[slot])
+        self.visits[slot] += 1
+
+    def evaluate(self, inputs):
+        """
+        Get the value of an input.
+
+        :param inputs: Inputs (as a list).
+        :return: The value (as a number).
+        """
+
+        indices = numpy.flatnonzero(inputs)
+
+        return self.evaluate_sparse(indices.tolist(), [inputs[i] for i in indices])
+
+    def evaluate_batch(self, rows):
+        """
+        Get the values of a batch of inputs.
+
+        :param rows: An array with one row of inputs per data point.
+        :return: The values (as a list of numbers).
+        """
+
+        # The non-zero inputs of all the rows are found at once (one row after the other)
+        rows = numpy.asarray(rows)
+        row_ids, indices = numpy.nonzero(rows)
+        values = rows[row_ids, indices].tolist()
+        bounds = numpy.searchsorted(row_ids, numpy.arange(len(rows) + 1)).tolist()
+        indices = indices.tolist()
+
+        return [self.evaluate_sparse(indices[bounds[r]:bounds[r + 1]], values[bounds[r]:bounds[r + 1]])
+                for r in range(len(rows))]
+
+    def evaluate_sparse(self, indices, values):
+        """
+        Get the value of an input given in sparse form.
+
+        :param indices: Indices of the non-zero inputs (as a list).
+        :param values: Values of the non-zero inputs (as a list).
+        :return: The value (as a number).
+        """
+
+        slot = self.find(self.key(indices, values))
+
+        if slot is None:
+            return TableNN.default_value
+
+        return float(self.values[slot])
@@ -0,0 +1,98 @@
+"""
+target_nn.py
+
+Provides a target network: a frozen copy of a neural network that is being trained, used only to compute the bootstrap
+targets of the Q-Learning updates. The copy is refreshed every few updates of the original network. Between refreshes
+its outputs never change, so they are cached by position and most bootstrap targets become cache lookups.
+"""
+
+from nn import NN
+
+
+class TargetNetwork(object):
+    """
+    Class that keeps a periodically refreshed copy of a neural network.
+    """
+
+    def __init__(self, nn, update_every=1000, cache_bytes=64 * 1024 * 1024):
+        """
+        Construct a new target network (a copy of the current weights of nn).
+
+        :param nn: The neural network being trained (NN). Its backend must support checkpoints (see NN.supports).
+        :param update_every: Number of training updates of nn between refreshes of the copy.
+        :param cache_bytes: Memory budget (in bytes) for the cache of outputs of the copy.
+        """
+
+        if not nn.supports("checkpoint"):
+            raise ValueError("The " + nn.backend + " backend cannot be copied to a target network")
+
+        self.nn = nn
+        self.update_every = update_every
+
+        self.target = NN(nn.num_inputs, None, nn.backend, nn.encoder.name, backend_options=nn.backend_options)
+        self.target.enable_cache(cache_bytes)
+
+        # Version of nn the copy was made from (see NN.version)
+        self.synced_version = None
+        self.refreshes = 0
+
+        self.refresh()
+
+    def refresh(self):
+        """
+        Copy the current weights of the neural network (the cached outputs are discarded).
+        """
+
+        arrays, metadata = self.nn.get_weights()
+        self.target.set_weights(arrays, metadata)
+
+        self.synced_version = self.nn.version
+        self.refreshes += 1
+
+    def refresh_if_needed(self):
+        """
+        Refresh the copy if the neural network was trained update_every times since the last refresh.
+        """
+
+        if self.nn.version - self.synced_version >= self.update_every:
+            self.refresh()
+
+    def get_state(self):
+        """
+        Get a snapshot of the copy (see QLTrainer.get_state).
+
+        :return: A tuple (arrays, metadata) from NN.get_state(), with the version the copy was made from and the number
+        of refreshes added to the metadata.
+        """
+
+        arrays, metadata = self.target.get_state()
+        metadata["synced_version"] = self.synced_version
+        metadata["refreshes"] = self.refreshes
+
+        return arrays, metadata
+
+    def set_state(self, arrays, metadata):
+        """
+        Restore a snapshot taken with TargetNetwork.get_state().
+
+        :param arrays: Arrays returned by TargetNetwork.get_state() (or read from a checkpoint).
+        :param metadata: Metadata returned by TargetNetwork.get_state() (or read from a checkpoint).
+        """
+
+        self.target.set_state(arrays, metadata)
+        self.synced_version = metadata["synced_version"]
+        self.refreshes = metadata["refreshes"]
+
+    def successor_values(self, player, packed, successors, afterstate):
+        """
+        Evaluate a list of successors with the copy from the perspective of the player who would move (see
+        QLPlayer.successor_values). The successors that are not cached are evaluated together (see NN.evaluate_keys).
+
+        :param player: The player who would move.
+        :param packed: The board the successors come from, packed by player.pack_board_state(...).
+        :param successors: The successors to evaluate (see Player.get_next_states).
+        :param afterstate: If True, evaluate the boards reached by the successors. Otherwise, evaluate the actions.
+        :return: A list with the value of each successor.
+        """
+
+        return self.target.evaluate_keys(*player.successor_inputs(packed, successors, afterstate))
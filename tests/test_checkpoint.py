@@ -0,0 +1,83 @@
+"""
+test_checkpoint.py
+
+Round-trip tests of the binary checkpoint format (see checkpoint.py). Run them from the repository root with
+python -m unittest discover tests.
+"""
+
+import collections
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import checkpoint
+
+
+class CheckpointRoundTripTest(unittest.TestCase):
+    """
+    Class that writes checkpoints and reads them back.
+    """
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.file = os.path.join(self.dir, "test.nn")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_metadata_lengths(self):
+        """
+        The arrays are read back intact whatever the length of the description (its length crosses several alignment
+        boundaries).
+        """
+
+        rng = numpy.random.RandomState(0)
+        arrays = collections.OrderedDict([("w1", rng.uniform(-1, 1, (7, 5))),
+                                         ("b1", rng.uniform(-1, 1, 5).astype(numpy.float32)),
+                                         ("steps", numpy.arange(3, dtype=numpy.int64))])
+
+        for padding in range(400):
+            metadata = {"padding": "x" * padding}
+
+            for mmap in (True, False):
+                checkpoint.write_checkpoint(self.file, arrays, metadata)
+                read_arrays, read_metadata = checkpoint.read_checkpoint(self.file, mmap=mmap)
+
+                self.assertEqual(read_metadata, metadata)
+                self.assertEqual(list(read_arrays.keys()), list(arrays.keys()))
+
+                for name in arrays:
+                    self.assertEqual(read_arrays[name].dtype, arrays[name].dtype)
+                    self.assertTrue(numpy.array_equal(read_arrays[name], arrays[name]), (padding, name))
+
+                del read_arrays
+
+    def test_interrupted_write(self):
+        """
+        A write interrupted by KeyboardInterrupt leaves neither the checkpoint nor a temporary file behind.
+        """
+
+        fsync = os.fsync
+
+        def interrupt(fd):
+            raise KeyboardInterrupt()
+
+        os.fsync = interrupt
+
+        try:
+            self.assertRaises(KeyboardInterrupt, checkpoint.write_checkpoint, self.file,
+                              collections.OrderedDict([("w", numpy.zeros(3))]))
+        finally:
+            os.fsync = fsync
+
+        self.assertEqual(os.listdir(self.dir), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
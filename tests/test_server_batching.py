@@ -0,0 +1,61 @@
+"""
+test_server_batching.py
+
+Tests of the requests the Q-Learning players send to an inference server (see inference_server.py). Run them from the
+repository root with python -m unittest discover tests.
+"""
+
+import os
+import random
+import sys
+import unittest
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from inference_server import InferenceServer
+from nn import NN
+from ql_trainer import QLTrainer
+
+
+class ServerBatchingTest(unittest.TestCase):
+    """
+    Class that plays test games with the "server" backend and counts the rows of each request.
+    """
+
+    def setUp(self):
+        random.seed(0)
+        numpy.random.seed(0)
+
+        self.local = NN(238, None, "numpy")
+        self.server = InferenceServer(self.local)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_successors_in_one_request(self):
+        """
+        The successors of a decision are evaluated in a single request, and their values are those of the network of
+        the server.
+        """
+
+        trainer = QLTrainer(20, None, nn_backend="server")
+
+        random.seed(1)
+        local_wins = trainer.test(5, "1_QL_AGAINST_3_RANDOM", self.local)
+
+        random.seed(1)
+        server_wins = trainer.test(5, "1_QL_AGAINST_3_RANDOM")
+
+        self.assertEqual(server_wins, local_wins)
+
+        # Most decisions have several successors (one request per successor would carry a single row each)
+        stats = self.server.stats()
+        self.assertGreater(stats["requests"], 0)
+        self.assertGreater(float(stats["rows"]) / stats["requests"], 1.5)
+
+
+if __name__ == "__main__":
+    unittest.main()